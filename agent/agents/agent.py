@@ -1,15 +1,217 @@
 import asyncio
+import inspect
+import logging
+import threading
 import livekit
-from collections.abc import Callable, Awaitable
+from collections import deque
+from collections.abc import Callable, Awaitable, Hashable
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from services.metrics import registry
+from services.transcription import (Transcriber, EVENT_TYPE_NO_SPEECH, EVENT_TYPE_TALKING_FINISHED,
+                                    EVENT_TYPE_TALKING_STARTED, EVENT_TYPE_TALKING_UPDATED)
+from .streams import StreamManager
+from .transcripts import TranscriptPublisher
 
 Should_Process_CB = Callable[[livekit.TrackPublication, livekit.Participant], Awaitable[bool]]
 
+TOPIC_TRANSCRIPTION = "transcription"
+TOPIC_DATA = "data"
+# Enough for a few seconds of transcripts from every participant, a consumer further behind loses the oldest
+DEFAULT_QUEUE_SIZE = 256
+
+events_published_total = registry.counter("agent_events_published", "Events published on agent buses",
+                                          labelnames=("topic",))
+events_coalesced_total = registry.counter("agent_events_coalesced",
+                                          "Queued events replaced by a newer one before they were handled",
+                                          labelnames=("topic",))
+events_dropped_total = registry.counter("agent_events_dropped", "Events dropped from a full subscriber queue",
+                                        labelnames=("topic",))
+handoff_batch_size = registry.histogram("agent_event_handoff_batch_size",
+                                        "Events handed from other threads to the event loop at once",
+                                        buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+
+
+@dataclass
+class AgentEvent:
+    topic: str
+    data: Any
+    participant: Optional[livekit.Participant] = None
+    # A queued event with the same key is superseded by this one instead of both being handled
+    coalesce_key: Optional[Hashable] = None
+    # Never dropped from a full queue, for events like the start and end of a turn that nothing else stands in for
+    essential: bool = False
+
+
+class Subscription:
+    """A subscriber's bounded queue of events, iterate it to receive them.
+
+    An event with a coalesce_key supersedes the queued one with the same
+    key, which is removed, and joins the back of the queue so it stays
+    behind everything published before it. When the queue is full the
+    oldest coalescable event is dropped to make room, or else the oldest
+    event that isn't essential, so publishing never waits on a slow
+    subscriber. A queue of nothing but essential events grows past maxsize.
+    """
+
+    def __init__(self, bus: "EventBus", topics: Optional[frozenset[str]], maxsize: int):
+        self._bus = bus
+        self._topics = topics
+        self._maxsize = maxsize
+        # Cells are one item lists, a superseded or dropped event's cell is emptied in place
+        # rather than searched for and removed, and skipped when it comes up
+        self._queue: deque[list] = deque()
+        self._size = 0
+        self._by_key: dict[Hashable, list] = {}
+        self._ready = asyncio.Event()
+        self.closed = False
+        self.coalesced = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self._size
+
+    def wants(self, event: AgentEvent) -> bool:
+        return self._topics is None or event.topic in self._topics
+
+    def put(self, event: AgentEvent):
+        if event.coalesce_key is not None:
+            cell = self._by_key.pop(event.coalesce_key, None)
+            if cell is not None:
+                self._empty(cell)
+                self.coalesced += 1
+                events_coalesced_total.inc(topic=event.topic)
+
+        if self._size >= self._maxsize:
+            self._drop_one()
+        cell = [event]
+        self._queue.append(cell)
+        self._size += 1
+        if event.coalesce_key is not None:
+            self._by_key[event.coalesce_key] = cell
+        self._ready.set()
+
+    def get_nowait(self) -> Optional[AgentEvent]:
+        while self._queue:
+            event = self._release(self._queue.popleft())
+            if event is not None:
+                return event
+        return None
+
+    def close(self):
+        self.closed = True
+        self._bus.unsubscribe(self)
+        self._ready.set()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> AgentEvent:
+        while True:
+            event = self.get_nowait()
+            if event is not None:
+                return event
+            if self.closed:
+                raise StopAsyncIteration
+            self._ready.clear()
+            await self._ready.wait()
+
+    def _release(self, cell: list) -> Optional[AgentEvent]:
+        event = cell[0]
+        if event is None:
+            return None
+        self._size -= 1
+        if event.coalesce_key is not None and self._by_key.get(event.coalesce_key) is cell:
+            del self._by_key[event.coalesce_key]
+        return event
+
+    def _empty(self, cell: list):
+        cell[0] = None
+        self._size -= 1
+        # Emptied cells are only cleared as they're reached, compact once they outnumber the live ones
+        if len(self._queue) > 2 * self._size + 16:
+            self._queue = deque(c for c in self._queue if c[0] is not None)
+
+    def _drop_one(self):
+        victim = None
+        for cell in self._queue:
+            event = cell[0]
+            if event is None or event.essential:
+                continue
+            if event.coalesce_key is not None:
+                victim = cell
+                break
+            if victim is None:
+                victim = cell
+        if victim is None:
+            return
+        event = victim[0]
+        if event.coalesce_key is not None and self._by_key.get(event.coalesce_key) is victim:
+            del self._by_key[event.coalesce_key]
+        self._empty(victim)
+        self.dropped += 1
+        events_dropped_total.inc(topic=event.topic)
+
+
+class EventBus:
+    """Fans agent events out to any number of subscribers on the agent's loop.
+
+    publish() is for the loop's own thread. Other threads, like transcribers,
+    use publish_threadsafe(), which batches whatever they publish until the
+    loop picks it up, so a burst of events costs one wakeup rather than one
+    each.
+    """
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self._loop = loop or asyncio.get_event_loop()
+        self._subscriptions: list[Subscription] = []
+        self._pending: list[AgentEvent] = []
+        self._pending_lock = threading.Lock()
+        self._handoff_scheduled = False
+
+    def subscribe(self, topics: Optional[tuple[str, ...]] = None, maxsize: int = DEFAULT_QUEUE_SIZE) -> Subscription:
+        subscription = Subscription(self, frozenset(topics) if topics is not None else None, maxsize)
+        self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        if subscription in self._subscriptions:
+            self._subscriptions.remove(subscription)
+
+    def publish(self, event: AgentEvent):
+        events_published_total.inc(topic=event.topic)
+        for subscription in self._subscriptions:
+            if subscription.wants(event):
+                subscription.put(event)
+
+    def publish_threadsafe(self, event: AgentEvent):
+        with self._pending_lock:
+            self._pending.append(event)
+            if self._handoff_scheduled:
+                return
+            self._handoff_scheduled = True
+        self._loop.call_soon_threadsafe(self._handoff)
+
+    def _handoff(self):
+        with self._pending_lock:
+            events, self._pending = self._pending, []
+            self._handoff_scheduled = False
+        handoff_batch_size.observe(len(events))
+        for event in events:
+            self.publish(event)
+
+
 class Agent:
     def __init__(self, *_, participant: livekit.LocalParticipant, room: livekit.Room):
         self.participant = participant
         self.room = room
+        self.events = EventBus()
+        self.streams = StreamManager()
+        self._subscriber_tasks: set[asyncio.Task] = set()
+        self._transcripts: Optional[TranscriptPublisher] = None
         self.room.on("participant_connected", self._on_participant_connected_or_disconnected)
-        self.room.on("participant_disconnected", self._on_participant_connected_or_disconnected)
+        self.room.on("participant_disconnected", self._on_participant_disconnected)
         self.room.on("track_subscribed", self._on_track_subscribed)
         self.room.on("track_unsubscribed", self._on_track_unsubscribed)
         self.room.on("track_published", self._on_track_published)
@@ -18,13 +220,62 @@ class Agent:
         self.should_process_cb = None
 
         self._handle_existing_tracks()
-        self.audio_streams = []
-        self.video_streams = []
-        self.stream_tasks = set()
 
     async def cleanup(self):
+        self.streams.stop_all()
+        for task in self._subscriber_tasks:
+            task.cancel()
+        if self._transcripts is not None:
+            await self._transcripts.stop()
         await self.room.disconnect()
 
+    def subscribe(self,
+                  callback: Callable[[AgentEvent], Any],
+                  topics: Optional[tuple[str, ...]] = None,
+                  maxsize: int = DEFAULT_QUEUE_SIZE) -> Subscription:
+        """Calls callback, which may be a coroutine function, with each event on topics in order."""
+        subscription = self.events.subscribe(topics, maxsize)
+        task = asyncio.create_task(self._dispatch(subscription, callback))
+        self._subscriber_tasks.add(task)
+        task.add_done_callback(self._subscriber_tasks.discard)
+        return subscription
+
+    async def _dispatch(self, subscription: Subscription, callback: Callable[[AgentEvent], Any]):
+        try:
+            async for event in subscription:
+                try:
+                    result = callback(event)
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception:
+                    logging.exception("Event subscriber failed on %s", event.topic)
+        finally:
+            subscription.close()
+
+    def transcription_publisher(self, participant: livekit.Participant) -> Callable[[Transcriber.Event], None]:
+        """A Transcriber callback that publishes its events from the transcriber's thread.
+        Superseded updates of a monologue and repeated no speech steps are coalesced,
+        the start and end of a monologue are never dropped."""
+        def publish(event: Transcriber.Event):
+            key = None
+            if event.type == EVENT_TYPE_TALKING_UPDATED:
+                key = (participant.sid, event.id)
+            elif event.type == EVENT_TYPE_NO_SPEECH:
+                key = (participant.sid, EVENT_TYPE_NO_SPEECH)
+            essential = event.type in (EVENT_TYPE_TALKING_STARTED, EVENT_TYPE_TALKING_FINISHED)
+            self.events.publish_threadsafe(AgentEvent(topic=TOPIC_TRANSCRIPTION, data=event, participant=participant,
+                                                      coalesce_key=key, essential=essential))
+        return publish
+
+    def publish_transcripts(self) -> TranscriptPublisher:
+        """Sends the transcriptions published on the bus to everyone in the room as well."""
+        if self._transcripts is None:
+            self._transcripts = TranscriptPublisher(self.room.local_participant)
+            self._transcripts.start()
+            self.subscribe(lambda event: self._transcripts.push(event.data, event.participant),
+                           topics=(TOPIC_TRANSCRIPTION,))
+        return self._transcripts
+
     def _handle_existing_tracks(self):
         for participantKey in self.participants:
             for publicationKey in self.participants[participantKey].tracks:
@@ -47,6 +298,10 @@ class Agent:
         self.participants = self.room.participants
         self.on_participants_changed(self.participants)
 
+    def _on_participant_disconnected(self, participant: livekit.RemoteParticipant):
+        self.streams.remove_participant(participant.sid)
+        self._on_participant_connected_or_disconnected(participant)
+
     def _on_track_published(self, publication: livekit.RemoteTrackPublication, participant: livekit.Participant):
         # Don't do anything for our own tracks
         if participant.sid == self.participant.sid:
@@ -61,9 +316,8 @@ class Agent:
         elif publication.kind == 2:
             self.on_video_track(track, participant)
 
-    def _on_track_unsubscribed(self, publication: livekit.RemoteTrackPublication, participant: livekit.RemoteParticipant):
-        self.audio_streams = [stream for stream in self.audio_streams if stream.track.sid != publication.track_sid]
-        self.video_streams = [stream for stream in self.video_streams if stream.track.sid != publication.track_sid]
+    def _on_track_unsubscribed(self, track: livekit.Track, publication: livekit.RemoteTrackPublication, participant: livekit.RemoteParticipant):
+        self.streams.remove(publication.track_sid)
 
     def _on_data_received(self, data: bytearray, kind, participant: livekit.RemoteParticipant):
-        print(data, self.participant.identity)
\ No newline at end of file
+        self.events.publish(AgentEvent(topic=TOPIC_DATA, data=bytes(data), participant=participant))
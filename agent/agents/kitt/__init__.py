@@ -4,4 +4,6 @@ from .states import (State,
                      State_DoingNothing,
                      State_Listening,
                      State_GeneratingResponse,
+                     State_SpeakingResponse,
+                     can_transition,
                      )
\ No newline at end of file
@@ -1,28 +1,66 @@
 import logging
 import asyncio
+import os
 import livekit
 import services.transcription as transcription
 import services.tts as tts
+from typing import Optional
 from . import states
+from .speculation import Speculation, SpeculationStats, should_speculate
 
 from services.openai.chatgpt import (ChatGPT, Message, MessageRole)
-from agents.agent import Agent
+from services.openai.response_cache import ResponseCache
+from services.metrics import (STAGE_ENDPOINT, STAGE_FINAL_TRANSCRIPT, STAGE_LLM_FIRST_TOKEN, STAGE_LLM_REQUEST,
+                              TurnTrace)
+from agents.agent import Agent, AgentEvent, TOPIC_TRANSCRIPTION
 
 PROMPT = "You are KITT, a voice assistant in a meeting created by LiveKit. \
           Keep your responses concise while still being friendly and personable. \
           If your response is a question, please append a question mark symbol to the end of it."
+# Kitt cares more about response latency than transcript accuracy, so it can run a smaller model than the default
+TRANSCRIPTION_MODEL = os.environ.get("KITT_TRANSCRIPTION_MODEL", transcription.DEFAULT_MODEL)
+# Start generating from partial transcripts while the caller is still talking
+SPECULATIVE = os.environ.get("KITT_SPECULATIVE", "1") == "1"
+# Said when a caller joins, synthesized once at start and played from the TTS cache
+GREETING = os.environ.get("KITT_GREETING", "Hi, I'm KITT. How can I help?")
 
 
 class Kitt(Agent):
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, stream_factory=livekit.AudioStream, **kwargs):
         super().__init__(*args, **kwargs)
+        self._stream_factory = stream_factory
         self.state: states.State = states.State_DoingNothing()
-        self.chat_gpt = ChatGPT(prompt=PROMPT, message_capacity=20)
+        self.chat_gpt = ChatGPT(prompt=PROMPT, max_history_tokens=1500, summarize=True,
+                               cache=ResponseCache())
+        self.speculation_stats = SpeculationStats()
+        self._speculation: Optional[Speculation] = None
+        self._committed_tokens = None
+        self._response_task: Optional[asyncio.Task] = None
+        # Text of the response in flight that has been sent to TTS
+        self._response_text = ""
+        self._trace: Optional[TurnTrace] = None
+        self.subscribe(self._on_transcription, topics=(TOPIC_TRANSCRIPTION,))
+        self.publish_transcripts()
         self.source = livekit.AudioSource(44100, 1)
         self.track = livekit.LocalAudioTrack.create_audio_track('kitt-audio', self.source)
-        self.tts = tts.TTS(self.source, 44100, 1)
+        self.tts = tts.TTS(self.source, 44100, 1, cache=tts.AudioCache(directory=os.environ.get("TTS_CACHE_DIR")))
         asyncio.create_task(self.publish_audio())
+        # Resolves the voice and opens TTS sessions before anyone speaks
+        asyncio.create_task(self.tts.start())
+        self._greeting_ready = asyncio.create_task(self.tts.prefetch([GREETING])) if GREETING else None
+
+    async def cleanup(self):
+        if self._greeting_ready is not None:
+            self._greeting_ready.cancel()
+        if self._speculation is not None:
+            self._speculation.cancel()
+            self._speculation = None
+        if self._response_task is not None:
+            self._response_task.cancel()
+            self._response_task = None
+        await self.tts.close()
+        await super().cleanup()
 
     async def publish_audio(self):
         options = livekit.TrackPublishOptions()
@@ -37,50 +75,152 @@ class Kitt(Agent):
         if participant.identity != "caller":
             return
 
-        def transcriber_cb(event: transcription.Transcriber.Event):
-            self._transcriber_cb(event, participant)
+        greet = len(self.streams) == 0
+        pipeline = self.streams.add(track.sid, participant,
+                                    lambda: transcription.Transcriber(audio_track=track,
+                                                                      callback=self.transcription_publisher(participant),
+                                                                      thread_callback=True,
+                                                                      model_name=TRANSCRIPTION_MODEL,
+                                                                      stream_factory=self._stream_factory))
+        if greet and pipeline is not None and self._greeting_ready is not None:
+            asyncio.create_task(self._greet())
+
+    async def _greet(self):
+        try:
+            await self._greeting_ready
+        except Exception:
+            logging.warning("Couldn't synthesize the greeting", exc_info=True)
+            return
+        # Only from the cache, there's no session open to synthesize it on and the caller may already be talking
+        if self.state.type == states.StateType.DOING_NOTHING and await self.tts.play_cached(GREETING):
+            self.chat_gpt.add_message(Message(role=MessageRole.assistant, content=GREETING))
 
-        transcriber = transcription.Transcriber(audio_track=track, callback=transcriber_cb)
-        transcriber.start()
+    def _on_transcription(self, event: AgentEvent):
+        self._transcriber_cb(event.data, event.participant)
 
     def _transcriber_cb(self, event: transcription.Transcriber.Event, participant: livekit.Participant):
         if event.type == transcription.EVENT_TYPE_TALKING_STARTED:
-            if self.state.type == states.StateType.DOING_NOTHING:
+            if self.state.type != states.StateType.LISTENING:
+                # Talking over a response interrupts it
                 self._set_state(states.State_Listening())
         elif event.type == transcription.EVENT_TYPE_TALKING_UPDATED:
-            pass
+            if SPECULATIVE and self.state.type == states.StateType.LISTENING:
+                self._speculate(event.text)
+        elif event.type == transcription.EVENT_TYPE_TALKING_LIKELY_FINISHED:
+            # The text is complete up to the pause, so a response started now is likely to be the one used
+            if SPECULATIVE and self.state.type == states.StateType.LISTENING:
+                self._speculate(event.text)
         elif event.type == transcription.EVENT_TYPE_TALKING_FINISHED:
+            listening = self.state.type == states.StateType.LISTENING
+            self._resolve_speculation(event.text, use=listening)
             self.chat_gpt.add_message(Message(role=MessageRole.user, content=event.text))
-            if self.state.type == states.StateType.LISTENING:
+            if listening:
+                # Every caller is "caller", the sid tells turns in different rooms apart
+                self._trace = TurnTrace(f"{participant.sid}-{event.id}", speech_end=event.speech_end)
+                self._trace.mark(STAGE_ENDPOINT, at=event.endpointed)
+                self._trace.mark(STAGE_FINAL_TRANSCRIPT, at=event.created)
                 self._set_state(states.State_GeneratingResponse())
         elif event.type == transcription.EVENT_TYPE_NO_SPEECH:
             pass
 
+    def _speculate(self, text: str):
+        if not should_speculate(text, self._speculation):
+            return
+        if self._speculation is not None:
+            self._speculation.cancel()
+        tokens, cache_answer = self.chat_gpt.speculate(model='gpt-3.5-turbo',
+                                                       pending=Message(role=MessageRole.user, content=text))
+        self._speculation = Speculation(text, tokens, self.speculation_stats, on_commit=cache_answer)
+
+    def _resolve_speculation(self, text: str, use: bool):
+        speculation, self._speculation = self._speculation, None
+        if speculation is None:
+            return
+        if use and speculation.matches(text):
+            self._committed_tokens = speculation.commit()
+        else:
+            speculation.cancel()
+        logging.info(self.speculation_stats)
+
     def _set_state(self, state: states.State):
-        if state.type == states.StateType.DOING_NOTHING:
-            pass
-        elif state.type == states.StateType.LISTENING:
+        if not states.can_transition(self.state.type, state.type):
+            logging.warning("Unexpected state transition %s -> %s", self.state.type.name, state.type.name)
+            return
+
+        previous = self.state
+        self.state = state
+        if state.type == states.StateType.LISTENING:
+            if previous.type in (states.StateType.GENERATING_RESPONSE, states.StateType.SPEAKING_RESPONSE):
+                self._interrupt_response()
+            else:
+                # Talking over the greeting cuts it off
+                self.tts.flush()
             asyncio.create_task(self.tts.warmup())
         elif state.type == states.StateType.GENERATING_RESPONSE:
-            if self.state.type != states.StateType.LISTENING:
-                logging.warning("Unexpected state transition")
-                return
-            asyncio.create_task(self._state_generating_response())
+            self._response_task = asyncio.create_task(self._state_generating_response())
 
-        self.state = state
+    def _interrupt_response(self):
+        """Stops generating and speaking, only what the caller heard goes into the history."""
+        # Queued audio goes before the next frame, the rest of the teardown can wait
+        self.tts.flush()
+        spoken = self.tts.spoken_text(self._response_text)
+        self._response_text = ""
+        if self._response_task is not None:
+            self._response_task.cancel()
+            self._response_task = None
+        asyncio.create_task(self.tts.interrupt())
+        if self._trace is not None:
+            self._trace.finish("interrupted")
+            self._trace = None
+
+        logging.info("Interrupted, spoken result: %s", spoken)
+        if spoken:
+            self.chat_gpt.add_message(Message(role=MessageRole.assistant, content=spoken))
 
     async def _state_generating_response(self):
         text_queue = asyncio.Queue()
-        asyncio.create_task(self.tts.stream_generate_audio(text_queue=text_queue))
+        trace = self._trace
+        tts_task = asyncio.create_task(self.tts.stream_generate_audio(text_queue=text_queue, trace=trace))
+        # Tokens go to TTS in phrase sized chunks instead of one message per token
+        chunker = tts.TextChunker()
         full_result = ""
-        async for chunk in self.chat_gpt.generate_text_streamed(model='gpt-3.5-turbo'):
-            await text_queue.put(chunk)
-            full_result += chunk
+        tokens, self._committed_tokens = self._committed_tokens, None
+        if tokens is None:
+            tokens = self.chat_gpt.generate_text_streamed(model='gpt-3.5-turbo')
+        if trace is not None:
+            # A speculative request was sent earlier, this is when the turn starts waiting on it
+            trace.mark(STAGE_LLM_REQUEST)
+        try:
+            async for token in tokens:
+                if trace is not None:
+                    trace.mark(STAGE_LLM_FIRST_TOKEN)
+                full_result += token
+                for chunk in chunker.push(token):
+                    self._response_text += chunk + " "
+                    await text_queue.put(chunk)
+
+            last_chunk = chunker.flush()
+            if last_chunk is not None:
+                self._response_text += last_chunk
+                await text_queue.put(last_chunk)
+
+            # Signal that we are done sending text
+            await text_queue.put(None)
+            self._set_state(states.State_SpeakingResponse())
+            await self.tts.wait_until_done()
+        except asyncio.CancelledError:
+            # Barge-in, closing the stream stops the OpenAI request
+            tts_task.cancel()
+            await tokens.aclose()
+            raise
 
-        # Signal that we are done sending text
-        await text_queue.put(None)
-        print("full result", full_result)
+        logging.info("Full result: %s", full_result)
         self.chat_gpt.add_message(Message(role=MessageRole.assistant, content=full_result))
+        if trace is not None:
+            trace.finish("completed")
+            self._trace = None
+        self._response_text = ""
+        self._response_task = None
         self._set_state(states.State_DoingNothing())
 
     def should_process(
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import re
+from collections.abc import AsyncIterator, Awaitable, Callable
+from typing import Optional
+
+# Partial transcripts shorter than this change too much to be worth a request
+MIN_WORDS = 3
+
+_PUNCTUATION = re.compile(r"[^\w\s']")
+
+
+def normalize_transcript(text: str) -> str:
+    return " ".join(_PUNCTUATION.sub(" ", text).lower().split())
+
+
+class SpeculationStats:
+    def __init__(self):
+        self.started = 0
+        self.hits = 0
+        self.misses = 0
+        self.tokens_generated = 0
+        self.tokens_wasted = 0
+
+    @property
+    def hit_rate(self) -> float:
+        resolved = self.hits + self.misses
+        return self.hits / resolved if resolved else 0.0
+
+    def __str__(self):
+        return (f"speculation hit rate {self.hit_rate:.0%} ({self.hits}/{self.hits + self.misses}), "
+                f"{self.tokens_wasted}/{self.tokens_generated} tokens wasted")
+
+
+class Speculation:
+    """An LLM response generated from a partial transcript while the user is
+    still talking.
+
+    Tokens are buffered, not spoken, until the final transcript arrives. If
+    it still matches the transcript the speculation started from, stream()
+    replays the buffered tokens and follows the live generation, otherwise
+    the generation is cancelled and its tokens are counted as wasted.
+    on_commit gets the whole answer once it's both committed and complete,
+    a cancelled or cut short one is never passed on.
+    """
+
+    def __init__(self, transcript: str, tokens: AsyncIterator[str], stats: SpeculationStats,
+                 on_commit: Optional[Callable[[str], Awaitable[None]]] = None):
+        self.transcript = transcript
+        self.key = normalize_transcript(transcript)
+        self._stats = stats
+        self._on_commit = on_commit
+        self._tokens: [str] = []
+        self._done = False
+        self._complete = False
+        self._committed = False
+        self._token_available = asyncio.Event()
+        self._task = asyncio.create_task(self._generate(tokens))
+        stats.started += 1
+
+    def matches(self, transcript: str) -> bool:
+        return self.key == normalize_transcript(transcript)
+
+    def commit(self) -> AsyncIterator[str]:
+        self._stats.hits += 1
+        self._committed = True
+        self._notify_commit()
+        return self._stream()
+
+    def cancel(self):
+        self._task.cancel()
+        self._stats.misses += 1
+        self._stats.tokens_wasted += len(self._tokens)
+
+    async def _generate(self, tokens: AsyncIterator[str]):
+        try:
+            async for token in tokens:
+                self._tokens.append(token)
+                self._stats.tokens_generated += 1
+                self._token_available.set()
+            self._complete = True
+            self._notify_commit()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logging.exception("Speculative generation failed")
+        finally:
+            self._done = True
+            self._token_available.set()
+
+    def _notify_commit(self):
+        if self._committed and self._complete and self._on_commit is not None:
+            on_commit, self._on_commit = self._on_commit, None
+            asyncio.create_task(on_commit("".join(self._tokens)))
+
+    async def _stream(self) -> AsyncIterator[str]:
+        index = 0
+        try:
+            while True:
+                while index < len(self._tokens):
+                    yield self._tokens[index]
+                    index += 1
+                if self._done:
+                    return
+                self._token_available.clear()
+                await self._token_available.wait()
+        finally:
+            # Closing the stream early, e.g. on barge-in, stops the generation
+            self._task.cancel()
+
+
+def should_speculate(transcript: str, current: Optional[Speculation]) -> bool:
+    key = normalize_transcript(transcript)
+    if len(key.split()) < MIN_WORDS:
+        return False
+    return current is None or current.key != key
@@ -17,3 +17,18 @@ class State_Listening(State):
 @dataclass
 class State_GeneratingResponse(State):
     type = StateType.GENERATING_RESPONSE
+
+@dataclass
+class State_SpeakingResponse(State):
+    type = StateType.SPEAKING_RESPONSE
+
+# Allowed transitions, going back to LISTENING from a response is a barge-in
+TRANSITIONS = {
+    StateType.DOING_NOTHING: {StateType.LISTENING},
+    StateType.LISTENING: {StateType.GENERATING_RESPONSE, StateType.DOING_NOTHING},
+    StateType.GENERATING_RESPONSE: {StateType.SPEAKING_RESPONSE, StateType.LISTENING, StateType.DOING_NOTHING},
+    StateType.SPEAKING_RESPONSE: {StateType.DOING_NOTHING, StateType.LISTENING},
+}
+
+def can_transition(current: StateType, new: StateType) -> bool:
+    return new in TRANSITIONS[current]
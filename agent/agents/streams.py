@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from typing import Optional
+
+import livekit
+
+from services.metrics import registry
+from services.transcription import Transcriber
+
+# Tracks one agent processes at once, a room with more callers than this leaves the rest alone
+MAX_STREAMS_PER_AGENT = int(os.environ.get("AGENT_MAX_STREAMS", "8"))
+# Tracks processed at once by every agent in the process
+MAX_STREAMS_PER_PROCESS = int(os.environ.get("PROCESS_MAX_STREAMS", "64"))
+CAP_AGENT = "agent"
+CAP_PROCESS = "process"
+
+_process_streams = 0
+_process_streams_lock = threading.Lock()
+
+streams_running = registry.gauge("agent_streams", "Track processing pipelines running")
+stream_memory_bytes = registry.gauge("agent_stream_memory_bytes", "Audio buffers held by running pipelines")
+streams_rejected_total = registry.counter("agent_streams_rejected", "Tracks left unprocessed because of a cap",
+                                          labelnames=("cap",))
+
+
+def process_streams() -> int:
+    return _process_streams
+
+
+def _reserve(max_streams: int) -> bool:
+    global _process_streams
+    with _process_streams_lock:
+        if _process_streams >= max_streams:
+            return False
+        _process_streams += 1
+        return True
+
+
+def _release():
+    global _process_streams
+    with _process_streams_lock:
+        _process_streams -= 1
+
+
+@dataclass
+class Stream:
+    track_sid: str
+    participant_sid: str
+    participant_identity: str
+    pipeline: Transcriber
+    memory_bytes: int
+    started: float = field(default_factory=time.monotonic)
+    started_at: float = field(default_factory=time.time)
+
+    def to_json(self) -> dict:
+        return {"track": self.track_sid,
+                "participant": self.participant_identity,
+                # Read live, a pipeline's buffers are gone once it stops
+                "memory_bytes": self.pipeline.memory_bytes,
+                "started": self.started_at}
+
+
+class StreamManager:
+    """Owns the processing pipeline of every track an agent subscribes to.
+
+    A pipeline is created and started by add() unless the agent or the
+    process is already running as many as it's allowed, and stopped when
+    its track is unsubscribed or ends, its participant leaves or the agent
+    is cleaned up, so nothing outlives the room. Pipelines are anything with
+    start(), stop(), add_done_callback() and memory_bytes, like Transcriber.
+    """
+
+    def __init__(self, max_streams: int = MAX_STREAMS_PER_AGENT, max_process_streams: int = MAX_STREAMS_PER_PROCESS):
+        self._max_streams = max_streams
+        self._max_process_streams = max_process_streams
+        self._streams: dict[str, Stream] = {}
+
+    def __len__(self):
+        return len(self._streams)
+
+    def __contains__(self, track_sid: str) -> bool:
+        return track_sid in self._streams
+
+    def add(self, track_sid: str, participant: livekit.Participant,
+            create: Callable[[], Transcriber]) -> Optional[Transcriber]:
+        """Starts a pipeline for the track, returns it or None if a cap was reached."""
+        stream = self._streams.get(track_sid)
+        if stream is not None:
+            return stream.pipeline
+        if len(self._streams) >= self._max_streams:
+            logging.warning("Not processing track %s of %s, the agent runs %d streams already",
+                            track_sid, participant.identity, len(self._streams))
+            streams_rejected_total.inc(cap=CAP_AGENT)
+            return None
+        if not _reserve(self._max_process_streams):
+            logging.warning("Not processing track %s of %s, the process runs %d streams already",
+                            track_sid, participant.identity, process_streams())
+            streams_rejected_total.inc(cap=CAP_PROCESS)
+            return None
+
+        loop = asyncio.get_event_loop()
+        try:
+            pipeline = create()
+            # A track that ends on its own gives its slot back without waiting to be unsubscribed
+            pipeline.add_done_callback(lambda: self._call_soon(loop, self._pipeline_done, track_sid, pipeline))
+            pipeline.start()
+        except Exception:
+            _release()
+            raise
+        stream = Stream(track_sid=track_sid,
+                        participant_sid=participant.sid,
+                        participant_identity=participant.identity,
+                        pipeline=pipeline,
+                        memory_bytes=pipeline.memory_bytes)
+        self._streams[track_sid] = stream
+        streams_running.inc()
+        stream_memory_bytes.inc(stream.memory_bytes)
+        logging.info("Processing track %s of %s, %d bytes of buffers",
+                     track_sid, participant.identity, stream.memory_bytes)
+        return pipeline
+
+    def remove(self, track_sid: str) -> bool:
+        stream = self._streams.pop(track_sid, None)
+        if stream is None:
+            return False
+        stream.pipeline.stop()
+        _release()
+        streams_running.dec()
+        stream_memory_bytes.dec(stream.memory_bytes)
+        logging.info("Stopped processing track %s of %s after %.0fs",
+                     track_sid, stream.participant_identity, time.monotonic() - stream.started)
+        return True
+
+    @staticmethod
+    def _call_soon(loop: asyncio.AbstractEventLoop, callback, *args):
+        try:
+            loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            # The agent's loop is already closed, there's nothing left to give the slot back to
+            pass
+
+    def _pipeline_done(self, track_sid: str, pipeline: Transcriber):
+        stream = self._streams.get(track_sid)
+        if stream is not None and stream.pipeline is pipeline:
+            self.remove(track_sid)
+
+    def remove_participant(self, participant_sid: str) -> int:
+        track_sids = [sid for sid, stream in self._streams.items() if stream.participant_sid == participant_sid]
+        for track_sid in track_sids:
+            self.remove(track_sid)
+        return len(track_sids)
+
+    def stop_all(self):
+        for track_sid in list(self._streams):
+            self.remove(track_sid)
+
+    @property
+    def memory_bytes(self) -> int:
+        return sum(stream.pipeline.memory_bytes for stream in self._streams.values())
+
+    def report(self) -> [dict]:
+        """Each running stream's track, participant, live buffer memory and start time."""
+        return [stream.to_json() for stream in self._streams.values()]
@@ -1,19 +1,30 @@
 import livekit
-from services.transcription import Transcriber
-from agents.agent import Agent
+from services.transcription import Transcriber, DEFAULT_MODEL
+from agents.agent import Agent, AgentEvent, TOPIC_TRANSCRIPTION
+
+TRANSCRIPTION_MODEL = DEFAULT_MODEL
 
 
 class Transcription(Agent):
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.subscribe(self._transcriber_cb, topics=(TOPIC_TRANSCRIPTION,))
+        self.publish_transcripts()
+
     def on_audio_track(
         self,
         track: livekit.Track,
         participant: livekit.Participant,
     ):
-        transcriber = Transcriber(audio_track=track, callback=self._transcriber_cb)
-        transcriber.start()
+        self.streams.add(track.sid, participant,
+                         lambda: Transcriber(audio_track=track,
+                                             callback=self.transcription_publisher(participant),
+                                             thread_callback=True,
+                                             model_name=TRANSCRIPTION_MODEL))
 
-    def _transcriber_cb(self, event: Transcriber.Event):
+    def _transcriber_cb(self, agent_event: AgentEvent):
+        event: Transcriber.Event = agent_event.data
         print(f"transcription event: {event.type} - text: {event.text} - seconds: {event.time_seconds}")
 
     def should_process(
@@ -0,0 +1,209 @@
+import asyncio
+import json
+import logging
+import os
+from collections import OrderedDict
+from collections.abc import Hashable
+from dataclasses import dataclass
+from typing import Optional
+
+import livekit
+
+from services.metrics import registry
+from services.transcription import (Transcriber, EVENT_TYPE_TALKING_FINISHED, EVENT_TYPE_TALKING_LIKELY_FINISHED,
+                                    EVENT_TYPE_TALKING_STARTED, EVENT_TYPE_TALKING_UPDATED)
+
+# How often pending transcripts are sent, partials in between are superseded rather than sent
+FLUSH_HZ = float(os.environ.get("TRANSCRIPT_FLUSH_HZ", "5"))
+# A partial is sent whole this often so a client that lost one catches up
+KEYFRAME_INTERVAL = 8
+# Below the size LiveKit splits data packets at
+MAX_PAYLOAD_BYTES = 14000
+# Monologues whose last sent text is remembered, ones that never finish are forgotten oldest first
+MAX_OPEN_MONOLOGUES = 256
+
+MESSAGE_TYPE = "transcript"
+MESSAGE_VERSION = 2
+PARTIAL_EVENT_TYPES = (EVENT_TYPE_TALKING_STARTED, EVENT_TYPE_TALKING_UPDATED, EVENT_TYPE_TALKING_LIKELY_FINISHED)
+
+messages_sent_total = registry.counter("transcript_messages_sent", "Transcript data packets sent to the room",
+                                       labelnames=("kind",))
+bytes_sent_total = registry.counter("transcript_bytes_sent", "Bytes of transcript data packets sent to the room",
+                                    labelnames=("kind",))
+updates_superseded_total = registry.counter("transcript_updates_superseded",
+                                            "Partial transcripts replaced by a newer one before they were sent")
+
+
+@dataclass
+class _Sent:
+    rev: int
+    text: str
+    since_keyframe: int
+
+
+class TranscriptEncoder:
+    """Turns transcript updates into compact data packet payloads.
+
+    A payload is UTF-8 JSON, {"t": "transcript", "v": 2, "f": final, "u": updates},
+    each update being [participant sid, participant name, monologue id, rev,
+    base, keep, text]. Monologues are told apart by the sid, identities
+    aren't unique across callers, the name is only for showing. The
+    receiver keeps the first keep UTF-16 code units of revision base of that
+    monologue and appends text, or takes text whole when base is 0. Partials
+    are sent lossy so one may never arrive, a delta whose base the receiver
+    doesn't have is skipped until the next whole one. Finals are always sent
+    whole and reliably. Monologue ids and revisions are the sending agent's
+    own, receivers tell agents apart by the packet's sender.
+
+    Only the latest partial of a monologue since the last take is sent.
+    """
+
+    def __init__(self,
+                 keyframe_interval: int = KEYFRAME_INTERVAL,
+                 max_payload_bytes: int = MAX_PAYLOAD_BYTES,
+                 max_open_monologues: int = MAX_OPEN_MONOLOGUES):
+        self._keyframe_interval = keyframe_interval
+        self._max_payload_bytes = max_payload_bytes
+        self._max_open_monologues = max_open_monologues
+        self._partials: OrderedDict[Hashable, tuple[str, str, int, str]] = OrderedDict()
+        self._finals: list[tuple[str, str, int, str]] = []
+        self._sent: OrderedDict[Hashable, _Sent] = OrderedDict()
+
+    @property
+    def pending(self) -> bool:
+        return bool(self._partials or self._finals)
+
+    def push(self, participant_sid: str, name: str, monologue_id: int, text: str, final: bool = False):
+        key = (participant_sid, monologue_id)
+        if final:
+            self._partials.pop(key, None)
+            self._finals.append((participant_sid, name, monologue_id, text))
+            return
+        if key in self._partials:
+            updates_superseded_total.inc()
+        self._partials[key] = (participant_sid, name, monologue_id, text)
+
+    def take_partials(self) -> [bytes]:
+        updates = []
+        for key, (participant_sid, name, monologue_id, text) in self._partials.items():
+            update = self._delta(key, participant_sid, name, monologue_id, text)
+            if update is not None:
+                updates.append(update)
+        self._partials.clear()
+        return self._payloads(updates, final=False)
+
+    def take_finals(self) -> [bytes]:
+        updates = []
+        for participant_sid, name, monologue_id, text in self._finals:
+            sent = self._sent.pop((participant_sid, monologue_id), None)
+            rev = sent.rev + 1 if sent is not None else 1
+            updates.append([participant_sid, name, monologue_id, rev, 0, 0, text])
+        self._finals.clear()
+        return self._payloads(updates, final=True)
+
+    def _delta(self, key: Hashable, participant_sid: str, name: str, monologue_id: int,
+               text: str) -> Optional[list]:
+        sent = self._sent.get(key)
+        if sent is None:
+            sent = _Sent(rev=1, text=text, since_keyframe=0)
+            self._sent[key] = sent
+            while len(self._sent) > self._max_open_monologues:
+                self._sent.popitem(last=False)
+            return [participant_sid, name, monologue_id, sent.rev, 0, 0, text]
+        if text == sent.text:
+            return None
+
+        self._sent.move_to_end(key)
+        base = sent.rev
+        common = len(os.path.commonprefix([sent.text, text]))
+        # Counted in UTF-16 code units like the browser's strings, characters outside the BMP are two
+        keep = len(text[:common].encode("utf-16-le")) // 2
+        sent.rev += 1
+        sent.text = text
+        sent.since_keyframe += 1
+        if keep == 0 or sent.since_keyframe >= self._keyframe_interval:
+            sent.since_keyframe = 0
+            return [participant_sid, name, monologue_id, sent.rev, 0, 0, text]
+        return [participant_sid, name, monologue_id, sent.rev, base, keep, text[common:]]
+
+    def _payloads(self, updates: [list], final: bool) -> [bytes]:
+        head = json.dumps({"t": MESSAGE_TYPE, "v": MESSAGE_VERSION, "f": int(final), "u": []},
+                          separators=(",", ":")).encode()
+        payloads = []
+        batch, size = [], len(head)
+        for update in updates:
+            encoded = json.dumps(update, separators=(",", ":"), ensure_ascii=False).encode()
+            # One for the comma between updates
+            if batch and size + len(encoded) + 1 > self._max_payload_bytes:
+                payloads.append(self._payload(head, batch))
+                batch, size = [], len(head)
+            batch.append(encoded)
+            size += len(encoded) + 1
+        if batch:
+            payloads.append(self._payload(head, batch))
+        return payloads
+
+    @staticmethod
+    def _payload(head: bytes, updates: [bytes]) -> bytes:
+        # head ends in "[]}", the updates go between the brackets
+        return head[:-2] + b",".join(updates) + head[-2:]
+
+
+class TranscriptPublisher:
+    """Sends the transcripts of an agent's transcribers to everyone in the room.
+
+    Events are pushed as they come and sent flush_hz times a second, partials
+    lossy and finals reliably, so a busy room gets a few small packets a
+    second instead of one per transcriber step.
+    """
+
+    def __init__(self, participant: livekit.LocalParticipant, flush_hz: float = FLUSH_HZ,
+                 encoder: Optional[TranscriptEncoder] = None):
+        self._participant = participant
+        self._interval = 1 / flush_hz
+        self._encoder = encoder or TranscriptEncoder()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    def push(self, event: Transcriber.Event, participant: livekit.Participant):
+        if event.type == EVENT_TYPE_TALKING_FINISHED:
+            self._encoder.push(participant.sid, participant.identity, event.id, event.text, final=True)
+        elif event.type in PARTIAL_EVENT_TYPES:
+            self._encoder.push(participant.sid, participant.identity, event.id, event.text)
+        else:
+            return
+        self._wakeup.set()
+
+    async def flush(self):
+        # Finals first, a partial of a later monologue shouldn't show before the one before it is done
+        for payload in self._encoder.take_finals():
+            await self._send(payload, livekit.DataPacketKind.KIND_RELIABLE, "reliable")
+        for payload in self._encoder.take_partials():
+            await self._send(payload, livekit.DataPacketKind.KIND_LOSSY, "lossy")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            started = loop.time()
+            try:
+                await self.flush()
+            except Exception:
+                logging.exception("Failed to publish transcripts")
+            await asyncio.sleep(max(0.0, self._interval - (loop.time() - started)))
+
+    async def _send(self, payload: bytes, kind, kind_label: str):
+        await self._participant.publish_data(payload, kind=kind)
+        messages_sent_total.inc(kind=kind_label)
+        bytes_sent_total.inc(len(payload), kind=kind_label)
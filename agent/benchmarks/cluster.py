@@ -0,0 +1,125 @@
+"""Runs a coordinator and a few worker processes locally and checks job placement.
+
+Jobs fetch their token from a local stand-in for the token service and then
+hold their slot for a while instead of joining a LiveKit room.
+    python -m benchmarks.cluster --workers 4 --jobs 40 --strategy power_of_two
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import time
+
+import aiohttp
+
+WORKER_BASE_PORT = 8200
+COORDINATOR_PORT = 8190
+
+
+async def hold_slot(job, stop: asyncio.Event, on_update):
+    """Stands in for run_job, exercises the token service then keeps the job running."""
+    from worker.jobs import JOB_STATUS_RUNNING, fetch_token
+
+    await fetch_token(job.room, job.identity)
+    job.status = JOB_STATUS_RUNNING
+    on_update(job)
+    try:
+        await asyncio.wait_for(stop.wait(), timeout=float(os.environ["CLUSTER_JOB_SECONDS"]))
+    except asyncio.TimeoutError:
+        pass
+
+
+def _worker_main(port: int, coordinator_url: str, max_jobs: int):
+    from worker import AdmissionControl, JobRunner, WorkerServer
+
+    async def run():
+        server = WorkerServer(JobRunner(run=hold_slot),
+                              AdmissionControl(max_jobs=max_jobs, max_cpu_load=float("inf")),
+                              coordinator_url=coordinator_url,
+                              advertise_url=f"http://127.0.0.1:{port}")
+        await server.start(host='127.0.0.1', port=port)
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+async def wait_for_workers(session: aiohttp.ClientSession, url: str, count: int):
+    while True:
+        async with session.get(f"{url}/workers") as resp:
+            if len((await resp.json())["workers"]) >= count:
+                return
+        await asyncio.sleep(0.1)
+
+
+async def main(args):
+    from benchmarks.fakes import FakeTokenService
+    from worker import Coordinator
+
+    token_service = FakeTokenService()
+    await token_service.start()
+    # Inherited by the spawned workers, which read them on import
+    os.environ["TOKEN_SERVICE_URL"] = token_service.url
+    os.environ["CLUSTER_JOB_SECONDS"] = str(args.job_seconds)
+
+    coordinator = Coordinator(strategy=args.strategy)
+    await coordinator.start(host='127.0.0.1', port=COORDINATOR_PORT)
+    coordinator_url = f"http://127.0.0.1:{COORDINATOR_PORT}"
+
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=_worker_main, args=(WORKER_BASE_PORT + i, coordinator_url, args.max_jobs),
+                                 daemon=True)
+                 for i in range(args.workers)]
+    for process in processes:
+        process.start()
+
+    report = {"strategy": args.strategy}
+    try:
+        async with aiohttp.ClientSession() as session:
+            await wait_for_workers(session, coordinator_url, args.workers)
+
+            async def add_agent(agent: str):
+                async with session.post(f"{coordinator_url}/add_agent", json={"agent": agent, "room": "test"}) as resp:
+                    return resp.status
+
+            start = time.perf_counter()
+            statuses = []
+            for i in range(args.jobs):
+                statuses.append(await add_agent("kitt" if i % 2 == 0 else "transcription"))
+                await asyncio.sleep(args.interval)
+            report["placement_seconds"] = time.perf_counter() - start
+            report["accepted"] = statuses.count(200)
+            report["rejected"] = statuses.count(503)
+            report["placements"] = sorted(coordinator.placements.values())
+
+            # Drained workers take nothing new, the rest of the cluster picks up the slack
+            drained = coordinator.registry.workers()[0]
+            async with session.post(f"{coordinator_url}/workers/{drained.id}/drain"):
+                pass
+            before = coordinator.placements.get(drained.id, 0)
+            for _ in range(args.workers):
+                await add_agent("kitt")
+            report["placed_on_drained_worker"] = coordinator.placements.get(drained.id, 0) - before
+
+            await asyncio.sleep(2 * 2)
+            async with session.get(f"{drained.url}/health") as resp:
+                report["drained_worker_status"] = (await resp.json())["status"]
+            report["token_requests"] = token_service.requests
+    finally:
+        for process in processes:
+            process.terminate()
+        await coordinator.stop()
+        await token_service.stop()
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--jobs", type=int, default=40)
+    parser.add_argument("--max-jobs", type=int, default=16)
+    parser.add_argument("--job-seconds", type=float, default=3)
+    parser.add_argument("--interval", type=float, default=0.02)
+    parser.add_argument("--strategy", default="power_of_two")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,281 @@
+"""Replays recorded calls through the transcriber, or through Kitt against
+local fake LLM and TTS servers, at increasing numbers of concurrent streams.
+
+    python -m benchmarks.end_to_end --wav call.wav --agent kitt --streams 1 4 16 64 --output results.json
+
+Every level runs in a fresh process so its memory and CPU are its own, the
+fake servers run in this one. Per level it reports:
+  real_time_factor             time the transcriber spent on a stream's frames / the stream's audio
+  transcription_latency        frame that completed a step -> the transcript event it raised (transcriber only)
+  endpoint_latency             last voiced frame -> the monologue finished event
+  time_to_first_audio          last voiced frame -> Kitt's first frame of audio (kitt only)
+  cpu_seconds_per_stream       process CPU time over the level, shared out per stream
+  rss_mb_per_stream            peak RSS above the baseline with models loaded, per stream
+Latencies are summarized as count, mean, p50, p95 and max in seconds.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from benchmarks.fakes import (FakeElevenLabs, FakeOpenAI, FakeParticipant, FakeRoom, RecordedAudioStream,
+                              RecordedAudioTrack, read_wav)
+
+AGENT_TRANSCRIBER = "transcriber"
+AGENT_KITT = "kitt"
+MEMORY_SAMPLE_SECONDS = 0.2
+POLL_SECONDS = 0.05
+
+
+def percentile(samples: [float], percentile: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))] if ordered else 0.0
+
+
+def summarize(samples: [float]) -> dict:
+    return {"count": len(samples),
+            "mean": float(np.mean(samples)) if samples else None,
+            "p50": percentile(samples, 50) if samples else None,
+            "p95": percentile(samples, 95) if samples else None,
+            "max": max(samples) if samples else None}
+
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Peak rather than current, in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+class LevelStats:
+    def __init__(self, tracks: [RecordedAudioTrack]):
+        self.tracks = tracks
+        self.transcription_latency: list[float] = []
+        self.endpoint_latency: list[float] = []
+        self.time_to_first_audio: list[float] = []
+        self.stages: dict[str, list[float]] = {}
+        self.turns: dict[str, int] = {}
+
+    def transcriber_callback(self, track: RecordedAudioTrack):
+        from services.transcription import EVENT_TYPE_TALKING_FINISHED, EVENT_TYPE_NO_SPEECH
+
+        def callback(event):
+            if event.type == EVENT_TYPE_NO_SPEECH:
+                return
+            # Events are raised while the frame that completed their step is being ingested
+            frame = track.latest_frame(event.created)
+            self.transcription_latency.append(event.created - track.delivered[frame])
+            if event.type == EVENT_TYPE_TALKING_FINISHED:
+                speech_end = track.speech_end(event.created)
+                if speech_end is not None:
+                    self.endpoint_latency.append(event.created - speech_end)
+        return callback
+
+    def turn_finished(self, tracks_by_participant: dict[str, RecordedAudioTrack]):
+        from services.metrics import STAGE_FINAL_TRANSCRIPT, STAGE_FIRST_AUDIO_FRAME
+
+        def callback(trace, outcome: str):
+            self.turns[outcome] = self.turns.get(outcome, 0) + 1
+            track = tracks_by_participant.get(trace.id.rsplit("-", 1)[0])
+            # Measured against the recording rather than the transcriber's own estimate of where speech ended
+            finished = trace.elapsed(STAGE_FINAL_TRANSCRIPT)
+            speech_end = None
+            if track is not None and finished is not None:
+                speech_end = track.speech_end(trace.started + finished)
+            if speech_end is not None:
+                self.endpoint_latency.append(trace.started + finished - speech_end)
+            for stage, seconds in trace.stages.items():
+                self.stages.setdefault(stage, []).append(seconds)
+            first_audio = trace.elapsed(STAGE_FIRST_AUDIO_FRAME)
+            if speech_end is not None and first_audio is not None:
+                self.time_to_first_audio.append(trace.started + first_audio - speech_end)
+        return callback
+
+
+async def run_transcribers(config: dict, stats: LevelStats):
+    from services.transcription import Transcriber
+
+    for track in stats.tracks:
+        Transcriber(audio_track=track,
+                    callback=stats.transcriber_callback(track),
+                    model_name=config["model"],
+                    quantized=config["quantized"],
+                    stream_factory=RecordedAudioStream).start()
+    while not all(track.done for track in stats.tracks):
+        await asyncio.sleep(POLL_SECONDS)
+
+
+async def run_kitts(config: dict, stats: LevelStats) -> int:
+    """Returns how many Kitts were still responding when they ran out of time."""
+    from agents.kitt import Kitt, StateType
+    from services.metrics import on_turn_finished
+
+    tracks_by_participant = {}
+    kitts = []
+    for track in stats.tracks:
+        room = FakeRoom()
+        caller = FakeParticipant("caller")
+        tracks_by_participant[caller.sid] = track
+        kitt = Kitt(participant=room.local_participant, room=room, stream_factory=RecordedAudioStream)
+        kitts.append(kitt)
+        kitt.on_audio_track(track, caller)
+    on_turn_finished(stats.turn_finished(tracks_by_participant))
+
+    while not all(track.done for track in stats.tracks):
+        await asyncio.sleep(POLL_SECONDS)
+    # Responses are played out in real time whatever the replay speed
+    deadline = time.monotonic() + config["turn_timeout"]
+    while time.monotonic() < deadline:
+        if all(kitt.state.type == StateType.DOING_NOTHING for kitt in kitts):
+            break
+        await asyncio.sleep(POLL_SECONDS)
+    unfinished = sum(1 for kitt in kitts if kitt.state.type != StateType.DOING_NOTHING)
+    for kitt in kitts:
+        await kitt.cleanup()
+    return unfinished
+
+
+async def run_level(config: dict, streams: int) -> dict:
+    from services.transcription import get_backend
+
+    model, quantized = config["model"], config["quantized"]
+    if config["agent"] == AGENT_KITT:
+        # Follows --model unless KITT_TRANSCRIPTION_MODEL says otherwise
+        from agents.kitt.kitt import TRANSCRIPTION_MODEL
+        model = TRANSCRIPTION_MODEL
+    # Models are loaded before the baseline, so only what each stream adds is counted against it
+    backend = get_backend(model, quantized)
+    backend.transcribe(backend.new_stream_id(), np.zeros(16000, dtype=np.float32))
+
+    recordings = [read_wav(path) for path in config["wav"]]
+    tracks = []
+    for index in range(streams):
+        samples, sample_rate, num_channels = recordings[index % len(recordings)]
+        tracks.append(RecordedAudioTrack(samples, sample_rate, num_channels, speed=config["speed"]))
+    stats = LevelStats(tracks)
+
+    baseline = rss_bytes()
+    peak = baseline
+
+    async def sample_memory():
+        nonlocal peak
+        while True:
+            peak = max(peak, rss_bytes())
+            await asyncio.sleep(MEMORY_SAMPLE_SECONDS)
+
+    sampler = asyncio.create_task(sample_memory())
+    cpu_start = cpu_seconds()
+    start = time.perf_counter()
+    unfinished = 0
+    if config["agent"] == AGENT_KITT:
+        unfinished = await run_kitts(config, stats)
+    else:
+        await run_transcribers(config, stats)
+    wall = time.perf_counter() - start
+    cpu = cpu_seconds() - cpu_start
+    sampler.cancel()
+    peak = max(peak, rss_bytes())
+
+    audio_seconds = sum(track.audio_seconds for track in tracks)
+    replay_seconds = [track.finished - track.started for track in tracks]
+    return {"streams": streams,
+            "audio_seconds_per_stream": audio_seconds / streams,
+            "wall_seconds": wall,
+            "real_time_factor": summarize([track.busy_seconds / track.audio_seconds for track in tracks]),
+            # 1 / speed while the transcriber keeps up with the replay, more once it falls behind
+            "replay_real_time_factor": summarize([seconds / track.audio_seconds
+                                                  for seconds, track in zip(replay_seconds, tracks)]),
+            "transcription_latency_seconds": summarize(stats.transcription_latency),
+            "endpoint_latency_seconds": summarize(stats.endpoint_latency),
+            "time_to_first_audio_seconds": summarize(stats.time_to_first_audio),
+            "stage_seconds": {stage: summarize(seconds) for stage, seconds in stats.stages.items()},
+            "turns": stats.turns,
+            "unfinished_responses": unfinished,
+            "cpu_seconds_per_stream": cpu / streams,
+            "cpu_cores_used": cpu / wall if wall > 0 else 0.0,
+            "rss_baseline_mb": baseline / 2**20,
+            "rss_peak_mb": peak / 2**20,
+            "rss_mb_per_stream": (peak - baseline) / 2**20 / streams}
+
+
+def _level_main(config: dict, streams: int) -> dict:
+    os.environ.update(config["env"])
+    logging.basicConfig(level=logging.WARNING)
+    return asyncio.run(run_level(config, streams))
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--wav", nargs="+", required=True, help="16-bit PCM recordings, shared out across streams")
+    parser.add_argument("--agent", choices=[AGENT_TRANSCRIBER, AGENT_KITT], default=AGENT_KITT)
+    parser.add_argument("--streams", nargs="+", type=int, default=[1, 4, 16, 64])
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed, 0 replays as fast as possible")
+    parser.add_argument("--model", default="tiny.en")
+    parser.add_argument("--quantized", action="store_true")
+    parser.add_argument("--turn-timeout", type=float, default=60)
+    parser.add_argument("--llm-first-token-latency", type=float, default=0.3)
+    parser.add_argument("--tts-first-byte-latency", type=float, default=0.2)
+    parser.add_argument("--output", help="also write the report to this file")
+    args = parser.parse_args()
+
+    llm = FakeOpenAI(first_token_latency=args.llm_first_token_latency)
+    tts = FakeElevenLabs(first_byte_latency=args.tts_first_byte_latency)
+    config = {"wav": args.wav,
+              "agent": args.agent,
+              "speed": args.speed,
+              "model": args.model,
+              "quantized": args.quantized,
+              "turn_timeout": args.turn_timeout,
+              "env": {"OPENAI_API_URL": llm.api_url,
+                      "OPENAI_API_KEY": "fake",
+                      "ELEVENLABS_API_URL": tts.api_url,
+                      "ELEVENLABS_WS_URL": tts.ws_url,
+                      "ELEVENLABS_API_KEY": "fake",
+                      # For agents, which take their model from the environment
+                      "TRANSCRIPTION_MODEL": args.model,
+                      "TRANSCRIPTION_QUANTIZED": "1" if args.quantized else "0"}}
+
+    if args.agent == AGENT_KITT:
+        await llm.start()
+        await tts.start()
+    levels = []
+    try:
+        loop = asyncio.get_running_loop()
+        for streams in args.streams:
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                level = await loop.run_in_executor(executor, _level_main, config, streams)
+            print(f"{streams} streams: rtf p95 {level['real_time_factor']['p95']:.3f}, "
+                  f"{level['cpu_seconds_per_stream']:.2f} cpu s and {level['rss_mb_per_stream']:.1f} MB per stream",
+                  file=sys.stderr)
+            levels.append(level)
+    finally:
+        if args.agent == AGENT_KITT:
+            await llm.stop()
+            await tts.stop()
+
+    config.pop("env")
+    report = {"config": config, "llm_requests": llm.requests, "tts_requests": tts.requests, "levels": levels}
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,344 @@
+"""Local stand-ins for the services the agents talk to, for benchmarks and load tests."""
+import asyncio
+import base64
+import json
+import random
+import time
+import wave
+from typing import Optional
+
+import aiohttp
+import aiohttp.web
+import numpy as np
+
+TTS_SAMPLE_RATE = 44100
+ANSWER = ("Sure! The capital of France is Paris, which is also its largest city. "
+          "It has a population of about two million people, and the metro area has over twelve million. "
+          "Is there anything else you'd like to know about France?")
+
+
+def _tone(seconds: float, sample_rate: int = TTS_SAMPLE_RATE) -> bytes:
+    t = np.arange(int(seconds * sample_rate), dtype=np.float32) / sample_rate
+    return (np.sin(2 * np.pi * 220 * t) * 3000).astype(np.int16).tobytes()
+
+
+class FakeAudioSource:
+    """Records captured frames instead of sending them to a room, paced like a real-time source."""
+
+    def __init__(self, realtime: bool = True):
+        self.frames = 0
+        self.silent_frames = 0
+        self.first_frame_time = None
+        self._realtime = realtime
+
+    async def capture_frame(self, frame):
+        self.frames += 1
+        if np.ctypeslib.as_array(frame.data).any():
+            if self.first_frame_time is None:
+                self.first_frame_time = time.perf_counter()
+        else:
+            self.silent_frames += 1
+        await asyncio.sleep(frame.samples_per_channel / frame.sample_rate if self._realtime else 0)
+
+
+class FakeLLM:
+    """Streams a canned answer a word at a time like a chat completion would."""
+
+    def __init__(self, answer: str = ANSWER, first_token_latency: float = 0.3, token_interval: float = 0.02):
+        self.answer = answer
+        self.first_token_latency = first_token_latency
+        self.token_interval = token_interval
+
+    async def generate_text_streamed(self, model: str = ""):
+        await asyncio.sleep(self.first_token_latency)
+        for i, word in enumerate(self.answer.split(" ")):
+            yield word if i == 0 else " " + word
+            await asyncio.sleep(self.token_interval)
+
+
+def hashing_embedding(text: str, dim: int = 1536) -> np.ndarray:
+    """Bag of words embedding, a stand-in for an embedding API that needs no network."""
+    embedding = np.zeros(dim, dtype=np.float32)
+    for word in text.lower().split():
+        embedding[hash(word) % dim] += 1
+    return embedding
+
+
+class FakeOpenAI:
+    """Speaks the streaming chat completions API, for load testing the LLM client.
+
+    Answers with ANSWER a word per token_interval. A slow_rate fraction of
+    requests wait slow_latency before the first token instead of
+    first_token_latency, and a failure_rate fraction fail with a 503.
+    """
+
+    def __init__(self,
+                 port: int = 8766,
+                 first_token_latency: float = 0.3,
+                 token_interval: float = 0.02,
+                 slow_rate: float = 0.0,
+                 slow_latency: float = 2.0,
+                 failure_rate: float = 0.0,
+                 answer: str = ANSWER):
+        self.port = port
+        self.first_token_latency = first_token_latency
+        self.token_interval = token_interval
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.failure_rate = failure_rate
+        self.answer = answer
+        self.requests = 0
+        self.failures = 0
+        self._runner = None
+
+    @property
+    def api_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    async def start(self):
+        app = aiohttp.web.Application()
+        app.add_routes([aiohttp.web.post('/v1/chat/completions', self._chat_completions)])
+        self._runner = aiohttp.web.AppRunner(app)
+        await self._runner.setup()
+        await aiohttp.web.TCPSite(self._runner, host='127.0.0.1', port=self.port).start()
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    async def _chat_completions(self, request):
+        self.requests += 1
+        await request.json()
+        if random.random() < self.failure_rate:
+            self.failures += 1
+            return aiohttp.web.Response(status=503)
+
+        response = aiohttp.web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await asyncio.sleep(self.slow_latency if random.random() < self.slow_rate else self.first_token_latency)
+        try:
+            for i, word in enumerate(self.answer.split(" ")):
+                chunk = {"choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}}]}
+                await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                await asyncio.sleep(self.token_interval)
+            await response.write(b"data: [DONE]\n\n")
+            await response.write_eof()
+        except ConnectionResetError:
+            # The client hung up, e.g. it lost a hedged race
+            pass
+        return response
+
+
+class FakeTokenService:
+    """Hands out tokens like the token service agents fetch their room credentials from."""
+
+    def __init__(self, port: int = 8767):
+        self.port = port
+        self.requests = 0
+        self._runner = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def start(self):
+        app = aiohttp.web.Application()
+        app.add_routes([aiohttp.web.get('/api/token', self._token)])
+        self._runner = aiohttp.web.AppRunner(app)
+        await self._runner.setup()
+        await aiohttp.web.TCPSite(self._runner, host='127.0.0.1', port=self.port).start()
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    async def _token(self, request):
+        self.requests += 1
+        identity = request.query["identity"]
+        room = request.query["roomName"]
+        return aiohttp.web.json_response({"accessToken": f"fake-token-{room}-{identity}",
+                                          "wsUrl": "ws://127.0.0.1:7880"})
+
+
+class FakeElevenLabs:
+    """Speaks the ElevenLabs voices, text-to-speech and stream-input APIs.
+
+    Every text message is synthesized on its own, its audio (seconds_per_char
+    of a PCM tone per character) is sent after first_byte_latency.
+    """
+
+    def __init__(self, port: int = 8765, first_byte_latency: float = 0.2, seconds_per_char: float = 0.05):
+        self.port = port
+        self.first_byte_latency = first_byte_latency
+        self.seconds_per_char = seconds_per_char
+        self.requests = 0
+        self.connections = 0
+        self._runner = None
+
+    @property
+    def api_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def ws_url(self) -> str:
+        return f"ws://127.0.0.1:{self.port}"
+
+    async def start(self):
+        app = aiohttp.web.Application()
+        app.add_routes([aiohttp.web.get('/v1/voices', self._voices),
+                        aiohttp.web.post('/v1/text-to-speech/{voice_id}', self._text_to_speech),
+                        aiohttp.web.get('/v1/text-to-speech/{voice_id}/stream-input', self._stream_input)])
+        self._runner = aiohttp.web.AppRunner(app)
+        await self._runner.setup()
+        await aiohttp.web.TCPSite(self._runner, host='127.0.0.1', port=self.port).start()
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    async def _voices(self, request):
+        return aiohttp.web.json_response({"voices": [{"voice_id": "fake-voice", "name": "Fake"}]})
+
+    async def _text_to_speech(self, request):
+        self.requests += 1
+        data = await request.json()
+        await asyncio.sleep(self.first_byte_latency)
+        return aiohttp.web.Response(body=_tone(len(data["text"]) * self.seconds_per_char))
+
+    async def _stream_input(self, request):
+        self.connections += 1
+        ws = aiohttp.web.WebSocketResponse()
+        await ws.prepare(request)
+
+        async for message in ws:
+            data = json.loads(message.data)
+            text = data.get("text", "")
+            if text == "":
+                await ws.send_str(json.dumps({"audio": None, "isFinal": True}))
+                break
+            if text.strip() == "":
+                # BOS and keep-alive messages
+                continue
+
+            self.requests += 1
+            await asyncio.sleep(self.first_byte_latency)
+            audio = base64.b64encode(_tone(len(text) * self.seconds_per_char)).decode()
+            await ws.send_str(json.dumps({"audio": audio, "isFinal": False}))
+
+        await ws.close()
+        return ws
+
+
+def read_wav(path: str) -> tuple[np.ndarray, int, int]:
+    """Returns a 16-bit PCM WAV file's interleaved samples, sample rate and channel count."""
+    with wave.open(path, "rb") as wav:
+        if wav.getsampwidth() != 2:
+            raise ValueError(f"{path} is not 16-bit PCM")
+        samples = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+        return samples, wav.getframerate(), wav.getnchannels()
+
+
+class RecordedAudioTrack:
+    """A caller's track that plays back a recording, paced like a live one.
+
+    speed 1.0 delivers frames in real time, 4.0 four times as fast and 0 as
+    fast as the transcriber takes them. Silence is appended so the last
+    monologue ends. The stream records when each frame was delivered and how
+    long the transcriber spent on it.
+    """
+
+    def __init__(self,
+                 samples: np.ndarray,
+                 sample_rate: int,
+                 num_channels: int = 1,
+                 speed: float = 1.0,
+                 trailing_silence_seconds: float = 2.0,
+                 frame_seconds: float = 0.01,
+                 speech_level: int = 300):
+        silence = np.zeros(int(trailing_silence_seconds * sample_rate) * num_channels, dtype=np.int16)
+        self.samples = np.concatenate([samples, silence])
+        self.sample_rate = sample_rate
+        self.num_channels = num_channels
+        self.speed = speed
+        self.frame_samples = int(sample_rate * frame_seconds)
+        self.num_frames = len(self.samples) // (self.frame_samples * num_channels)
+        self.sid = f"TR_{id(self):x}"
+
+        frames = self.samples[0:self.num_frames * self.frame_samples * num_channels].astype(np.float32)
+        rms = np.sqrt(np.mean(frames.reshape(self.num_frames, -1) ** 2, axis=1))
+        self.voiced = rms > speech_level
+        self.delivered = np.full(self.num_frames, np.nan)
+        self.busy_seconds = 0.0
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+
+    @property
+    def audio_seconds(self) -> float:
+        return self.num_frames * self.frame_samples / self.sample_rate
+
+    @property
+    def done(self) -> bool:
+        return self.finished is not None
+
+    def latest_frame(self, at: float) -> int:
+        """Index of the last frame delivered by perf_counter() time at, -1 if none was."""
+        delivered = self.delivered[~np.isnan(self.delivered)]
+        return int(np.searchsorted(delivered, at, side="right")) - 1
+
+    def speech_end(self, at: float) -> Optional[float]:
+        """When the last voiced frame delivered before at was delivered."""
+        voiced = np.flatnonzero(self.voiced[0:self.latest_frame(at) + 1])
+        return float(self.delivered[voiced[-1]]) if len(voiced) else None
+
+
+class RecordedAudioStream:
+    """Stands in for livekit.AudioStream, yields a RecordedAudioTrack's frames."""
+
+    def __init__(self, track: RecordedAudioTrack, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self._track = track
+
+    async def __aiter__(self):
+        import livekit
+
+        track = self._track
+        track.started = time.perf_counter()
+        frame_values = track.frame_samples * track.num_channels
+        for index in range(track.num_frames):
+            if track.speed > 0:
+                delay = track.started + index * track.frame_samples / track.sample_rate / track.speed
+                await asyncio.sleep(max(0.0, delay - time.perf_counter()))
+            frame = livekit.AudioFrame.create(sample_rate=track.sample_rate, num_channels=track.num_channels,
+                                              samples_per_channel=track.frame_samples)
+            np.ctypeslib.as_array(frame.data)[:] = track.samples[index * frame_values:(index + 1) * frame_values]
+            track.delivered[index] = time.perf_counter()
+            yield frame
+            # The transcriber ingests each frame before asking for the next one
+            track.busy_seconds += time.perf_counter() - track.delivered[index]
+        track.finished = time.perf_counter()
+
+
+class FakeParticipant:
+    def __init__(self, identity: str):
+        self.identity = identity
+        self.sid = f"PA_{id(self):x}"
+        self.tracks = {}
+        self.published = []
+        self.data = []
+
+    async def publish_track(self, track, options):
+        self.published.append(track)
+
+    async def publish_data(self, payload, kind=None, destination_sids=None):
+        self.data.append((payload, kind))
+
+
+class FakeRoom:
+    """Stands in for a connected livekit.Room with nobody else in it, agents are handed tracks directly."""
+
+    def __init__(self, identity: str = "agent"):
+        self.local_participant = FakeParticipant(identity)
+        self.participants = {}
+        self.handlers = {}
+
+    def on(self, event: str, callback):
+        self.handlers.setdefault(event, []).append(callback)
+
+    async def disconnect(self):
+        pass
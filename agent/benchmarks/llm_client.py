@@ -0,0 +1,79 @@
+"""Load tests the LLM client against a local mock of the chat completions API.
+
+    python -m benchmarks.llm_client --requests 200 --concurrency 16 --slow-rate 0.1 --failure-rate 0.05
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.fakes import FakeOpenAI
+from services.openai.llm import LLMError, OpenAIClient
+
+
+def percentile(samples: [float], percentile: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))] if ordered else 0.0
+
+
+async def run(server: FakeOpenAI, args, hedge: bool) -> dict:
+    client = OpenAIClient(base_url=server.api_url, api_key="fake", hedge=hedge,
+                          timeout_seconds=args.timeout)
+    messages = [{"role": "user", "content": "What is the capital of France?"}]
+    first_tokens = []
+    totals = []
+    errors = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one():
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            first = None
+            try:
+                async for _ in client.stream(model="fake", messages=messages):
+                    if first is None:
+                        first = time.perf_counter() - start
+            except LLMError:
+                errors += 1
+                return
+            first_tokens.append(first)
+            totals.append(time.perf_counter() - start)
+
+    requests_before = server.requests
+    await asyncio.gather(*[one() for _ in range(args.requests)])
+    await client.close()
+    return {
+        "first_token_p50_ms": percentile(first_tokens, 50) * 1000,
+        "first_token_p95_ms": percentile(first_tokens, 95) * 1000,
+        "first_token_p99_ms": percentile(first_tokens, 99) * 1000,
+        "total_p95_ms": percentile(totals, 95) * 1000,
+        "errors": errors,
+        "server_requests": server.requests - requests_before,
+        "retries": client.retries,
+        "hedges": client.hedges,
+        "hedge_wins": client.hedge_wins,
+    }
+
+
+async def main(args):
+    server = FakeOpenAI(first_token_latency=args.first_token_latency, token_interval=0.005,
+                        slow_rate=args.slow_rate, failure_rate=args.failure_rate)
+    await server.start()
+    try:
+        report = {"plain": await run(server, args, hedge=False),
+                  "hedged": await run(server, args, hedge=True)}
+        print(json.dumps(report, indent=2))
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--first-token-latency", type=float, default=0.1)
+    parser.add_argument("--slow-rate", type=float, default=0.1)
+    parser.add_argument("--failure-rate", type=float, default=0.05)
+    parser.add_argument("--timeout", type=float, default=10)
+    asyncio.run(main(parser.parse_args()))
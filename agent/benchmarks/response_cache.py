@@ -0,0 +1,48 @@
+"""Measures response cache lookups, exact and by embedding similarity.
+
+    python -m benchmarks.response_cache --entries 10000
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import services.openai.response_cache as response_cache
+from benchmarks.fakes import hashing_embedding
+
+
+async def time_lookups(cache, questions: [str]) -> float:
+    start = time.perf_counter()
+    for question in questions:
+        await cache.get(question)
+    return (time.perf_counter() - start) / len(questions)
+
+
+async def main(args):
+    cache = response_cache.ResponseCache(max_entries=args.entries, embed=hashing_embedding,
+                                         similarity_threshold=0.8)
+    questions = [f"what is the weather like in city number {i}?" for i in range(args.entries)]
+    for question in questions:
+        await cache.put(question, f"answer {question}")
+
+    exact = await time_lookups(cache, questions[:args.lookups])
+    paraphrased = [f"So what is the weather like in city number {i}?" for i in range(args.lookups)]
+    semantic = await time_lookups(cache, paraphrased)
+    unrelated = await time_lookups(cache, [f"who wrote book {i}?" for i in range(args.lookups)])
+
+    print(json.dumps({
+        "entries": len(cache),
+        "exact_lookup_ms": exact * 1000,
+        "semantic_lookup_ms": semantic * 1000,
+        "miss_lookup_ms": unrelated * 1000,
+        "exact_hits": cache.exact_hits,
+        "semantic_hits": cache.semantic_hits,
+        "misses": cache.misses,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=10000)
+    parser.add_argument("--lookups", type=int, default=200)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,54 @@
+"""Reports agent import time and first transcription latency.
+
+Run from the agent/ directory so every import is measured cold:
+    python -m benchmarks.startup --model tiny.en --quantized
+"""
+import argparse
+import importlib
+import json
+import time
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="tiny.en")
+    parser.add_argument("--quantized", action="store_true")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    report = {"model": args.model, "quantized": args.quantized}
+
+    start = time.perf_counter()
+    importlib.import_module("agents.kitt")
+    importlib.import_module("agents.transcription")
+    report["import_seconds"] = time.perf_counter() - start
+
+    from services.transcription import InferenceScheduler, registry
+
+    start = time.perf_counter()
+    registry.get(args.model, args.quantized)
+    report["model_load_seconds"] = time.perf_counter() - start
+
+    # A second of a quiet tone, enough for the decoder to produce its first tokens
+    t = np.arange(SAMPLE_RATE, dtype=np.float32) / SAMPLE_RATE
+    audio = (0.1 * np.sin(2 * np.pi * 220 * t)).astype(np.float32)
+
+    scheduler = InferenceScheduler(args.model, args.quantized, max_wait_seconds=0)
+    stream_id = scheduler.new_stream_id()
+    latencies = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        scheduler.transcribe(stream_id, audio)
+        latencies.append(time.perf_counter() - start)
+
+    report["first_token_seconds"] = latencies[0]
+    report["warm_decode_seconds"] = float(np.median(latencies[1:])) if len(latencies) > 1 else None
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Measures time to first audio when LLM tokens go to TTS one by one vs chunked.
+
+Runs against a fake LLM and a local fake ElevenLabs server:
+    python -m benchmarks.time_to_first_audio
+"""
+import asyncio
+import json
+import os
+import time
+
+from benchmarks.fakes import FakeAudioSource, FakeElevenLabs, FakeLLM
+
+
+async def run(tts_module, server: FakeElevenLabs, chunked: bool) -> dict:
+    source = FakeAudioSource()
+    tts = tts_module.TTS(source, 44100, 1)
+    await tts.warmup()
+    requests_before = server.requests
+
+    start = time.perf_counter()
+    text_queue = asyncio.Queue()
+    tts_task = asyncio.create_task(tts.stream_generate_audio(text_queue=text_queue))
+    tokens = FakeLLM().generate_text_streamed()
+    if chunked:
+        tokens = tts_module.chunk_text(tokens)
+    async for text in tokens:
+        await text_queue.put(text)
+    await text_queue.put(None)
+    await tts_task
+
+    while source.first_frame_time is None:
+        await asyncio.sleep(0.001)
+    result = {"time_to_first_audio_seconds": source.first_frame_time - start,
+              "tts_messages": server.requests - requests_before}
+    await tts.close()
+    return result
+
+
+async def main():
+    server = FakeElevenLabs()
+    os.environ["ELEVENLABS_API_URL"] = server.api_url
+    os.environ["ELEVENLABS_WS_URL"] = server.ws_url
+    os.environ.setdefault("ELEVENLABS_API_KEY", "fake")
+    import services.tts as tts_module
+
+    await server.start()
+    try:
+        report = {"per_token": await run(tts_module, server, chunked=False),
+                  "chunked": await run(tts_module, server, chunked=True)}
+        print(json.dumps(report, indent=2))
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,58 @@
+"""Compares time to first audio frame for cached and uncached TTS phrases.
+
+Runs against a local fake ElevenLabs server:
+    python -m benchmarks.tts_cache
+"""
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from benchmarks.fakes import FakeAudioSource, FakeElevenLabs
+
+PHRASES = ["Hi, I'm Kitt.", "Give me a second.", "Sorry, could you say that again?"]
+
+
+async def time_to_first_frame(tts_module, cache, phrase: str) -> float:
+    source = FakeAudioSource()
+    tts = tts_module.TTS(source, 44100, 1, cache=cache)
+    start = time.perf_counter()
+    if cache.get(tts_module.cache_key(phrase, "fake-voice", tts_module.OUTPUT_FORMAT)) is None:
+        await tts.warmup()
+    await tts.generate_audio(phrase)
+    while source.first_frame_time is None:
+        await asyncio.sleep(0.001)
+    return source.first_frame_time - start
+
+
+async def main():
+    server = FakeElevenLabs()
+    os.environ["ELEVENLABS_API_URL"] = server.api_url
+    os.environ["ELEVENLABS_WS_URL"] = server.ws_url
+    os.environ.setdefault("ELEVENLABS_API_KEY", "fake")
+    import services.tts as tts_module
+
+    await server.start()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            cache = tts_module.AudioCache(directory=directory)
+            report = {"miss_seconds": [], "hit_seconds": [], "disk_hit_seconds": []}
+            for phrase in PHRASES:
+                report["miss_seconds"].append(await time_to_first_frame(tts_module, cache, phrase))
+            for phrase in PHRASES:
+                report["hit_seconds"].append(await time_to_first_frame(tts_module, cache, phrase))
+
+            # A fresh cache over the same directory only has the disk tier
+            disk_cache = tts_module.AudioCache(directory=directory, memory_bytes=0)
+            for phrase in PHRASES:
+                report["disk_hit_seconds"].append(await time_to_first_frame(tts_module, disk_cache, phrase))
+
+            report["server_requests"] = server.requests
+            print(json.dumps(report, indent=2))
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
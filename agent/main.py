@@ -1,71 +1,44 @@
-import os
-import livekit
-import aiohttp
-import aiohttp_cors
-import dotenv
+import argparse
 import asyncio
-import openai
+import logging
+import os
 
-from agents.transcription import Transcription
-from agents.kitt.kitt import Kitt 
-from agents.agent import Agent
+import dotenv
 
+# Loaded before the worker reads its settings from the environment
 dotenv.load_dotenv()
 
+from worker import JobRunner, ProcessPoolRunner, WorkerServer
+from worker.jobs import AGENT_CLASSES, DEFAULT_ROOM
 
-TOKEN_SERVICE_URL = os.environ.get("TOKEN_SERVICE_URL", "")
-# openai.api_key = os.environ.get("OPENAI_API_KEY", "")
-# PORT = 8000
+# Number of processes to run agent jobs in, 0 runs them all in this process
+WORKER_PROCESSES = int(os.environ.get("WORKER_PROCESSES", "0"))
 
-AGENTS: [Agent] = []
-async def main():
-#async def add_agent(request):
-    # data = await request.json()
-    # agent_type = data['agent']
-    ws_url = ''
-    token = ''
-    async with aiohttp.ClientSession() as session:
-        endpoint = f'{TOKEN_SERVICE_URL}/api/token?identity=agent&roomName=hack-rtc2'
 
-        async with session.get(endpoint) as response:
-            json_response = await response.json()
-            ws_url = "wss://hackrtc-usisftuh.livekit.cloud"
-            token = json_response['accessToken']
-            print(f'ws_url: {ws_url} token: {token}')
+async def main(args):
+    runner = ProcessPoolRunner(WORKER_PROCESSES) if WORKER_PROCESSES > 0 else JobRunner()
+    server = WorkerServer(runner, coordinator_url=args.coordinator, advertise_url=args.advertise_url)
+    await server.start(port=args.port)
+    for agent in args.agent:
+        job, rejection = server.submit(agent, args.room)
+        if job is None:
+            logging.warning("Couldn't start %s: %s", agent, rejection)
 
-    room = livekit.Room()
-    await room.connect(ws_url, token)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
 
-    participant = room.local_participant
-    transcription = Transcription(participant=participant, room=room)
-    AGENTS.append(transcription)
-    while True:
-        await asyncio.sleep(0.1)
-    # if agent_type == 'transcription':
-        
-    # elif agent_type == 'kitt':
-    #     participant = room.local_participant
-    #     kitt = Kitt(participant=participant, room=room)
-    #     AGENTS.append(kitt)
-
-    #return aiohttp.web.json_response({'success': True})
-
-# app = aiohttp.web.Application()
-# app.add_routes([aiohttp.web.post('/add_agent', add_agent)])
-# cors = aiohttp_cors.setup(app, defaults={"*": aiohttp_cors.ResourceOptions(
-#     allow_credentials=True, expose_headers="*", allow_headers="*")})
-# for route in list(app.router.routes()):
-#     cors.add(route)
-
-# async def main():
-    # runner = aiohttp.web.AppRunner(app)
-    # await runner.setup()
-    # site = aiohttp.web.TCPSite(runner, host='0.0.0.0', port=PORT)    
-    # await site.start()
-    # await asyncio.Event().wait()
 
 if __name__ == "__main__":
-
-    asyncio.run(main())
-    #main_task = asyncio.ensure_future(main())
-    asyncio.get_event_loop().run_until_complete(main_task)
\ No newline at end of file
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=int(os.environ.get("WORKER_PORT", "8000")))
+    parser.add_argument("--agent", action="append", default=[], choices=list(AGENT_CLASSES),
+                        help="agent to start in --room as soon as the worker is up, can be repeated")
+    parser.add_argument("--room", default=DEFAULT_ROOM)
+    parser.add_argument("--coordinator", default=os.environ.get("COORDINATOR_URL", ""),
+                        help="coordinator to register with and send load reports to")
+    parser.add_argument("--advertise-url", default=None,
+                        help="url the coordinator reaches this worker on, http://<hostname>:<port> if unset")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,3 @@
+from .prometheus import Counter, Gauge, Histogram, Registry, registry
+from .trace import (TurnTrace, on_turn_finished, STAGE_ENDPOINT, STAGE_FINAL_TRANSCRIPT, STAGE_LLM_REQUEST, STAGE_LLM_FIRST_TOKEN, STAGE_TTS_FIRST_BYTE,
+                    STAGE_FIRST_AUDIO_FRAME)
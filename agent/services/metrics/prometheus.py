@@ -0,0 +1,227 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds, from a 10ms audio frame up to a slow LLM answer
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_key(labelnames: tuple[str, ...], labels: dict) -> tuple[str, ...]:
+    if set(labels) != set(labelnames):
+        raise ValueError(f"expected labels {labelnames}, got {tuple(labels)}")
+    return tuple(str(labels[name]) for name in labelnames)
+
+
+def _format_labels(labelnames: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"kind": "counter", "help": self.help, "labelnames": list(self.labelnames),
+                    "values": [[list(key), value] for key, value in self._values.items()]}
+
+    def merge(self, snapshot: dict):
+        with self._lock:
+            for key, value in snapshot["values"]:
+                key = tuple(key)
+                self._values[key] = self._values.get(key, 0) + value
+
+    def expose(self) -> [str]:
+        name = f"{self.name}_total"
+        lines = [f"# HELP {name} {self.help}", f"# TYPE {name} counter"]
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f"{name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"kind": "gauge", "help": self.help, "labelnames": list(self.labelnames),
+                    "values": [[list(key), value] for key, value in self._values.items()]}
+
+    def merge(self, snapshot: dict):
+        # Gauges of a pool's processes add up, like the streams each of them runs
+        with self._lock:
+            for key, value in snapshot["values"]:
+                key = tuple(key)
+                self._values[key] = self._values.get(key, 0) + value
+
+    def expose(self) -> [str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: a count per bucket (the last one is +Inf), the sum and the count
+        self._values: dict[tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            counts[0][index] += 1
+            counts[1] += value
+            counts[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        counts = self._values.get(_label_key(self.labelnames, labels))
+        return counts[2] if counts else 0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"kind": "histogram", "help": self.help, "labelnames": list(self.labelnames),
+                    "buckets": list(self.buckets),
+                    "values": [[list(key), [list(buckets), total, count]]
+                               for key, (buckets, total, count) in self._values.items()]}
+
+    def merge(self, snapshot: dict):
+        with self._lock:
+            for key, (buckets, total, count) in snapshot["values"]:
+                counts = self._values.setdefault(tuple(key), [[0] * (len(self.buckets) + 1), 0.0, 0])
+                counts[0] = [a + b for a, b in zip(counts[0], buckets)]
+                counts[1] += total
+                counts[2] += count
+
+    def expose(self) -> [str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (buckets, total, count) in self._values.items():
+                cumulative = 0
+                for bound, bucket in zip(self.buckets + (float("inf"),), buckets):
+                    cumulative += bucket
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    bucket_labels = _format_labels(self.labelnames, key, f'le="{le}"')
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    """The metrics of one process, in the Prometheus text exposition format.
+
+    Metrics are created on first use and shared after, so modules can
+    declare the ones they record at import time.
+    """
+
+    def __init__(self):
+        self._metrics: dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self._get_or_create(Counter, name, help, labelnames)
+
+    def gauge(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, help, labelnames)
+
+    def histogram(self, name: str, help: str, labelnames: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help, labelnames, buckets)
+
+    def snapshot(self) -> dict:
+        """The metrics' current values in a form that can be pickled or sent as JSON."""
+        with self._lock:
+            metrics = dict(self._metrics)
+        return {name: metric.snapshot() for name, metric in metrics.items()}
+
+    def merged(self, snapshots: [dict]) -> "Registry":
+        """A new registry adding up this one and snapshots of others, like
+        those of the processes of a pool."""
+        merged = Registry()
+        for snapshot in [self.snapshot()] + list(snapshots):
+            for name, values in snapshot.items():
+                labelnames = tuple(values["labelnames"])
+                if values["kind"] == "counter":
+                    metric = merged.counter(name, values["help"], labelnames)
+                elif values["kind"] == "gauge":
+                    metric = merged.gauge(name, values["help"], labelnames)
+                else:
+                    metric = merged.histogram(name, values["help"], labelnames, tuple(values["buckets"]))
+                metric.merge(values)
+        return merged
+
+    def expose(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+    def _get_or_create(self, cls, name: str, *args):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"{name} is already registered as a {type(metric).__name__}")
+            return metric
+
+
+registry = Registry()
@@ -0,0 +1,62 @@
+import logging
+import time
+from collections.abc import Callable
+from typing import Optional
+
+from .prometheus import registry
+
+# The transcriber took the pause as the end of the turn, then transcribed what was left of it
+STAGE_ENDPOINT = "endpoint"
+STAGE_FINAL_TRANSCRIPT = "final_transcript"
+STAGE_LLM_REQUEST = "llm_request"
+STAGE_LLM_FIRST_TOKEN = "llm_first_token"
+STAGE_TTS_FIRST_BYTE = "tts_first_byte"
+STAGE_FIRST_AUDIO_FRAME = "first_audio_frame"
+
+turn_stage_seconds = registry.histogram("voice_turn_stage_seconds",
+                                        "Time from the end of the caller's speech to each stage of the response",
+                                        labelnames=("stage",))
+turns_total = registry.counter("voice_turns", "Turns traced, by how they ended", labelnames=("outcome",))
+
+_listeners: list[Callable[["TurnTrace", str], None]] = []
+
+
+def on_turn_finished(callback: Callable[["TurnTrace", str], None]):
+    """Calls callback with every trace and its outcome as it finishes, for benchmarks to collect turns."""
+    _listeners.append(callback)
+
+
+class TurnTrace:
+    """Stage timings of one turn, from the end of the caller's speech to the
+    first frame of the response, under the transcriber's event id.
+
+    Each stage is recorded the first time it's marked, into the
+    voice_turn_stage_seconds histogram and the log line written by finish().
+    """
+
+    def __init__(self, turn_id: str, speech_end: Optional[float] = None):
+        self.id = turn_id
+        self.started = speech_end if speech_end is not None else time.perf_counter()
+        self._stages: dict[str, float] = {}
+
+    def mark(self, stage: str, at: Optional[float] = None):
+        """Records the stage as reached now, or at the perf_counter() time at."""
+        if stage in self._stages:
+            return
+        elapsed = (at if at is not None else time.perf_counter()) - self.started
+        self._stages[stage] = elapsed
+        turn_stage_seconds.observe(elapsed, stage=stage)
+
+    def elapsed(self, stage: str) -> Optional[float]:
+        return self._stages.get(stage)
+
+    @property
+    def stages(self) -> dict[str, float]:
+        return dict(self._stages)
+
+    def finish(self, outcome: str = "completed"):
+        turns_total.inc(outcome=outcome)
+        stages = " ".join(f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in self._stages.items())
+        logging.info("turn %s %s: %s", self.id, outcome, stages)
+        for callback in _listeners:
+            callback(self, outcome)
@@ -1 +1,4 @@
 from .chatgpt import (ChatGPT, Message, MessageRole)
+from .memory import ConversationMemory, count_tokens
+from .response_cache import ResponseCache, normalize_question, openai_embedding
+from .llm import LLMClient, OpenAIClient, LLMError, RetryableLLMError, default_client
@@ -1,6 +1,18 @@
+import functools
+import hashlib
+import json
+from collections.abc import AsyncIterator, Awaitable, Callable
 from dataclasses import dataclass
-import openai
 from enum import Enum
+from typing import Optional
+
+from .llm import LLMClient, default_client
+from .memory import DEFAULT_MAX_TOKENS, ConversationMemory
+from .response_cache import ResponseCache, is_cacheable, replay
+
+SUMMARY_MODEL = "gpt-3.5-turbo"
+SUMMARY_PROMPT = "Summarize this conversation between a user and a voice assistant in a few sentences, \
+                  keeping names, facts and anything the user asked to remember."
 
 MessageRole = Enum('MessageRole', ["system", "user", "assistant", "function"])
 
@@ -17,15 +29,24 @@ class Message:
 
 
 class ChatGPT:
-    def __init__(self, prompt: str, message_capacity: int):
-        self._prompt = prompt
-        self._message_capacity = message_capacity
-        self._messages: [Message] = []
+    def __init__(self,
+                 prompt: str,
+                 max_history_tokens: int = DEFAULT_MAX_TOKENS,
+                 summarize: bool = False,
+                 cache: Optional[ResponseCache] = None,
+                 client: Optional[LLMClient] = None):
+        self._cache = cache
+        self._client = client or default_client()
+        self._memory = ConversationMemory(prompt=prompt,
+                                          max_tokens=max_history_tokens,
+                                          summarizer=self._summarize if summarize else None)
+
+    @property
+    def memory(self) -> ConversationMemory:
+        return self._memory
 
     def add_message(self, message: Message):
-        self._messages.append(message)
-        if len(self._messages) > self._message_capacity:
-            self._messages.pop(0)
+        self._memory.add(message)
 
     async def generate_text(self, model: str):
         result = ""
@@ -33,12 +54,63 @@ class ChatGPT:
             result += chunk
         return result
 
-    async def generate_text_streamed(self, model: str):
-        prompt_message = Message(role=MessageRole.system, content=self._prompt)
-        async for chunk in await openai.ChatCompletion.acreate(model=model,
-                                                               n=1,
-                                                               stream=True,
-                                                               messages=[prompt_message.toAPI()] + [m.toAPI() for m in self._messages]):
-            content = chunk["choices"][0].get("delta", {}).get("content")
-            if content is not None:
-                yield content
+    def generate_text_streamed(self, model: str, pending: Optional[Message] = None):
+        """Streams a reply to the conversation so far, plus a pending message
+        that is sent with the request but not added to the history.
+
+        The messages are captured when this is called, not when the stream is
+        first iterated, so later add_message calls don't change the request.
+        """
+        return self._stream(model=model, messages=self._request_messages(pending))
+
+    def speculate(self, model: str,
+                  pending: Message) -> tuple[AsyncIterator[str], Callable[[str], Awaitable[None]]]:
+        """Like generate_text_streamed, but the answer is only cached once it's
+        passed to the returned function, as a speculation may be thrown away."""
+        messages = self._request_messages(pending)
+        return (self._stream(model=model, messages=messages, cache_answer=False),
+                functools.partial(self._cache_answer, messages))
+
+    def _request_messages(self, pending: Optional[Message]) -> [dict]:
+        messages = self._memory.api_messages()
+        if pending is not None:
+            messages = messages + [pending.toAPI()]
+        return messages
+
+    @staticmethod
+    def _cache_key(messages: [dict]) -> tuple[Optional[str], str]:
+        """The question a request asks and a hash of the conversation before it."""
+        question = messages[-1]["content"] if messages[-1]["role"] == MessageRole.user.name else None
+        context = hashlib.sha1(json.dumps(messages[:-1], separators=(",", ":")).encode()).hexdigest()
+        return question, context
+
+    async def _cache_answer(self, messages: [dict], answer: str):
+        question, context = self._cache_key(messages)
+        if self._cache is not None and question is not None and is_cacheable(question):
+            await self._cache.put(question, answer, context=context)
+
+    async def _stream(self, model: str, messages: [dict], cache_answer: bool = True):
+        question, context = self._cache_key(messages)
+        if self._cache is not None and question is not None and is_cacheable(question):
+            answer = await self._cache.get(question, context=context)
+            if answer is not None:
+                async for token in replay(answer):
+                    yield token
+                return
+
+        answer = ""
+        async for content in self._client.stream(model=model, messages=messages):
+            answer += content
+            yield content
+
+        # Only complete answers are cached, not ones cut short by a barge-in
+        if cache_answer:
+            await self._cache_answer(messages, answer)
+
+    async def _summarize(self, summary: str, messages: [dict]) -> str:
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+        if summary:
+            transcript = f"Earlier summary: {summary}\n{transcript}"
+        return await self._client.complete(model=SUMMARY_MODEL,
+                                           messages=[{"role": "system", "content": SUMMARY_PROMPT},
+                                                     {"role": "user", "content": transcript}])
@@ -0,0 +1,254 @@
+import asyncio
+import json
+import logging
+import os
+import random
+from collections import deque
+from collections.abc import AsyncIterator
+from typing import Optional
+
+import aiohttp
+
+from services.metrics import registry
+
+OPENAI_API_URL = os.environ.get("OPENAI_API_URL", "https://api.openai.com/v1")
+DEFAULT_TIMEOUT_SECONDS = 30
+DEFAULT_MAX_RETRIES = 2
+RETRY_BASE_SECONDS = 0.25
+RETRY_MAX_SECONDS = 4
+DEFAULT_CONNECTIONS = 32
+KEEPALIVE_SECONDS = 60
+# First token latencies kept for the hedging percentile
+LATENCY_WINDOW = 200
+HEDGE_PERCENTILE = 95
+# Hedging waits until there are enough samples for the percentile to mean something
+HEDGE_MIN_SAMPLES = 20
+
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+first_token_seconds = registry.histogram("llm_first_token_seconds", "Time from an LLM request to its first token")
+retries_total = registry.counter("llm_retries", "LLM requests retried")
+hedges_total = registry.counter("llm_hedges", "Hedged LLM requests sent, and how many of them won",
+                                labelnames=("won",))
+
+
+class LLMError(Exception):
+    pass
+
+
+class RetryableLLMError(LLMError):
+    pass
+
+
+async def parse_sse(content: aiohttp.StreamReader) -> AsyncIterator[str]:
+    """Yields the data of each server-sent event, until the stream ends or sends [DONE]."""
+    data = []
+    async for line in content:
+        line = line.decode("utf-8").rstrip("\r\n")
+        if line == "":
+            if data:
+                event = "\n".join(data)
+                data = []
+                if event == "[DONE]":
+                    return
+                yield event
+        elif line.startswith("data:"):
+            data.append(line[5:].lstrip(" "))
+        # Comments, event names and ids aren't used by the completions API
+
+    if data and "\n".join(data) != "[DONE]":
+        yield "\n".join(data)
+
+
+class LatencyTracker:
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._samples = deque(maxlen=window)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+
+class LLMClient:
+    """Streams chat completions, the transport behind ChatGPT."""
+
+    def stream(self, model: str, messages: [dict]) -> AsyncIterator[str]:
+        raise NotImplementedError
+
+    async def complete(self, model: str, messages: [dict]) -> str:
+        result = ""
+        async for token in self.stream(model=model, messages=messages):
+            result += token
+        return result
+
+    async def close(self):
+        pass
+
+
+class OpenAIClient(LLMClient):
+    """Talks to the OpenAI chat completions API, or any server compatible with it.
+
+    Requests share one pooled aiohttp session. Each request has a deadline
+    covering all of its attempts, and failures before the first token are
+    retried with jittered exponential backoff. With hedge=True, a duplicate
+    request is sent if the first token hasn't arrived within the p95 of
+    recent first token latencies, and whichever answers first is used.
+    """
+
+    def __init__(self,
+                 base_url: str = OPENAI_API_URL,
+                 api_key: Optional[str] = None,
+                 timeout_seconds: float = DEFAULT_TIMEOUT_SECONDS,
+                 max_retries: int = DEFAULT_MAX_RETRIES,
+                 hedge: bool = False,
+                 connections: int = DEFAULT_CONNECTIONS):
+        self._base_url = base_url.rstrip("/")
+        self._api_key = api_key
+        self._timeout_seconds = timeout_seconds
+        self._max_retries = max_retries
+        self._hedge = hedge
+        self._connections = connections
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.first_token_latency = LatencyTracker()
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self._connections, keepalive_timeout=KEEPALIVE_SECONDS)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def stream(self, model: str, messages: [dict]) -> AsyncIterator[str]:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self._timeout_seconds
+        attempt = 0
+        while True:
+            started = False
+            try:
+                async for token in self._hedged(model, messages, deadline):
+                    started = True
+                    yield token
+                return
+            except RetryableLLMError as e:
+                # Once tokens have been passed on a retry would repeat them
+                delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt) * random.uniform(0.5, 1)
+                if started or attempt >= self._max_retries or loop.time() + delay >= deadline:
+                    raise
+                logging.warning("LLM request failed, retrying in %.2fs: %s", delay, e)
+                attempt += 1
+                self.retries += 1
+                retries_total.inc()
+                await asyncio.sleep(delay)
+
+    async def _hedged(self, model: str, messages: [dict], deadline: float) -> AsyncIterator[str]:
+        loop = asyncio.get_running_loop()
+        hedge_after = None
+        if self._hedge and len(self.first_token_latency) >= HEDGE_MIN_SAMPLES:
+            hedge_after = self.first_token_latency.percentile(HEDGE_PERCENTILE)
+
+        started = loop.time()
+        primary = self._request(model, messages, deadline)
+        attempts = {asyncio.ensure_future(primary.__anext__()): primary}
+        winner = None
+        first = None
+        hedged = False
+        try:
+            while winner is None:
+                timeout = None
+                if hedge_after is not None and len(attempts) == 1:
+                    timeout = max(0.0, started + hedge_after - loop.time())
+                done, _ = await asyncio.wait(attempts.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # Slower than usual, race a second request against the first
+                    self.hedges += 1
+                    hedged = True
+                    hedge_after = None
+                    backup = self._request(model, messages, deadline)
+                    attempts[asyncio.ensure_future(backup.__anext__())] = backup
+                    continue
+
+                for future in done:
+                    generator = attempts.pop(future)
+                    try:
+                        first = future.result()
+                    except StopAsyncIteration:
+                        # An empty answer is still an answer
+                        return
+                    except LLMError:
+                        # Fails over to the other attempt if there is one
+                        if not attempts:
+                            raise
+                        continue
+                    winner = generator
+                    if hedged:
+                        hedges_total.inc(won="true" if generator is not primary else "false")
+                    if generator is not primary:
+                        self.hedge_wins += 1
+                    break
+        finally:
+            for future, generator in attempts.items():
+                future.cancel()
+                await asyncio.gather(future, return_exceptions=True)
+                await generator.aclose()
+
+        latency = loop.time() - started
+        self.first_token_latency.record(latency)
+        first_token_seconds.observe(latency)
+        try:
+            yield first
+            async for token in winner:
+                yield token
+        finally:
+            await winner.aclose()
+
+    async def _request(self, model: str, messages: [dict], deadline: float) -> AsyncIterator[str]:
+        remaining = deadline - asyncio.get_running_loop().time()
+        if remaining <= 0:
+            raise LLMError("LLM request deadline exceeded")
+
+        api_key = self._api_key or os.environ.get("OPENAI_API_KEY", "")
+        headers = {"Authorization": f"Bearer {api_key}"}
+        body = {"model": model, "messages": messages, "n": 1, "stream": True}
+        try:
+            async with self._get_session().post(f"{self._base_url}/chat/completions",
+                                                json=body,
+                                                headers=headers,
+                                                timeout=aiohttp.ClientTimeout(total=remaining)) as resp:
+                if resp.status in RETRYABLE_STATUSES:
+                    raise RetryableLLMError(f"LLM request failed with status {resp.status}")
+                if resp.status != 200:
+                    raise LLMError(f"LLM request failed with status {resp.status}: {await resp.text()}")
+
+                async for event in parse_sse(resp.content):
+                    chunk = json.loads(event)
+                    content = chunk["choices"][0].get("delta", {}).get("content")
+                    if content:
+                        yield content
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise RetryableLLMError(f"LLM request failed: {e!r}") from e
+
+
+_default_client: Optional[OpenAIClient] = None
+
+
+def default_client() -> OpenAIClient:
+    """The client shared by everything in the process that doesn't bring its own."""
+    global _default_client
+    if _default_client is None:
+        _default_client = OpenAIClient(hedge=os.environ.get("OPENAI_HEDGE") == "1")
+    return _default_client
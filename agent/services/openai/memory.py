@@ -0,0 +1,133 @@
+import asyncio
+import logging
+from collections import deque
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from typing import Optional
+
+DEFAULT_MODEL = "gpt-3.5-turbo"
+DEFAULT_MAX_TOKENS = 2000
+# Every message costs a few tokens of framing on top of its content
+TOKENS_PER_MESSAGE = 4
+# Used when the tiktoken encoding can't be loaded, e.g. offline
+CHARS_PER_TOKEN = 4
+# Evicted turns are folded into the summary once there are this many tokens of them
+SUMMARIZE_AFTER_TOKENS = 300
+
+_encodings = {}
+
+
+def count_tokens(text: str, model: str = DEFAULT_MODEL) -> int:
+    if model not in _encodings:
+        try:
+            import tiktoken
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except Exception:
+            logging.warning("No tiktoken encoding for %s, estimating token counts", model)
+            _encodings[model] = None
+
+    encoding = _encodings[model]
+    if encoding is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(encoding.encode(text))
+
+
+@dataclass
+class _Entry:
+    message: object
+    api: dict
+    tokens: int
+
+
+class ConversationMemory:
+    """Conversation history trimmed to a token budget.
+
+    Messages are serialized and their tokens counted once, when added, and
+    the oldest turns are evicted as soon as the history goes over budget, so
+    a request costs the same however long the session runs. If a summarizer
+    is given, evicted turns are folded into a rolling summary in the
+    background, and the summary is sent after the prompt.
+    """
+
+    def __init__(self,
+                 prompt: str,
+                 max_tokens: int = DEFAULT_MAX_TOKENS,
+                 model: str = DEFAULT_MODEL,
+                 summarizer: Optional[Callable[[str, list[dict]], Awaitable[str]]] = None):
+        self._model = model
+        self._max_tokens = max_tokens
+        self._prompt = {"role": "system", "content": prompt}
+        self._prompt_tokens = self._count(self._prompt)
+        self._entries: deque[_Entry] = deque()
+        self._history_tokens = 0
+        self._summarizer = summarizer
+        self._summary: Optional[_Entry] = None
+        self._summary_text = ""
+        self._evicted: list[dict] = []
+        self._evicted_tokens = 0
+        self._summary_task: Optional[asyncio.Task] = None
+        self._api_messages: Optional[list[dict]] = None
+
+    @property
+    def tokens(self) -> int:
+        """Tokens the prompt, summary and history will take up in the next request."""
+        summary_tokens = self._summary.tokens if self._summary is not None else 0
+        return self._prompt_tokens + summary_tokens + self._history_tokens
+
+    @property
+    def messages(self) -> list:
+        return [entry.message for entry in self._entries]
+
+    @property
+    def summary(self) -> str:
+        return self._summary_text
+
+    def add(self, message):
+        entry = _Entry(message=message, api=message.toAPI(), tokens=0)
+        entry.tokens = self._count(entry.api)
+        self._entries.append(entry)
+        self._history_tokens += entry.tokens
+        self._api_messages = None
+
+        # Always keeps the newest message, even if it's over budget on its own
+        while self.tokens > self._max_tokens and len(self._entries) > 1:
+            self._evict(self._entries.popleft())
+
+    def api_messages(self) -> list[dict]:
+        """The prompt, summary and history in API format, rebuilt only after a change."""
+        if self._api_messages is None:
+            summary = [self._summary.api] if self._summary is not None else []
+            self._api_messages = [self._prompt] + summary + [entry.api for entry in self._entries]
+        return self._api_messages
+
+    def _count(self, api_message: dict) -> int:
+        return TOKENS_PER_MESSAGE + count_tokens(api_message["content"], self._model)
+
+    def _evict(self, entry: _Entry):
+        self._history_tokens -= entry.tokens
+        if self._summarizer is None:
+            return
+
+        self._evicted.append(entry.api)
+        self._evicted_tokens += entry.tokens
+        if self._evicted_tokens >= SUMMARIZE_AFTER_TOKENS and self._summary_task is None:
+            self._summary_task = asyncio.create_task(self._summarize())
+
+    async def _summarize(self):
+        evicted, self._evicted = self._evicted, []
+        self._evicted_tokens = 0
+        try:
+            summary = await self._summarizer(self._summary_text, evicted)
+        except Exception:
+            logging.exception("Failed to summarize conversation")
+            summary = None
+        finally:
+            self._summary_task = None
+
+        if summary:
+            self._summary_text = summary
+            api = {"role": "system", "content": f"Summary of the conversation so far: {summary}"}
+            self._summary = _Entry(message=None, api=api, tokens=self._count(api))
+            self._api_messages = None
+            while self.tokens > self._max_tokens and len(self._entries) > 1:
+                self._evict(self._entries.popleft())
@@ -0,0 +1,163 @@
+import asyncio
+import inspect
+import re
+import time
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Awaitable, Callable
+from dataclasses import dataclass
+from typing import Optional, Union
+
+import numpy as np
+
+DEFAULT_MAX_ENTRIES = 512
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+DEFAULT_SIMILARITY_THRESHOLD = 0.92
+DEFAULT_TOP_K = 4
+# Short or non-question turns ("yes", "tell me more") depend on the conversation
+MIN_QUESTION_WORDS = 3
+# Pace of replayed answers, one word per tick so TTS chunking behaves as it does live
+REPLAY_TOKEN_INTERVAL_SECONDS = 0.0
+
+EmbeddingFunction = Callable[[str], Union[np.ndarray, Awaitable[np.ndarray]]]
+
+_PUNCTUATION = re.compile(r"[^\w\s']")
+
+
+def normalize_question(text: str) -> str:
+    return " ".join(_PUNCTUATION.sub(" ", text).lower().split())
+
+
+def is_cacheable(question: str) -> bool:
+    return question.rstrip().endswith("?") and len(normalize_question(question).split()) >= MIN_QUESTION_WORDS
+
+
+async def replay(answer: str, interval: float = REPLAY_TOKEN_INTERVAL_SECONDS) -> AsyncIterator[str]:
+    """Streams a cached answer back a word at a time, like a completion would."""
+    for i, word in enumerate(answer.split(" ")):
+        yield word if i == 0 else " " + word
+        await asyncio.sleep(interval)
+
+
+async def openai_embedding(text: str) -> np.ndarray:
+    import openai
+    response = await openai.Embedding.acreate(model="text-embedding-ada-002", input=text)
+    return np.asarray(response["data"][0]["embedding"], dtype=np.float32)
+
+
+@dataclass
+class _Entry:
+    answer: str
+    context: str
+    expires: float
+    row: Optional[int] = None
+
+
+class ResponseCache:
+    """Answers to questions that have been asked before.
+
+    An answer is only given back for the context it was cached in, e.g. a
+    hash of the conversation before the question, so "what about tomorrow?"
+    isn't answered about a different day. Questions are matched exactly after
+    normalization. If an embedding
+    function is given, they are also matched by cosine similarity against the
+    embeddings of cached questions, kept as unit rows of one preallocated
+    matrix so a lookup is a single matrix-vector product and a top-k
+    partition. Entries expire after ttl_seconds, and the least recently used
+    entry is evicted once max_entries are cached.
+    """
+
+    def __init__(self,
+                 max_entries: int = DEFAULT_MAX_ENTRIES,
+                 ttl_seconds: float = DEFAULT_TTL_SECONDS,
+                 embed: Optional[EmbeddingFunction] = None,
+                 similarity_threshold: float = DEFAULT_SIMILARITY_THRESHOLD,
+                 top_k: int = DEFAULT_TOP_K):
+        self._max_entries = max_entries
+        self._ttl_seconds = ttl_seconds
+        self._embed = embed
+        self._similarity_threshold = similarity_threshold
+        self._top_k = top_k
+        self._entries: OrderedDict[tuple[str, str], _Entry] = OrderedDict()
+        self._matrix: Optional[np.ndarray] = None
+        self._row_keys: list[Optional[tuple[str, str]]] = [None] * max_entries
+        self._free_rows = list(range(max_entries - 1, -1, -1))
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def get(self, question: str, context: str = "") -> Optional[str]:
+        key = (context, normalize_question(question))
+        now = time.monotonic()
+        entry = self._live_entry(key, now)
+        if entry is not None:
+            self.exact_hits += 1
+            return entry.answer
+
+        if self._embed is not None and self._matrix is not None:
+            for match in self._nearest(await self._embedding(question)):
+                entry = self._live_entry(match, now)
+                if entry is not None and entry.context == context:
+                    self.semantic_hits += 1
+                    return entry.answer
+
+        self.misses += 1
+        return None
+
+    async def put(self, question: str, answer: str, context: str = ""):
+        key = (context, normalize_question(question))
+        entry = self._live_entry(key, time.monotonic())
+        if entry is not None and entry.answer == answer:
+            # Replayed from the cache, only its expiry moves
+            entry.expires = time.monotonic() + self._ttl_seconds
+            return
+        embedding = await self._embedding(question) if self._embed is not None else None
+
+        self._remove(key)
+        while len(self._entries) >= self._max_entries:
+            self._remove(next(iter(self._entries)))
+
+        entry = _Entry(answer=answer, context=context, expires=time.monotonic() + self._ttl_seconds)
+        if embedding is not None:
+            if self._matrix is None:
+                self._matrix = np.zeros((self._max_entries, len(embedding)), dtype=np.float32)
+            entry.row = self._free_rows.pop()
+            self._matrix[entry.row] = embedding
+            self._row_keys[entry.row] = key
+        self._entries[key] = entry
+
+    def _live_entry(self, key: tuple[str, str], now: float) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires < now:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _remove(self, key: tuple[str, str]):
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry.row is not None:
+            # A zero row scores 0 against everything, so it never matches
+            self._matrix[entry.row] = 0
+            self._row_keys[entry.row] = None
+            self._free_rows.append(entry.row)
+
+    async def _embedding(self, text: str) -> np.ndarray:
+        embedding = self._embed(normalize_question(text))
+        if inspect.isawaitable(embedding):
+            embedding = await embedding
+        embedding = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm > 0 else embedding
+
+    def _nearest(self, embedding: np.ndarray) -> [tuple[str, str]]:
+        scores = self._matrix @ embedding
+        k = min(self._top_k, len(scores))
+        candidates = np.argpartition(scores, -k)[-k:]
+        candidates = candidates[np.argsort(scores[candidates])[::-1]]
+        return [self._row_keys[row] for row in candidates
+                if scores[row] >= self._similarity_threshold and self._row_keys[row] is not None]
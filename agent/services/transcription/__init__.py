@@ -1 +1,6 @@
-from .transcriber import Transcriber, EVENT_TYPE_TALKING_FINISHED, EVENT_TYPE_TALKING_STARTED, EVENT_TYPE_TALKING_UPDATED, EVENT_TYPE_NO_SPEECH
\ No newline at end of file
+from .transcriber import Transcriber, get_backend, stop_backends, active_transcribers, inference_queue_depth, EVENT_TYPE_TALKING_FINISHED, EVENT_TYPE_TALKING_STARTED, EVENT_TYPE_TALKING_UPDATED, EVENT_TYPE_TALKING_LIKELY_FINISHED, EVENT_TYPE_NO_SPEECH
+from .inference import InferenceBackend, InferenceScheduler, TranscriptionResult, Segment
+from .models import DEFAULT_MODEL, DEFAULT_QUANTIZED, ModelRegistry, registry
+from .process_pool import ProcessPoolBackend
+from .endpointing import Endpointer, transcript_cue
+from .vad import VoiceActivityDetector, EnergyVAD, SileroVAD
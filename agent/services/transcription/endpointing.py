@@ -0,0 +1,109 @@
+import os
+from typing import Optional
+
+import numpy as np
+
+ENDPOINT_LIKELY_FINISHED = "likely_finished"
+ENDPOINT_FINISHED = "finished"
+
+CUE_COMPLETE = "complete"
+CUE_UNKNOWN = "unknown"
+CUE_INCOMPLETE = "incomplete"
+
+# Words a finished sentence rarely ends on, the caller is probably pausing mid-phrase
+CONTINUATION_WORDS = {
+    "a", "an", "and", "are", "as", "at", "because", "but", "for", "from", "if", "in", "into", "is", "like", "my",
+    "of", "on", "or", "so", "than", "that", "the", "then", "to", "was", "which", "with", "your",
+    "er", "hmm", "uh", "uhm", "um",
+}
+TERMINAL_PUNCTUATION = (".", "?", "!")
+CONTINUATION_PUNCTUATION = (",", ";", ":", "-", "...")
+
+MIN_SILENCE_SECONDS = float(os.environ.get("ENDPOINT_MIN_SILENCE_SECONDS", "0.4"))
+SILENCE_SECONDS = float(os.environ.get("ENDPOINT_SILENCE_SECONDS", "0.7"))
+MAX_SILENCE_SECONDS = float(os.environ.get("ENDPOINT_MAX_SILENCE_SECONDS", "1.2"))
+LIKELY_SILENCE_SECONDS = float(os.environ.get("ENDPOINT_LIKELY_SILENCE_SECONDS", "0.3"))
+
+
+def transcript_cue(text: str) -> str:
+    """Guesses from its wording whether a transcript is a finished turn."""
+    text = text.strip()
+    if not text:
+        return CUE_UNKNOWN
+    if text.endswith(CONTINUATION_PUNCTUATION):
+        return CUE_INCOMPLETE
+    last_word = text.split()[-1].strip(".?!,;:\"'").lower()
+    if last_word in CONTINUATION_WORDS:
+        return CUE_INCOMPLETE
+    if text.endswith(TERMINAL_PUNCTUATION):
+        return CUE_COMPLETE
+    return CUE_UNKNOWN
+
+
+class Endpointer:
+    """Decides when a caller has finished their turn, from VAD frames and the
+    transcript so far.
+
+    Trailing silence is counted frame by frame, starting with the VAD's
+    hangover since it only reports silence that long after the speech ended.
+    The turn ends after min_silence_seconds if the transcript reads like a
+    finished sentence, max_silence_seconds if it trails off mid-phrase and
+    silence_seconds otherwise. Once likely_silence_seconds have passed on a
+    transcript that doesn't trail off, the turn is reported as likely
+    finished, once per pause.
+    """
+
+    def __init__(self,
+                 hangover_seconds: float = 0.0,
+                 min_silence_seconds: float = MIN_SILENCE_SECONDS,
+                 silence_seconds: float = SILENCE_SECONDS,
+                 max_silence_seconds: float = MAX_SILENCE_SECONDS,
+                 likely_silence_seconds: float = LIKELY_SILENCE_SECONDS):
+        self._hangover_seconds = hangover_seconds
+        self._timeouts = {CUE_COMPLETE: min_silence_seconds,
+                          CUE_UNKNOWN: silence_seconds,
+                          CUE_INCOMPLETE: max_silence_seconds}
+        self._likely_silence_seconds = likely_silence_seconds
+        self.trailing_silence = 0.0
+        self._heard_speech = False
+        self._likely_sent = False
+
+    def reset(self):
+        self.trailing_silence = 0.0
+        self._heard_speech = False
+        self._likely_sent = False
+
+    def timeout(self, text: str) -> float:
+        return self._timeouts[transcript_cue(text)]
+
+    def update(self, voiced: np.ndarray, frame_seconds: float, text: str, active: bool = True) -> Optional[str]:
+        """Takes the VAD's flags for the latest frames and returns ENDPOINT_FINISHED,
+        ENDPOINT_LIKELY_FINISHED or None. Silence is tracked even while not
+        active, so a turn that ended before it became one is still timed right."""
+        voiced_at = np.flatnonzero(voiced)
+        if len(voiced_at) > 0:
+            self._heard_speech = True
+            self._likely_sent = False
+            self.trailing_silence = 0.0
+            silent_frames = len(voiced) - 1 - voiced_at[-1]
+        else:
+            silent_frames = len(voiced)
+        if not self._heard_speech:
+            return None
+        if silent_frames > 0:
+            if self.trailing_silence == 0.0:
+                self.trailing_silence = self._hangover_seconds
+            self.trailing_silence += silent_frames * frame_seconds
+
+        if not active or self.trailing_silence == 0.0:
+            return None
+        cue = transcript_cue(text)
+        if self.trailing_silence >= self._timeouts[cue]:
+            # trailing_silence is left as it was until speech starts again
+            self._heard_speech = False
+            self._likely_sent = False
+            return ENDPOINT_FINISHED
+        if not self._likely_sent and cue != CUE_INCOMPLETE and self.trailing_silence >= self._likely_silence_seconds:
+            self._likely_sent = True
+            return ENDPOINT_LIKELY_FINISHED
+        return None
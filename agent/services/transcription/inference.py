@@ -0,0 +1,264 @@
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Optional
+
+import numpy as np
+
+from .models import DEFAULT_MODEL, DEFAULT_QUANTIZED, registry
+from .ring_buffer import AudioRingBuffer
+
+NO_SPEECH_THRESHOLD = 0.5
+DEFAULT_MAX_BATCH_SIZE = 8
+DEFAULT_MAX_WAIT_SECONDS = 0.05
+WHISPER_SAMPLE_RATE = 16000
+WHISPER_CHUNK_SECONDS = 30
+# Whisper emits one timestamp token every 20ms (2x conv stride * 160 sample hop)
+TIMESTAMP_RESOLUTION_SECONDS = 0.02
+
+
+@dataclass
+class Segment:
+    start: float
+    end: float
+    text: str
+
+
+@dataclass
+class TranscriptionResult:
+    segments: [Segment] = field(default_factory=list)
+    no_speech_prob: float = 1.0
+
+    @property
+    def is_speech(self) -> bool:
+        return self.no_speech_prob < NO_SPEECH_THRESHOLD and len(self.segments) > 0
+
+    @property
+    def text(self) -> str:
+        if not self.is_speech:
+            return ""
+        return "".join(segment.text for segment in self.segments)
+
+
+class WhisperDecoder:
+    """Runs batched Whisper decoding and splits the output into timed segments."""
+
+    def __init__(self, model):
+        import whisper
+
+        self.model = model
+        self._tokenizer = whisper.tokenizer.get_tokenizer(model.is_multilingual, language="en", task="transcribe")
+
+    def decode(self, buffers: [np.ndarray], prompt: Optional[str]) -> [TranscriptionResult]:
+        import torch
+        import whisper
+
+        model = self.model
+        mel = torch.stack([whisper.log_mel_spectrogram(whisper.pad_or_trim(buffer)) for buffer in buffers])
+        options = whisper.DecodingOptions(language="en",
+                                          prompt=prompt,
+                                          fp16=model.device.type != "cpu")
+        with torch.no_grad():
+            decoded = whisper.decode(model, mel.to(model.device), options)
+
+        return [TranscriptionResult(segments=self._segments(d.tokens, len(buffer) / WHISPER_SAMPLE_RATE),
+                                    no_speech_prob=d.no_speech_prob)
+                for d, buffer in zip(decoded, buffers)]
+
+    def _segments(self, tokens: [int], duration: float) -> [Segment]:
+        timestamp_begin = self._tokenizer.timestamp_begin
+
+        # Segments are delimited by timestamp tokens: <|t0|> text <|t1|><|t1|> text <|t2|>
+        segments = []
+        start = None
+        text_tokens = []
+        for token in tokens:
+            if token < timestamp_begin:
+                text_tokens.append(token)
+                continue
+
+            seconds = (token - timestamp_begin) * TIMESTAMP_RESOLUTION_SECONDS
+            if start is None:
+                start = seconds
+            elif len(text_tokens) > 0:
+                segments.append(Segment(start=start, end=seconds, text=self._tokenizer.decode(text_tokens)))
+                text_tokens = []
+                start = None
+            else:
+                start = seconds
+
+        # Unterminated trailing segment, runs to the end of the audio
+        if len(text_tokens) > 0:
+            segments.append(Segment(start=start or 0.0,
+                                    end=min(duration, WHISPER_CHUNK_SECONDS),
+                                    text=self._tokenizer.decode(text_tokens)))
+
+        return segments
+
+
+def batch_prompt(prompts: [Optional[str]]) -> Optional[str]:
+    """The prompt to decode a batch with. Whisper takes one prompt per decode pass
+    and each stream prompts with its own committed text, so a batch that spans
+    several prompts is decoded without one rather than split into passes of
+    about one row each. The prompt only steers spelling and style, the audio
+    the words come from is the same."""
+    first = prompts[0]
+    return first if all(prompt == first for prompt in prompts) else None
+
+
+class InferenceBackend:
+    """Where Transcribers send their decode windows.
+
+    Each stream gets an id and a window buffer from the backend, so backends
+    that run Whisper elsewhere can hand out storage the decoder can read
+    without copying.
+    """
+
+    def __init__(self):
+        self._stream_ids = itertools.count(1)
+
+    def new_stream_id(self) -> int:
+        return next(self._stream_ids)
+
+    def create_window(self, stream_id: int, capacity: int) -> AudioRingBuffer:
+        return AudioRingBuffer(capacity)
+
+    def release_stream(self, stream_id: int):
+        pass
+
+    def stop(self):
+        pass
+
+    @property
+    def queue_depth(self) -> int:
+        return 0
+
+    def submit(self, stream_id: int, buffer: np.ndarray, prompt: Optional[str] = None) -> Future:
+        raise NotImplementedError
+
+    def transcribe(self, stream_id: int, buffer: np.ndarray, prompt: Optional[str] = None) -> TranscriptionResult:
+        return self.submit(stream_id, buffer, prompt).result()
+
+
+@dataclass
+class _Request:
+    stream_id: int
+    buffer: np.ndarray
+    prompt: Optional[str]
+    future: Future
+    submitted: float
+
+
+class InferenceScheduler(InferenceBackend):
+    """Shares one Whisper model between every Transcriber in the process.
+
+    Pending step buffers from all streams are collected into a single batched
+    mel/decode pass. A batch is dispatched as soon as it is full or the oldest
+    request has waited max_wait_seconds. Streams are served round-robin, one
+    request per stream per batch, so a chatty stream can't starve the others.
+    Every batch is a single decode pass, see batch_prompt.
+    """
+
+    def __init__(self,
+                 model_name: str = DEFAULT_MODEL,
+                 quantized: bool = DEFAULT_QUANTIZED,
+                 max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+                 max_wait_seconds: float = DEFAULT_MAX_WAIT_SECONDS):
+        super().__init__()
+        self._model_name = model_name
+        self._quantized = quantized
+        self._decoder: Optional[WhisperDecoder] = None
+        self._max_batch_size = max_batch_size
+        self._max_wait_seconds = max_wait_seconds
+        self._pending: OrderedDict[int, deque[_Request]] = OrderedDict()
+        self._pending_count = 0
+        self._oldest_pending_time = 0.0
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def queue_depth(self) -> int:
+        return self._pending_count
+
+    def start(self):
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def submit(self, stream_id: int, buffer: np.ndarray, prompt: Optional[str] = None) -> Future:
+        # The buffer isn't copied, callers must leave it untouched until the future resolves
+        self.start()
+        request = _Request(stream_id=stream_id, buffer=buffer, prompt=prompt, future=Future(),
+                           submitted=time.monotonic())
+        with self._condition:
+            if self._pending_count == 0:
+                self._oldest_pending_time = request.submitted
+            self._pending.setdefault(stream_id, deque()).append(request)
+            self._pending_count += 1
+            self._condition.notify()
+        return request.future
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            prompt = batch_prompt([request.prompt for request in batch])
+            try:
+                results = self._get_decoder().decode([r.buffer for r in batch], prompt)
+            except Exception as e:
+                logging.exception("Batched transcription failed")
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+
+            for request, result in zip(batch, results):
+                request.future.set_result(result)
+
+    def stop(self):
+        with self._condition:
+            decoder, self._decoder = self._decoder, None
+        if decoder is not None:
+            registry.release(self._model_name, self._quantized)
+
+    def _get_decoder(self) -> WhisperDecoder:
+        # Resolved once and pinned, so schedulers for more models than the registry keeps
+        # don't evict and reload each other's every batch
+        if self._decoder is None:
+            self._decoder = WhisperDecoder(registry.acquire(self._model_name, self._quantized))
+        return self._decoder
+
+    def _next_batch(self) -> [_Request]:
+        with self._condition:
+            while self._pending_count == 0:
+                self._condition.wait()
+
+            # Give other streams a chance to join the batch
+            deadline = self._oldest_pending_time + self._max_wait_seconds
+            while len(self._pending) < self._max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            batch = []
+            for stream_id in list(self._pending.keys()):
+                if len(batch) >= self._max_batch_size:
+                    break
+                requests = self._pending[stream_id]
+                batch.append(requests.popleft())
+                # Served streams go to the back of the line for the next batch
+                if len(requests) == 0:
+                    del self._pending[stream_id]
+                else:
+                    self._pending.move_to_end(stream_id)
+
+            self._pending_count -= len(batch)
+            if self._pending_count > 0:
+                # Left over requests have already waited, they don't get a fresh max_wait
+                self._oldest_pending_time = min(requests[0].submitted for requests in self._pending.values())
+            return batch
@@ -0,0 +1,60 @@
+import ctypes
+import time
+
+import numpy as np
+
+INT16_SCALE = np.float32(1.0 / 32768.0)
+
+
+def int16_view(data) -> (np.ndarray, bool):
+    """Views a frame's PCM data as int16 samples, returns whether a copy was needed."""
+    if isinstance(data, ctypes.Array):
+        return np.ctypeslib.as_array(data), False
+    try:
+        return np.frombuffer(data, dtype=np.int16), False
+    except TypeError:
+        return np.asarray(data, dtype=np.int16), True
+
+
+def int16_to_float32(samples: np.ndarray, out: np.ndarray):
+    """Converts int16 PCM straight into a preallocated float32 slice."""
+    np.multiply(samples, INT16_SCALE, out=out, casting='unsafe')
+
+
+class IngestStats:
+    """Counts what the ingest path does for each second of frames.
+
+    copies counts frames whose PCM couldn't be viewed in place and had to
+    be copied, which should stay at zero with LiveKit's frames.
+    resampled_frames counts frames LiveKit had to remix/resample natively
+    before we could read them. benchmarks/ingest.py measures the memory the
+    path actually allocates.
+    """
+
+    def __init__(self):
+        self.frames = 0
+        self.copies = 0
+        self.resampled_frames = 0
+        self.copies_per_second = 0.0
+        self.resampled_frames_per_second = 0.0
+        self._window_start = time.monotonic()
+        self._window_copies = 0
+        self._window_resampled_frames = 0
+
+    def record_frame(self, copied: bool = False, resampled: bool = False):
+        self.frames += 1
+        if copied:
+            self.copies += 1
+            self._window_copies += 1
+        if resampled:
+            self.resampled_frames += 1
+            self._window_resampled_frames += 1
+
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed >= 1.0:
+            self.copies_per_second = self._window_copies / elapsed
+            self.resampled_frames_per_second = self._window_resampled_frames / elapsed
+            self._window_start = now
+            self._window_copies = 0
+            self._window_resampled_frames = 0
@@ -0,0 +1,105 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+DEFAULT_MODEL = os.environ.get("TRANSCRIPTION_MODEL", "tiny.en")
+DEFAULT_QUANTIZED = os.environ.get("TRANSCRIPTION_QUANTIZED", "0") == "1"
+# How many differently sized/quantized models can stay loaded at once
+DEFAULT_CAPACITY = 2
+
+
+def quantize_dynamic_int8(model):
+    """Swaps the model's linear layers for int8 dynamically quantized ones, CPU only."""
+    import torch
+    import whisper.model
+
+    # Whisper's Linear only overrides forward to cast weights, quantize_dynamic
+    # matches on exact types so it has to look like a plain nn.Linear first
+    for module in model.modules():
+        if type(module) is whisper.model.Linear:
+            module.__class__ = torch.nn.Linear
+
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class ModelRegistry:
+    """Loads Whisper models on first use and keeps the most recently used ones.
+
+    Models are shared by every agent in the process. Loading happens outside
+    the registry lock, so a slow load only blocks callers waiting on that model.
+    Acquired models are pinned until released and never evicted, capacity only
+    bounds how many unpinned ones are kept around.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self._capacity = capacity
+        self._models: OrderedDict[tuple[str, bool], object] = OrderedDict()
+        self._loading: dict[tuple[str, bool], threading.Lock] = {}
+        self._pins: dict[tuple[str, bool], int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str = DEFAULT_MODEL, quantized: bool = DEFAULT_QUANTIZED):
+        key = (name, quantized)
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self._models.move_to_end(key)
+                return model
+            load_lock = self._loading.setdefault(key, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                model = self._models.get(key)
+            if model is not None:
+                return model
+
+            model = self._load(name, quantized)
+            with self._lock:
+                self._models[key] = model
+                self._loading.pop(key, None)
+                self._evict()
+            return model
+
+    def acquire(self, name: str = DEFAULT_MODEL, quantized: bool = DEFAULT_QUANTIZED):
+        """Like get, but the model stays loaded until release is called for it."""
+        key = (name, quantized)
+        model = self.get(name, quantized)
+        with self._lock:
+            self._pins[key] = self._pins.get(key, 0) + 1
+            # Another load may have evicted it since get returned
+            self._models.setdefault(key, model)
+        return model
+
+    def release(self, name: str = DEFAULT_MODEL, quantized: bool = DEFAULT_QUANTIZED):
+        key = (name, quantized)
+        with self._lock:
+            pins = self._pins.get(key, 0) - 1
+            if pins > 0:
+                self._pins[key] = pins
+            else:
+                self._pins.pop(key, None)
+            self._evict()
+
+    def loaded(self) -> [tuple[str, bool]]:
+        with self._lock:
+            return list(self._models.keys())
+
+    def _evict(self):
+        # Called with the lock held, least recently used first
+        for key in list(self._models.keys()):
+            if len(self._models) <= self._capacity:
+                return
+            if key not in self._pins:
+                del self._models[key]
+                logging.info("Evicted whisper model %s", key)
+
+    def _load(self, name: str, quantized: bool):
+        import whisper
+
+        if quantized:
+            return quantize_dynamic_int8(whisper.load_model(name, device="cpu"))
+        return whisper.load_model(name)
+
+
+registry = ModelRegistry()
@@ -0,0 +1,246 @@
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+from typing import Optional
+
+import numpy as np
+
+from .inference import DEFAULT_MAX_BATCH_SIZE, InferenceBackend, WhisperDecoder, batch_prompt
+from .models import DEFAULT_MODEL, DEFAULT_QUANTIZED, registry
+from .ring_buffer import AudioRingBuffer
+
+SAMPLE_BYTES = np.dtype(np.float32).itemsize
+# How often the result thread checks that the worker processes are still alive
+MONITOR_SECONDS = 1
+STOP_TIMEOUT_SECONDS = 10
+
+RESULT_TAKEN = "taken"
+RESULT_DONE = "done"
+RESULT_STOP = "stop"
+
+
+def _close(shm: shared_memory.SharedMemory):
+    try:
+        shm.close()
+    except BufferError:
+        # Still viewed by someone, the mapping goes away with the last view
+        pass
+
+
+def _worker_main(index: int, model_name: str, quantized: bool, threads: int, max_batch_size: int,
+                 tasks: multiprocessing.Queue, results: multiprocessing.Queue):
+    import torch
+
+    torch.set_num_threads(threads)
+    decoder = WhisperDecoder(registry.get(model_name, quantized))
+
+    stopping = False
+    while not stopping:
+        task = tasks.get()
+        if task is None:
+            return
+        batch = [task]
+        # Pick up whatever else is already waiting, up to a full batch or the pool stopping
+        while len(batch) < max_batch_size:
+            try:
+                task = tasks.get_nowait()
+            except queue.Empty:
+                break
+            if task is None:
+                stopping = True
+                break
+            batch.append(task)
+        # So the pool knows which requests to fail if this process dies with them
+        results.put((RESULT_TAKEN, index, [task[0] for task in batch]))
+
+        # Attach for the duration of the decode only, the main process owns the segments
+        segments = [shared_memory.SharedMemory(name=task[1]) for task in batch]
+        try:
+            buffers = [np.ndarray((length,), dtype=np.float32, buffer=shm.buf, offset=offset * SAMPLE_BYTES)
+                       for (_, _, offset, length, _), shm in zip(batch, segments)]
+            decoded = decoder.decode(buffers, batch_prompt([task[4] for task in batch]))
+            del buffers
+            for task, result in zip(batch, decoded):
+                results.put((RESULT_DONE, index, (task[0], result, None)))
+        except Exception as e:
+            for task in batch:
+                results.put((RESULT_DONE, index, (task[0], None, repr(e))))
+        finally:
+            for shm in segments:
+                _close(shm)
+
+
+class ProcessPoolBackend(InferenceBackend):
+    """Runs Whisper in a fixed pool of worker processes, each with its own model.
+
+    Decode windows live in shared memory, so a request only sends the name,
+    offset and length of the window and only the transcription comes back.
+    The main process keeps the GIL for LiveKit and its event loop.
+
+    Workers report the requests they take, so a worker that dies fails them
+    and is replaced rather than leaving their callers waiting forever.
+    """
+
+    def __init__(self,
+                 model_name: str = DEFAULT_MODEL,
+                 quantized: bool = DEFAULT_QUANTIZED,
+                 num_workers: Optional[int] = None,
+                 threads_per_worker: int = 1,
+                 max_batch_size: int = DEFAULT_MAX_BATCH_SIZE):
+        super().__init__()
+        self._model_name = model_name
+        self._quantized = quantized
+        self._num_workers = num_workers or os.cpu_count() or 1
+        self._threads_per_worker = threads_per_worker
+        self._max_batch_size = max_batch_size
+        self._request_ids = itertools.count(1)
+        self._futures: dict[int, Future] = {}
+        # worker index -> requests it's decoding
+        self._taken: dict[int, list[int]] = {}
+        # stream id -> (shared memory, address of the start of its window storage)
+        self._streams: dict[int, (shared_memory.SharedMemory, int)] = {}
+        self._lock = threading.Lock()
+        self._workers = []
+        self._tasks = None
+        self._results = None
+        self._context = None
+        self._receiver: Optional[threading.Thread] = None
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._futures)
+
+    def start(self):
+        with self._lock:
+            if len(self._workers) > 0:
+                return
+
+            # Forking a process that already has torch threads running isn't safe
+            self._context = multiprocessing.get_context('spawn')
+            self._tasks = self._context.Queue()
+            self._results = self._context.Queue()
+            self._workers = [self._spawn(index) for index in range(self._num_workers)]
+            self._receiver = threading.Thread(target=self._receive_results, daemon=True)
+            self._receiver.start()
+
+    def stop(self):
+        with self._lock:
+            workers, self._workers = self._workers, []
+            if not workers:
+                return
+            for _ in workers:
+                self._tasks.put(None)
+        for worker in workers:
+            worker.join(STOP_TIMEOUT_SECONDS)
+            if worker.is_alive():
+                worker.terminate()
+        self._results.put((RESULT_STOP, None, None))
+        self._receiver.join()
+        with self._lock:
+            # Anything still queued behind the stop never reached a worker
+            futures = self._pop_futures(list(self._futures))
+            self._taken.clear()
+            for stream_id in list(self._streams.keys()):
+                self._release(stream_id)
+        self._fail(futures, "transcription pool stopped")
+
+    def create_window(self, stream_id: int, capacity: int) -> AudioRingBuffer:
+        shm = shared_memory.SharedMemory(create=True, size=capacity * 2 * SAMPLE_BYTES)
+        storage = np.ndarray((capacity * 2,), dtype=np.float32, buffer=shm.buf)
+        with self._lock:
+            self._streams[stream_id] = (shm, storage.ctypes.data)
+        return AudioRingBuffer(capacity, storage)
+
+    def release_stream(self, stream_id: int):
+        with self._lock:
+            self._release(stream_id)
+
+    def submit(self, stream_id: int, buffer: np.ndarray, prompt: Optional[str] = None) -> Future:
+        # The buffer has to be a view into this stream's window, it's read in place by a worker
+        shm, base_address = self._streams[stream_id]
+        offset = (buffer.ctypes.data - base_address) // SAMPLE_BYTES
+        if offset < 0 or (offset + len(buffer)) * SAMPLE_BYTES > shm.size:
+            raise ValueError("buffer is not part of the stream's window")
+
+        self.start()
+        request_id = next(self._request_ids)
+        future = Future()
+        with self._lock:
+            self._futures[request_id] = future
+        self._tasks.put((request_id, shm.name, offset, len(buffer), prompt))
+        return future
+
+    def _release(self, stream_id: int):
+        stream = self._streams.pop(stream_id, None)
+        if stream is not None:
+            shm, _ = stream
+            shm.unlink()
+            _close(shm)
+
+    def _spawn(self, index: int) -> multiprocessing.Process:
+        worker = self._context.Process(target=_worker_main,
+                                       args=(index, self._model_name, self._quantized, self._threads_per_worker,
+                                             self._max_batch_size, self._tasks, self._results),
+                                       daemon=True)
+        worker.start()
+        return worker
+
+    def _pop_futures(self, request_ids: [int]) -> [Future]:
+        """The lock must be held."""
+        futures = [self._futures.pop(request_id, None) for request_id in request_ids]
+        return [future for future in futures if future is not None]
+
+    @staticmethod
+    def _fail(futures: [Future], error: str):
+        # Outside the lock, a future's callbacks may submit again
+        for future in futures:
+            future.set_exception(RuntimeError(error))
+
+    def _check_workers(self):
+        failed = []
+        with self._lock:
+            for index, worker in enumerate(self._workers):
+                if worker.is_alive():
+                    continue
+                logging.error("Transcription worker %d exited with %s, replacing it", index, worker.exitcode)
+                failed.append((self._pop_futures(self._taken.pop(index, [])), worker.exitcode))
+                self._workers[index] = self._spawn(index)
+        for futures, exitcode in failed:
+            self._fail(futures, f"transcription worker exited with {exitcode}")
+
+    def _receive_results(self):
+        next_check = time.monotonic() + MONITOR_SECONDS
+        while True:
+            if time.monotonic() >= next_check:
+                self._check_workers()
+                next_check = time.monotonic() + MONITOR_SECONDS
+            try:
+                kind, index, payload = self._results.get(timeout=MONITOR_SECONDS)
+            except queue.Empty:
+                continue
+            if kind == RESULT_STOP:
+                return
+            if kind == RESULT_TAKEN:
+                with self._lock:
+                    self._taken[index] = payload
+                continue
+
+            request_id, result, error = payload
+            with self._lock:
+                future = self._futures.pop(request_id, None)
+                taken = self._taken.get(index)
+                if taken is not None and request_id in taken:
+                    taken.remove(request_id)
+            if future is None:
+                continue
+            if error is not None:
+                logging.error("Transcription worker failed: %s", error)
+                future.set_exception(RuntimeError(error))
+            else:
+                future.set_result(result)
@@ -0,0 +1,77 @@
+from typing import Optional
+
+import numpy as np
+
+
+class AudioRingBuffer:
+    """Fixed-size float32 audio store with a sliding window over the newest samples.
+
+    Every sample is written twice, at i and i + capacity, so the window is
+    always one contiguous view into the backing array no matter where it
+    starts. Writing and sliding the window never allocate or shift samples.
+    Positions are absolute sample counts since the buffer was created.
+    """
+
+    def __init__(self, capacity: int, storage: Optional[np.ndarray] = None):
+        if storage is None:
+            storage = np.zeros(capacity * 2, dtype=np.float32)
+        if len(storage) < capacity * 2:
+            raise ValueError("storage must hold at least twice the capacity")
+
+        self.capacity = capacity
+        self._data = storage
+        self._start = 0
+        self._end = 0
+
+    def __len__(self) -> int:
+        return self._end - self._start
+
+    @property
+    def start(self) -> int:
+        return self._start
+
+    @property
+    def end(self) -> int:
+        return self._end
+
+    @property
+    def available(self) -> int:
+        return self.capacity - len(self)
+
+    @property
+    def nbytes(self) -> int:
+        return self._data.nbytes
+
+    def write(self, samples: np.ndarray) -> int:
+        """Appends samples and returns how many old samples had to be dropped to fit them."""
+        count = len(samples)
+        if count > self.capacity:
+            samples = samples[count - self.capacity:]
+            count = self.capacity
+
+        dropped = max(count - self.available, 0)
+        self._start += dropped
+
+        position = self._end % self.capacity
+        first = min(count, self.capacity - position)
+        self._data[position:position + first] = samples[0:first]
+        self._data[position + self.capacity:position + self.capacity + first] = samples[0:first]
+        if first < count:
+            rest = count - first
+            self._data[0:rest] = samples[first:]
+            self._data[self.capacity:self.capacity + rest] = samples[first:]
+
+        self._end += count
+        return dropped
+
+    def window(self) -> np.ndarray:
+        position = self._start % self.capacity
+        return self._data[position:position + len(self)]
+
+    def consume(self, count: int) -> int:
+        count = min(count, len(self))
+        self._start += count
+        return count
+
+    def clear(self):
+        self._start = self._end
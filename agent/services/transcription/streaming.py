@@ -0,0 +1,96 @@
+from .inference import Segment
+
+PROMPT_MAX_CHARS = 200
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+class IncrementalTranscript:
+    """Tracks a monologue that is transcribed a window at a time.
+
+    A segment is committed once two consecutive hypotheses agree on it and it
+    isn't the last segment of the window (which may still be growing). The
+    caller drops committed audio from the front of its decode window, so only
+    the unconfirmed tail is ever transcribed again.
+    """
+
+    def __init__(self):
+        self.committed: [Segment] = []
+        self.tentative: [Segment] = []
+        self._committed_text = ""
+        # Start of the decode window, in seconds since the monologue started
+        self._window_offset = 0.0
+
+    @property
+    def text(self) -> str:
+        return self._committed_text + "".join(segment.text for segment in self.tentative)
+
+    @property
+    def segments(self) -> [Segment]:
+        """Committed and tentative segments, timed from the start of the monologue."""
+        return self.committed + [Segment(start=self._window_offset + s.start,
+                                         end=self._window_offset + s.end,
+                                         text=s.text) for s in self.tentative]
+
+    @property
+    def prompt(self) -> str:
+        return self._committed_text[-PROMPT_MAX_CHARS:]
+
+    def update(self, segments: [Segment], commit: bool = True) -> float:
+        """Takes the latest hypothesis for the window and returns how many
+        seconds can be dropped from the front of it."""
+        agreed = 0
+        if commit:
+            for previous, current in zip(self.tentative, segments[:-1]):
+                if _normalize(previous.text) != _normalize(current.text):
+                    break
+                agreed += 1
+
+        return self._commit(segments, agreed)
+
+    def force_commit(self, segments: [Segment], window_seconds: float, keep_seconds: float) -> float:
+        """Commits everything but the last keep_seconds of the window, used when
+        the tail has grown to the size of the decode window."""
+        if len(segments) == 0:
+            cut = max(window_seconds - keep_seconds, 0.0)
+            self._window_offset += cut
+            return cut
+
+        count = len(segments)
+        while count > 1 and segments[count - 1].start > window_seconds - keep_seconds:
+            count -= 1
+        return self._commit(segments, count)
+
+    def skip(self, seconds: float) -> float:
+        """Moves the start of the window on by at least seconds of audio that won't
+        be transcribed again, committing the tentative segments that start in it.
+        Returns how many seconds to drop from the front of the window."""
+        count = 0
+        while count < len(self.tentative) and self.tentative[count].start < seconds:
+            count += 1
+        cut = self._commit(self.tentative, count)
+        if cut >= seconds:
+            return cut
+
+        rest = seconds - cut
+        self.tentative = [Segment(start=s.start - rest, end=s.end - rest, text=s.text) for s in self.tentative]
+        self._window_offset += rest
+        return seconds
+
+    def _commit(self, segments: [Segment], count: int) -> float:
+        if count == 0:
+            self.tentative = segments
+            return 0.0
+
+        cut = segments[count - 1].end
+        for segment in segments[:count]:
+            self.committed.append(Segment(start=self._window_offset + segment.start,
+                                          end=self._window_offset + segment.end,
+                                          text=segment.text))
+            self._committed_text += segment.text
+
+        self.tentative = [Segment(start=s.start - cut, end=s.end - cut, text=s.text) for s in segments[count:]]
+        self._window_offset += cut
+        return cut
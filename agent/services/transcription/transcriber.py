@@ -1,25 +1,90 @@
 import asyncio
-from collections.abc import Callable
-import logging
+from collections.abc import AsyncIterable, Callable
+import os
 import threading
-from dataclasses import dataclass
+import time
+from dataclasses import dataclass, field
+from typing import Optional
 
-import whisper
 import livekit
 import numpy as np
 
+from services.metrics import registry
+from .endpointing import ENDPOINT_FINISHED, ENDPOINT_LIKELY_FINISHED, Endpointer, transcript_cue
+from .inference import InferenceBackend, InferenceScheduler, Segment
+from .ingest import IngestStats, int16_to_float32, int16_view
+from .models import DEFAULT_MODEL, DEFAULT_QUANTIZED
+from .process_pool import ProcessPoolBackend
+from .streaming import IncrementalTranscript
+from .vad import EnergyVAD, VoiceActivityDetector
 
-model = whisper.load_model('tiny.en')
 
 WHISPER_SAMPLE_RATE = 16000
 STEP_SIZE_SECONDS = 1
 MAX_TALKING_SECONDS = 30
+# Audio kept in the decode window when a monologue outgrows it
+WINDOW_OVERLAP_SECONDS = 5
 
 EVENT_TYPE_TALKING_STARTED = "monologue_started"
 EVENT_TYPE_TALKING_FINISHED = "monologue_finished"
 EVENT_TYPE_TALKING_UPDATED = "monologue_updated"
+# The caller has paused where a turn could end, the text is transcribed up to the pause
+EVENT_TYPE_TALKING_LIKELY_FINISHED = "monologue_likely_finished"
 EVENT_TYPE_NO_SPEECH = "no_speech"
 
+# Number of worker processes to run Whisper in, 0 runs it on a thread in this process
+TRANSCRIPTION_PROCESSES = int(os.environ.get("TRANSCRIPTION_PROCESSES", "0"))
+# End turns on the endpointer's frame level silence timer instead of only after a whole silent step
+ENDPOINTING = os.environ.get("TRANSCRIPTION_ENDPOINTING", "1") == "1"
+
+_backends: dict[tuple[str, bool], InferenceBackend] = {}
+_backends_lock = threading.Lock()
+_active_transcribers: set["Transcriber"] = set()
+
+ingest_seconds = registry.histogram("transcriber_frame_ingest_seconds",
+                                    "Time to resample and convert one audio frame into the step buffer")
+vad_seconds = registry.histogram("transcriber_vad_seconds", "Time to run voice activity detection on one frame")
+transcribe_seconds = registry.histogram("transcriber_transcribe_seconds",
+                                        "Time to transcribe the decode window, queueing included")
+steps_total = registry.counter("transcriber_steps", "Steps processed, by whether they were voiced",
+                               labelnames=("voiced",))
+endpoint_silence_seconds = registry.histogram("transcriber_endpoint_silence_seconds",
+                                              "Trailing silence when the endpointer ended a turn",
+                                              labelnames=("cue",))
+
+
+def get_backend(model_name: str = DEFAULT_MODEL, quantized: bool = DEFAULT_QUANTIZED) -> InferenceBackend:
+    """Returns the process wide backend for a model, models themselves are only loaded on first use."""
+    with _backends_lock:
+        key = (model_name, quantized)
+        if key not in _backends:
+            if TRANSCRIPTION_PROCESSES > 0:
+                _backends[key] = ProcessPoolBackend(model_name, quantized, num_workers=TRANSCRIPTION_PROCESSES)
+            else:
+                _backends[key] = InferenceScheduler(model_name, quantized)
+        return _backends[key]
+
+
+def stop_backends():
+    """Stops every backend in the process, for shutdown. Transcriptions still waiting fail."""
+    with _backends_lock:
+        backends = list(_backends.values())
+        _backends.clear()
+    for backend in backends:
+        backend.stop()
+
+
+def active_transcribers() -> int:
+    return len(_active_transcribers)
+
+
+def inference_queue_depth() -> int:
+    """Transcriptions waiting on every backend in this process, a measure of how busy the models are."""
+    with _backends_lock:
+        backends = list(_backends.values())
+    return sum(backend.queue_depth for backend in backends)
+
+
 class Transcriber:
 
     @dataclass
@@ -28,75 +93,249 @@ class Transcriber:
         type: str
         text: str
         time_seconds: float
+        segments: [Segment] = field(default_factory=list)
+        # perf_counter() when the event was raised
+        created: float = field(default_factory=time.perf_counter)
+        # perf_counter() when the last voiced audio of the monologue arrived and when the pause after it
+        # was taken as the end of the turn, set on finished events, the start of a turn's trace
+        speech_end: Optional[float] = None
+        endpointed: Optional[float] = None
 
-    def __init__(self, audio_track: livekit.RemoteAudioTrack, callback: Callable[[Event], None]):
+    def __init__(self,
+                 audio_track: livekit.RemoteAudioTrack,
+                 callback: Callable[[Event], None],
+                 inference_backend: Optional[InferenceBackend] = None,
+                 model_name: str = DEFAULT_MODEL,
+                 quantized: bool = DEFAULT_QUANTIZED,
+                 incremental: bool = True,
+                 vad: Optional[VoiceActivityDetector] = None,
+                 endpointer: Optional[Endpointer] = None,
+                 thread_callback: bool = False,
+                 stream_factory: Callable[[livekit.RemoteAudioTrack, asyncio.AbstractEventLoop],
+                                          AsyncIterable[livekit.AudioFrame]] = livekit.AudioStream):
         self._callback = callback
+        # A threadsafe callback, like an agent's event bus, is called straight from the transcriber's thread
+        self._thread_callback = thread_callback
         self._audio_track = audio_track
+        # Opens the track's frames on the transcriber's own loop, benchmarks replay recordings through it
+        self._stream_factory = stream_factory
+        self._backend = inference_backend or get_backend(model_name, quantized)
+        self._stream_id = self._backend.new_stream_id()
+        self._incremental = incremental
+        self._vad = vad or EnergyVAD()
+        if endpointer is None and ENDPOINTING:
+            endpointer = Endpointer(hangover_seconds=self._vad.hangover_seconds)
+        self._endpointer = endpointer
         self._main_event_loop = asyncio.get_event_loop()
-        self._write_index = 0
+        self._monologue_samples = 0
+        self._transcript = IncrementalTranscript()
         self._in_monologue = False
-        self._working_buffer = np.zeros(MAX_TALKING_SECONDS * WHISPER_SAMPLE_RATE, dtype=np.float32)
+        # The decode window only holds the part of the monologue that hasn't been committed yet
+        self._window = self._backend.create_window(self._stream_id, MAX_TALKING_SECONDS * WHISPER_SAMPLE_RATE)
         self._delta_buffer_write_index = 0
         self._delta_buffer = np.zeros(WHISPER_SAMPLE_RATE * STEP_SIZE_SECONDS, dtype=np.float32)
+        self._step_voiced = False
+        self._speech_end: Optional[float] = None
+        self.ingest_stats = IngestStats()
         self._last_text = ""
         self._current_id = 1
         self._silence_buffer_count = 0
+        self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopped = False
+        self._done_callbacks: list[Callable[[], None]] = []
+
+    @property
+    def memory_bytes(self) -> int:
+        """Audio buffers held for the stream, the bulk of what keeping it open costs."""
+        window = self._window.nbytes if self._window is not None else 0
+        return window + self._delta_buffer.nbytes
 
     def start(self):
-        threading.Thread(target=self._create_stream, daemon=True).start()
+        self._thread = threading.Thread(target=self._create_stream, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops reading the track and releases the stream's buffers, from any thread."""
+        self._stopped = True
+        loop, task = self._loop, self._task
+        if loop is not None and task is not None:
+            try:
+                loop.call_soon_threadsafe(task.cancel)
+            except RuntimeError:
+                # The loop has already finished and closed
+                pass
+
+    def add_done_callback(self, callback: Callable[[], None]):
+        """Calls callback from the transcriber's thread once it has stopped, whether
+        it was told to or the track ended."""
+        self._done_callbacks.append(callback)
+
+    def join(self, timeout: Optional[float] = None):
+        if self._thread is not None:
+            self._thread.join(timeout)
 
     def _create_stream(self):
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
-        stream = livekit.AudioStream(self._audio_track, loop)
-        loop.run_until_complete(self._process_loop(stream))
+        stream = self._stream_factory(self._audio_track, loop)
+        self._task = loop.create_task(self._process_loop(stream))
+        self._loop = loop
+        if self._stopped:
+            self._task.cancel()
+        _active_transcribers.add(self)
+        try:
+            loop.run_until_complete(self._task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            _active_transcribers.discard(self)
+            loop.close()
+            self._release()
+            for callback in self._done_callbacks:
+                callback()
 
-    async def _process_loop(self, stream: livekit.AudioStream):
+    async def _process_loop(self, stream: AsyncIterable[livekit.AudioFrame]):
         async for frame in stream:
-            resampled = frame.remix_and_resample(WHISPER_SAMPLE_RATE, 1)
-            data = np.array(resampled.data, dtype=np.float32) / 32768.0
-            self._add_buffer(data)
-
-    def _add_buffer(self, buffer: np.array) -> None:
-        buffer_size = len(buffer)
-
-        if buffer_size + self._delta_buffer_write_index > WHISPER_SAMPLE_RATE * STEP_SIZE_SECONDS:
-            logging.error("Received buffer larger than step size, truncating")
-            buffer = buffer[0:WHISPER_SAMPLE_RATE * STEP_SIZE_SECONDS - self._delta_buffer_write_index]
-
-        self._delta_buffer[self._delta_buffer_write_index:self._delta_buffer_write_index + buffer_size] = buffer
-        self._delta_buffer_write_index += buffer_size
-
-        # Normal case, we've recieved enough buffers to fill up the step size
-        if self._delta_buffer_write_index >= WHISPER_SAMPLE_RATE * STEP_SIZE_SECONDS:
-            self._delta_buffer_write_index = 0
-            delta_res = self._transcribe(self._delta_buffer)
-
-            if delta_res != "":
-                # We've received enough buffers to fill up the max monologue size so we finish any
-                # monologue we're in and start a new one. This can cause a monologue to be split or
-                # glitched if the speaker is speaking for longer than the max monologue size. Consider
-                # a better solution using some sort of sliding window design.
-                if self._write_index >= len(self._working_buffer):
-                    self._last_text = self._transcribe(self._working_buffer[0:self._write_index])
-                    if self._in_monologue:
-                        self._finish_talking()
-
-                self._working_buffer[self._write_index:self._write_index + len(self._delta_buffer)] = self._delta_buffer
-                self._write_index += len(self._delta_buffer)
-                self._last_text = self._transcribe(self._working_buffer[0:self._write_index])
-
-                if self._in_monologue:
-                    self._update_talking()
-                else:
-                    self._start_talking()
+            if self._stopped:
+                break
+            self._ingest_frame(frame)
+
+    def _release(self):
+        self._backend.release_stream(self._stream_id)
+        self._window = None
+
+    def _ingest_frame(self, frame: livekit.AudioFrame):
+        start = time.perf_counter()
+        resampled = frame.sample_rate != WHISPER_SAMPLE_RATE or frame.num_channels != 1
+        if resampled:
+            frame = frame.remix_and_resample(WHISPER_SAMPLE_RATE, 1)
+
+        samples, copied = int16_view(frame.data)
+        self.ingest_stats.record_frame(copied=copied, resampled=resampled)
+        step_seconds = self._add_buffer(samples)
+        ingest_seconds.observe(time.perf_counter() - start - step_seconds)
+
+    def _add_buffer(self, samples: np.ndarray) -> float:
+        """Returns the time spent processing steps and endpoints the samples completed."""
+        # Converts straight into the step buffer, a frame straddling a step boundary is split across two steps
+        step_size = len(self._delta_buffer)
+        step_seconds = 0.0
+        offset = 0
+        arrived = time.perf_counter()
+        while offset < len(samples):
+            start = self._delta_buffer_write_index
+            count = min(len(samples) - offset, step_size - start)
+            chunk = self._delta_buffer[start:start + count]
+            int16_to_float32(samples[offset:offset + count], chunk)
+            self._delta_buffer_write_index += count
+            offset += count
+
+            # VAD runs as frames arrive so the endpointer can time pauses to the frame
+            with vad_seconds.time():
+                voiced = self._vad.process(chunk)
+            voiced_at = np.flatnonzero(voiced)
+            if len(voiced_at) > 0:
+                self._step_voiced = True
+                # The VAD keeps reporting speech for its hangover after the speech itself ends
+                silent_frames = len(voiced) - 1 - voiced_at[-1]
+                self._speech_end = arrived - (silent_frames * self._vad.frame_seconds + self._vad.hangover_seconds)
+
+            step_start = time.perf_counter()
+            if self._endpointer is not None:
+                endpoint = self._endpointer.update(voiced, self._vad.frame_seconds, self._last_text,
+                                                   active=self._in_monologue)
+                if endpoint == ENDPOINT_LIKELY_FINISHED:
+                    self._likely_finished()
+                elif endpoint == ENDPOINT_FINISHED:
+                    self._endpoint()
+            if self._delta_buffer_write_index >= step_size:
+                self._process_step()
+            step_seconds += time.perf_counter() - step_start
+        return step_seconds
+
+    def _process_step(self):
+        # Whisper only ever sees steps the VAD considers voiced
+        voiced = self._take_step()
+        steps_total.inc(voiced=voiced is not None)
+
+        if voiced is not None:
+            self._append_to_window(voiced)
+            self._transcribe_window()
+
+            if self._in_monologue:
+                self._update_talking()
+            elif self._last_text != "":
+                self._start_talking()
             else:
-                self._silence_buffer_count += WHISPER_SAMPLE_RATE * STEP_SIZE_SECONDS
-                if self._in_monologue:
-                    self._finish_talking()
-                    self._start_silence()
-                else:
-                    self._update_silence()
+                # Voiced but nothing Whisper recognizes as words (a cough, a door), don't start a monologue on it
+                self._reset_window()
+                self._count_silence()
+        else:
+            self._count_silence()
+
+    def _take_step(self) -> Optional[np.ndarray]:
+        """Starts a new step, returns the audio of the one so far if any of it was voiced."""
+        count, self._delta_buffer_write_index = self._delta_buffer_write_index, 0
+        voiced, self._step_voiced = self._step_voiced, False
+        return self._delta_buffer[0:count] if voiced and count > 0 else None
+
+    def _append_to_window(self, samples: np.ndarray):
+        # The uncommitted tail has filled the decode window, commit all but the last few seconds
+        # so the monologue keeps streaming instead of being split
+        if len(samples) > self._window.available:
+            cut = self._transcript.force_commit(self._transcript.tentative,
+                                                len(self._window) / WHISPER_SAMPLE_RATE,
+                                                WINDOW_OVERLAP_SECONDS)
+            self._drop_from_window(cut)
+        shortfall = len(samples) - self._window.available
+        if shortfall > 0:
+            # The last segment kept started early in the window, the oldest audio goes without
+            # being transcribed again so the window and the transcript's timestamps stay in step
+            self._drop_from_window(self._transcript.skip(shortfall / WHISPER_SAMPLE_RATE))
+
+        self._window.write(samples)
+        self._monologue_samples += len(samples)
+
+    def _flush_step(self):
+        """Transcribes the step so far, so the transcript covers everything said up to a pause."""
+        voiced = self._take_step()
+        if voiced is not None:
+            self._append_to_window(voiced)
+            self._transcribe_window()
+
+    def _likely_finished(self):
+        self._flush_step()
+        event = Transcriber.Event(id=self._current_id,
+                                  text=self._last_text,
+                                  type=EVENT_TYPE_TALKING_LIKELY_FINISHED,
+                                  time_seconds=self._monologue_samples / WHISPER_SAMPLE_RATE,
+                                  segments=self._transcript.segments)
+        self._emit(event)
+
+    def _endpoint(self):
+        endpointed = time.perf_counter()
+        silence = self._endpointer.trailing_silence
+        endpoint_silence_seconds.observe(silence, cue=transcript_cue(self._last_text))
+        self._flush_step()
+        self._silence_buffer_count = int(silence * WHISPER_SAMPLE_RATE)
+        self._finish_talking(endpointed)
+        self._start_silence()
+
+    def _count_silence(self):
+        self._silence_buffer_count += WHISPER_SAMPLE_RATE * STEP_SIZE_SECONDS
+        if self._in_monologue:
+            self._finish_talking(time.perf_counter())
+            self._start_silence()
+        else:
+            self._update_silence()
+
+    def _reset_window(self):
+        self._last_text = ""
+        self._window.clear()
+        self._monologue_samples = 0
+        self._transcript = IncrementalTranscript()
 
     def _start_talking(self):
         self._in_monologue = True
@@ -105,25 +344,29 @@ class Transcriber:
         event = Transcriber.Event(id=self._current_id,
                                   text=self._last_text,
                                   type=EVENT_TYPE_TALKING_STARTED,
-                                  time_seconds=self._write_index / WHISPER_SAMPLE_RATE)
-        self._main_event_loop.call_soon_threadsafe(self._callback, event)
+                                  time_seconds=self._monologue_samples / WHISPER_SAMPLE_RATE,
+                                  segments=self._transcript.segments)
+        self._emit(event)
 
     def _update_talking(self):
         event = Transcriber.Event(id=self._current_id,
                                   text=self._last_text,
                                   type=EVENT_TYPE_TALKING_UPDATED,
-                                  time_seconds=self._write_index / WHISPER_SAMPLE_RATE)
-        self._main_event_loop.call_soon_threadsafe(self._callback, event)
+                                  time_seconds=self._monologue_samples / WHISPER_SAMPLE_RATE,
+                                  segments=self._transcript.segments)
+        self._emit(event)
 
-    def _finish_talking(self):
+    def _finish_talking(self, endpointed: float):
         self._in_monologue = False
         event = Transcriber.Event(id=self._current_id,
                                   text=self._last_text,
                                   type=EVENT_TYPE_TALKING_FINISHED,
-                                  time_seconds=self._write_index / WHISPER_SAMPLE_RATE)
-        self._last_text = ""
-        self._write_index = 0
-        self._main_event_loop.call_soon_threadsafe(self._callback, event)
+                                  time_seconds=self._monologue_samples / WHISPER_SAMPLE_RATE,
+                                  segments=self._transcript.segments,
+                                  speech_end=min(self._speech_end, endpointed) if self._speech_end is not None else None,
+                                  endpointed=endpointed)
+        self._reset_window()
+        self._emit(event)
 
     def _start_silence(self):
         self._current_id += 1
@@ -131,24 +374,29 @@ class Transcriber:
                                   text="",
                                   type=EVENT_TYPE_NO_SPEECH,
                                   time_seconds=self._silence_buffer_count / WHISPER_SAMPLE_RATE)
-        self._main_event_loop.call_soon_threadsafe(self._callback, event)
+        self._emit(event)
 
     def _update_silence(self):
         event = Transcriber.Event(id=self._current_id,
                                   text="",
                                   type=EVENT_TYPE_NO_SPEECH,
                                   time_seconds=self._silence_buffer_count / WHISPER_SAMPLE_RATE)
-        self._main_event_loop.call_soon_threadsafe(self._callback, event)
-
-    def _transcribe(self, buffer: np.array) -> str:
-        res = whisper.transcribe(model, buffer)
+        self._emit(event)
 
-        #print(res)
+    def _emit(self, event: Event):
+        if self._thread_callback:
+            self._callback(event)
+        else:
+            self._main_event_loop.call_soon_threadsafe(self._callback, event)
 
-        segments = res.get('segments', [])
-        result = ""
-        for segment in segments:
-            if segment['no_speech_prob'] < 0.5:
-                result += segment["text"]
+    def _transcribe_window(self):
+        prompt = self._transcript.prompt if self._incremental else ""
+        with transcribe_seconds.time():
+            result = self._backend.transcribe(self._stream_id, self._window.window(), prompt=prompt or None)
+        segments = result.segments if result.is_speech else []
+        cut = self._transcript.update(segments, commit=self._incremental)
+        self._drop_from_window(cut)
+        self._last_text = self._transcript.text
 
-        return result
+    def _drop_from_window(self, seconds: float):
+        self._window.consume(int(round(seconds * WHISPER_SAMPLE_RATE)))
@@ -0,0 +1,177 @@
+import numpy as np
+
+VAD_SAMPLE_RATE = 16000
+VAD_FRAME_SECONDS = 0.02
+
+
+class VoiceActivityDetector:
+    """Classifies 16kHz mono audio as voiced or silent, one frame at a time.
+
+    Subclasses score whole batches of frames at once, the base class applies
+    hysteresis: speech starts after start_frames consecutive frames pass the
+    start test and ends after hangover_frames frames fail the keep test.
+    Audio that doesn't fill a whole frame is held until the next call.
+    """
+
+    def __init__(self, frame_size: int, start_frames: int, hangover_frames: int):
+        self.frame_size = frame_size
+        self.is_speaking = False
+        self._start_frames = start_frames
+        self._hangover_frames = hangover_frames
+        self._start_run = 0
+        self._silent_run = 0
+        self._pending = np.zeros(frame_size, dtype=np.float32)
+        self._pending_count = 0
+
+    @property
+    def frame_seconds(self) -> float:
+        return self.frame_size / VAD_SAMPLE_RATE
+
+    @property
+    def hangover_seconds(self) -> float:
+        """How long after speech ends frames are still reported as voiced."""
+        return self._hangover_frames * self.frame_seconds
+
+    def reset(self):
+        self.is_speaking = False
+        self._start_run = 0
+        self._silent_run = 0
+        self._pending_count = 0
+
+    def process(self, buffer: np.ndarray) -> np.ndarray:
+        """Returns one voiced flag per complete frame in buffer."""
+        results = []
+        if self._pending_count > 0:
+            needed = min(self.frame_size - self._pending_count, len(buffer))
+            self._pending[self._pending_count:self._pending_count + needed] = buffer[0:needed]
+            self._pending_count += needed
+            buffer = buffer[needed:]
+            if self._pending_count < self.frame_size:
+                return np.zeros(0, dtype=bool)
+            self._pending_count = 0
+            results.append(self._apply_hysteresis(self._pending[np.newaxis, :]))
+
+        frame_count = len(buffer) // self.frame_size
+        if frame_count > 0:
+            frames = buffer[0:frame_count * self.frame_size].reshape(frame_count, self.frame_size)
+            results.append(self._apply_hysteresis(frames))
+
+        leftover = len(buffer) - frame_count * self.frame_size
+        if leftover > 0:
+            self._pending[0:leftover] = buffer[frame_count * self.frame_size:]
+            self._pending_count = leftover
+
+        if len(results) == 1:
+            return results[0]
+        return np.concatenate(results) if results else np.zeros(0, dtype=bool)
+
+    def _classify(self, frames: np.ndarray) -> (np.ndarray, np.ndarray):
+        """Returns (start, keep) masks for a (frame_count, frame_size) array."""
+        raise NotImplementedError
+
+    def _apply_hysteresis(self, frames: np.ndarray) -> np.ndarray:
+        start, keep = self._classify(frames)
+        voiced = np.zeros(len(frames), dtype=bool)
+        for i in range(len(frames)):
+            if self.is_speaking:
+                if keep[i]:
+                    self._silent_run = 0
+                else:
+                    self._silent_run += 1
+                    if self._silent_run >= self._hangover_frames:
+                        self.is_speaking = False
+                        self._start_run = 0
+            else:
+                self._start_run = self._start_run + 1 if start[i] else 0
+                if self._start_run >= self._start_frames:
+                    self.is_speaking = True
+                    self._silent_run = 0
+            voiced[i] = self.is_speaking
+        return voiced
+
+
+class EnergyVAD(VoiceActivityDetector):
+    """Energy and zero-crossing detector with an adaptive noise floor.
+
+    A frame can start speech when it is start_db above the noise floor and
+    isn't dominated by high frequency hiss (zero-crossing rate), and keeps
+    speech going while it stays keep_db above the floor.
+    """
+
+    def __init__(self,
+                 start_db: float = 12.0,
+                 keep_db: float = 6.0,
+                 min_energy_db: float = -55.0,
+                 max_zero_crossing_rate: float = 0.35,
+                 noise_adaptation: float = 0.05,
+                 speech_adaptation: float = 0.0005,
+                 start_frames: int = 3,
+                 hangover_frames: int = 15):
+        super().__init__(frame_size=int(VAD_SAMPLE_RATE * VAD_FRAME_SECONDS),
+                         start_frames=start_frames,
+                         hangover_frames=hangover_frames)
+        self._start_db = start_db
+        self._keep_db = keep_db
+        self._min_energy_db = min_energy_db
+        self._max_zero_crossing_rate = max_zero_crossing_rate
+        self._noise_adaptation = noise_adaptation
+        self._speech_adaptation = speech_adaptation
+        self._noise_floor_db = min_energy_db
+
+    def _classify(self, frames: np.ndarray) -> (np.ndarray, np.ndarray):
+        energy = np.einsum('ij,ij->i', frames, frames) / frames.shape[1]
+        energy_db = 10.0 * np.log10(energy + 1e-10)
+        signs = np.signbit(frames)
+        zero_crossing_rate = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (frames.shape[1] - 1)
+
+        # The floor drops quickly, follows background noise and barely moves while someone speaks
+        floor = np.empty_like(energy_db)
+        noise = self._noise_floor_db
+        for i, db in enumerate(energy_db):
+            if db < noise:
+                rate = 0.5
+            elif db < noise + self._keep_db:
+                rate = self._noise_adaptation
+            else:
+                rate = self._speech_adaptation
+            noise = max(noise + rate * (db - noise), self._min_energy_db)
+            floor[i] = noise
+        self._noise_floor_db = noise
+
+        loud_enough = energy_db > floor + self._start_db
+        start = loud_enough & ((zero_crossing_rate < self._max_zero_crossing_rate) |
+                               (energy_db > floor + 2 * self._start_db))
+        keep = energy_db > floor + self._keep_db
+        return start, keep
+
+
+class SileroVAD(VoiceActivityDetector):
+    """Model based detector using Silero VAD, loaded from torch hub on first use."""
+
+    def __init__(self,
+                 start_probability: float = 0.5,
+                 keep_probability: float = 0.35,
+                 start_frames: int = 1,
+                 hangover_frames: int = 10):
+        # Silero only accepts 512 sample windows at 16kHz
+        super().__init__(frame_size=512, start_frames=start_frames, hangover_frames=hangover_frames)
+        self._start_probability = start_probability
+        self._keep_probability = keep_probability
+        self._model = None
+
+    def reset(self):
+        super().reset()
+        if self._model is not None:
+            self._model.reset_states()
+
+    def _classify(self, frames: np.ndarray) -> (np.ndarray, np.ndarray):
+        import torch
+
+        if self._model is None:
+            self._model, _ = torch.hub.load('snakers4/silero-vad', 'silero_vad')
+
+        with torch.no_grad():
+            # The model is stateful so frames have to be fed in order
+            probabilities = np.array([self._model(torch.from_numpy(frame), VAD_SAMPLE_RATE).item()
+                                      for frame in frames])
+        return probabilities > self._start_probability, probabilities > self._keep_probability
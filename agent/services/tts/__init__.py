@@ -1 +1,5 @@
-from .tts import TTS
\ No newline at end of file
+from .tts import TTS, OUTPUT_FORMAT
+from .cache import AudioCache, cache_key
+from .chunker import TextChunker, chunk_text
+from .playout import PlayoutEngine
+from .sessions import SessionPool, resolve_voice_id
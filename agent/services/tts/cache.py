@@ -0,0 +1,131 @@
+import hashlib
+import logging
+import mmap
+import os
+import tempfile
+from collections import OrderedDict
+from typing import Optional
+
+DEFAULT_MEMORY_BYTES = 16 * 1024 * 1024
+DEFAULT_DISK_BYTES = 256 * 1024 * 1024
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.split()).lower()
+
+
+def cache_key(text: str, voice_id: str, output_format: str) -> str:
+    key = "\x00".join([normalize_text(text), voice_id, output_format])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class AudioCache:
+    """Content addressed cache of synthesized PCM.
+
+    Entries live in an in-memory LRU tier and, if a directory is given, in an
+    on-disk tier of one file per key that is memory-mapped on read. Both tiers
+    evict least recently used entries once they go over their byte budget.
+    """
+
+    def __init__(self,
+                 directory: Optional[str] = None,
+                 memory_bytes: int = DEFAULT_MEMORY_BYTES,
+                 disk_bytes: int = DEFAULT_DISK_BYTES):
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._memory_bytes = memory_bytes
+        self._memory_size = 0
+        self._directory = directory
+        self._disk: OrderedDict[str, int] = OrderedDict()
+        self._disk_bytes = disk_bytes
+        self._disk_size = 0
+        self.hits = 0
+        self.misses = 0
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self._load_disk_index()
+
+    def get(self, key: str) -> Optional[memoryview]:
+        pcm = self._memory.get(key)
+        if pcm is not None:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return memoryview(pcm)
+
+        if key in self._disk:
+            mapped = self._map(key)
+            if mapped is not None:
+                self._disk.move_to_end(key)
+                self.hits += 1
+                return mapped
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, pcm: bytes):
+        pcm = bytes(pcm)
+        if len(pcm) <= self._memory_bytes:
+            self._memory_size -= len(self._memory.pop(key, b""))
+            self._memory[key] = pcm
+            self._memory_size += len(pcm)
+            while self._memory_size > self._memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_size -= len(evicted)
+
+        if self._directory is not None and len(pcm) <= self._disk_bytes:
+            self._write(key, pcm)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._directory, f"{key}.pcm")
+
+    def _load_disk_index(self):
+        entries = []
+        for name in os.listdir(self._directory):
+            if not name.endswith(".pcm"):
+                continue
+            stat = os.stat(os.path.join(self._directory, name))
+            entries.append((stat.st_mtime, name[:-len(".pcm")], stat.st_size))
+
+        # Oldest first, so the front of the index is what gets evicted
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_size += size
+        self._evict_disk()
+
+    def _map(self, key: str) -> Optional[memoryview]:
+        try:
+            with open(self._path(key), "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            # Keeps the LRU order across restarts
+            os.utime(self._path(key))
+        except (OSError, ValueError):
+            logging.warning("Dropping unreadable cached audio %s", key)
+            self._disk_size -= self._disk.pop(key, 0)
+            return None
+        return memoryview(mapped)
+
+    def _write(self, key: str, pcm: bytes):
+        fd, temp_path = tempfile.mkstemp(dir=self._directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(pcm)
+            os.replace(temp_path, self._path(key))
+        except OSError:
+            logging.exception("Failed to write cached audio")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+
+        self._disk_size -= self._disk.pop(key, 0)
+        self._disk[key] = len(pcm)
+        self._disk_size += len(pcm)
+        self._evict_disk()
+
+    def _evict_disk(self):
+        while self._disk_size > self._disk_bytes:
+            key, size = self._disk.popitem(last=False)
+            self._disk_size -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
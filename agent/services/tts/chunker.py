@@ -0,0 +1,85 @@
+import re
+from collections.abc import AsyncIterator
+from typing import Optional
+
+FIRST_CHUNK_MIN_CHARS = 12
+MIN_CHARS = 60
+MAX_CHARS = 250
+GROWTH = 2.0
+
+# Sentence ends and clause breaks, only once the whitespace after them has arrived
+_SENTENCE_END = re.compile(r'[.!?]+["\')\]]*\s')
+_CLAUSE_END = re.compile(r'[,;:—]\s|\s-\s')
+
+
+class TextChunker:
+    """Groups streamed LLM tokens into prosodic chunks for TTS.
+
+    A chunk is emitted at the first sentence end past the current minimum
+    size, at a clause break once the chunk is half way to its maximum, or at
+    the last space before the maximum. The first chunk is small so audio can
+    start early, each later chunk may be GROWTH times bigger up to MIN_CHARS,
+    so a long answer goes out in fewer, larger messages.
+    """
+
+    def __init__(self,
+                 first_chunk_min_chars: int = FIRST_CHUNK_MIN_CHARS,
+                 min_chars: int = MIN_CHARS,
+                 max_chars: int = MAX_CHARS,
+                 growth: float = GROWTH):
+        self._min_chars = min_chars
+        self._max_chars = max_chars
+        self._growth = growth
+        self._current_min = first_chunk_min_chars
+        self._buffer = ""
+
+    def push(self, text: str) -> [str]:
+        self._buffer += text
+        chunks = []
+        while True:
+            end = self._find_split()
+            if end is None:
+                break
+            chunk = self._buffer[0:end].strip()
+            self._buffer = self._buffer[end:]
+            if chunk:
+                chunks.append(chunk)
+                self._current_min = min(int(self._current_min * self._growth), self._min_chars)
+        return chunks
+
+    def flush(self) -> Optional[str]:
+        chunk = self._buffer.strip()
+        self._buffer = ""
+        return chunk or None
+
+    def _find_split(self) -> Optional[int]:
+        max_chars = min(self._max_chars, self._current_min * 4)
+        if len(self._buffer) < self._current_min:
+            return None
+
+        for match in _SENTENCE_END.finditer(self._buffer, self._current_min - 1):
+            if match.end() <= max_chars:
+                return match.end()
+            break
+
+        clause_min = (self._current_min + max_chars) // 2
+        for match in _CLAUSE_END.finditer(self._buffer, clause_min - 1):
+            if match.end() <= max_chars:
+                return match.end()
+            break
+
+        if len(self._buffer) >= max_chars:
+            space = self._buffer.rfind(" ", 0, max_chars)
+            return space + 1 if space > 0 else max_chars
+        return None
+
+
+async def chunk_text(tokens: AsyncIterator[str], chunker: Optional[TextChunker] = None) -> AsyncIterator[str]:
+    chunker = chunker or TextChunker()
+    async for token in tokens:
+        for chunk in chunker.push(token):
+            yield chunk
+
+    chunk = chunker.flush()
+    if chunk is not None:
+        yield chunk
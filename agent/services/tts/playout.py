@@ -0,0 +1,198 @@
+import asyncio
+from typing import Optional
+
+import livekit
+import numpy as np
+
+from services.metrics import STAGE_FIRST_AUDIO_FRAME, TurnTrace, registry
+
+PCM_SAMPLE_RATE = 44100  # ElevenLabs pcm_44100 output, mono int16
+FRAME_SECONDS = 0.01
+DEFAULT_BUFFER_SECONDS = 20
+# Audio held back before a response's first frame, so a late packet early on doesn't underrun
+DEFAULT_PREROLL_SECONDS = 0.06
+# Further behind than this and the clock gives up on catching up
+MAX_LAG_SECONDS = 0.1
+
+underruns_total = registry.counter("tts_playout_underruns", "Frames padded with silence because audio ran out")
+frames_total = registry.counter("tts_playout_frames", "Frames sent to the audio source")
+
+
+class PlayoutEngine:
+    """Paces TTS audio into an AudioSource, one 10ms frame per clock tick.
+
+    PCM is written into a preallocated int16 ring buffer. While a response is
+    playing, a single clock task sends exactly one frame per tick and fills
+    it with silence only when the buffer underruns. Between responses the
+    task sleeps until audio arrives, and a response starts once preroll_seconds
+    of it are buffered or it has ended. Frames are filled into one preallocated
+    AudioFrame. flush() drops everything queued, so a barge-in is silent from
+    the next tick.
+    """
+
+    def __init__(self,
+                 audio_source: livekit.AudioSource,
+                 sample_rate: int,
+                 num_channels: int,
+                 buffer_seconds: float = DEFAULT_BUFFER_SECONDS,
+                 preroll_seconds: float = DEFAULT_PREROLL_SECONDS):
+        self._audio_source = audio_source
+        self._sample_rate = sample_rate
+        self._num_channels = num_channels
+        self._frame_samples = int(PCM_SAMPLE_RATE * FRAME_SECONDS)
+        self._preroll_samples = int(PCM_SAMPLE_RATE * preroll_seconds)
+        # capture_frame copies the samples, so the same frame is refilled every tick
+        self._frame = livekit.AudioFrame.create(sample_rate=PCM_SAMPLE_RATE, num_channels=1,
+                                                samples_per_channel=self._frame_samples)
+        self._frame_out = np.ctypeslib.as_array(self._frame.data)
+        self._buffer = np.zeros(int(PCM_SAMPLE_RATE * buffer_seconds), dtype=np.int16)
+        self._read_index = 0
+        self._write_index = 0
+        self._odd_byte = b''
+        self._playing = False
+        self._finishing = False
+        # Bumped by flush(), so writes blocked on a full buffer drop their audio
+        self._generation = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._audio_available = asyncio.Event()
+        self._space_available = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # Gets the first frame of each response marked on it
+        self.trace: Optional[TurnTrace] = None
+        self._response_frames = 0
+        self.frames_played = 0
+        self.underruns = 0
+        self.samples_played = 0
+
+    @property
+    def buffered_samples(self) -> int:
+        return self._write_index - self._read_index
+
+    @property
+    def buffer_depth_ms(self) -> float:
+        return self.buffered_samples * 1000 / PCM_SAMPLE_RATE
+
+    @property
+    def is_playing(self) -> bool:
+        return self._playing
+
+    async def wait_idle(self):
+        """Waits until the current response has been played or flushed."""
+        await self._idle.wait()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def write(self, pcm: bytes):
+        """Queues int16 PCM, waits for room in the buffer if playback is behind."""
+        self.start()
+        if self._odd_byte:
+            pcm = self._odd_byte + bytes(pcm)
+            self._odd_byte = b''
+        if len(pcm) % 2 == 1:
+            self._odd_byte = bytes(pcm[-1:])
+            pcm = pcm[:-1]
+
+        samples = np.frombuffer(pcm, dtype=np.int16)
+        if len(samples) == 0:
+            return
+        self._playing = True
+        self._finishing = False
+        self._idle.clear()
+        generation = self._generation
+        offset = 0
+        while offset < len(samples):
+            free = len(self._buffer) - self.buffered_samples
+            if free == 0:
+                self._space_available.clear()
+                await self._space_available.wait()
+                if generation != self._generation:
+                    return
+                continue
+
+            count = min(free, len(samples) - offset)
+            position = self._write_index % len(self._buffer)
+            first = min(count, len(self._buffer) - position)
+            self._buffer[position:position + first] = samples[offset:offset + first]
+            self._buffer[0:count - first] = samples[offset + first:offset + count]
+            self._write_index += count
+            offset += count
+            self._audio_available.set()
+
+    def end_response(self):
+        """Marks the end of the response, playback goes idle once the buffer drains."""
+        self._finishing = True
+        self._audio_available.set()
+
+    def flush(self):
+        self._read_index = self._write_index
+        self._odd_byte = b''
+        self._playing = False
+        self._finishing = False
+        self._generation += 1
+        self._idle.set()
+        self._space_available.set()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            if not self._playing or (self._finishing and self.buffered_samples == 0):
+                self._playing = False
+                self._idle.set()
+                self._response_frames = 0
+                self._audio_available.clear()
+                await self._audio_available.wait()
+                next_tick = loop.time()
+                continue
+
+            if (self._response_frames == 0 and not self._finishing
+                    and self.buffered_samples < self._preroll_samples):
+                self._audio_available.clear()
+                await self._audio_available.wait()
+                next_tick = loop.time()
+                continue
+
+            await self._audio_source.capture_frame(self._next_frame())
+            if self._response_frames == 0 and self.trace is not None:
+                self.trace.mark(STAGE_FIRST_AUDIO_FRAME)
+            self._response_frames += 1
+
+            next_tick += FRAME_SECONDS
+            delay = next_tick - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif delay < -MAX_LAG_SECONDS:
+                next_tick = loop.time()
+
+    def _next_frame(self) -> livekit.AudioFrame:
+        frame = self._frame
+        out = self._frame_out
+
+        count = min(self.buffered_samples, self._frame_samples)
+        position = self._read_index % len(self._buffer)
+        first = min(count, len(self._buffer) - position)
+        out[0:first] = self._buffer[position:position + first]
+        out[first:count] = self._buffer[0:count - first]
+        if count < self._frame_samples:
+            out[count:] = 0
+            if not self._finishing:
+                self.underruns += 1
+                underruns_total.inc()
+
+        self._read_index += count
+        self.samples_played += count
+        self.frames_played += 1
+        frames_total.inc()
+        self._space_available.set()
+
+        if self._sample_rate != PCM_SAMPLE_RATE or self._num_channels != 1:
+            return frame.remix_and_resample(self._sample_rate, self._num_channels)
+        return frame
@@ -0,0 +1,129 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Optional
+
+import aiohttp
+import websockets.client as wsclient
+import websockets.exceptions
+
+ELEVENLABS_API_URL = os.environ.get("ELEVENLABS_API_URL", "https://api.elevenlabs.io")
+ELEVENLABS_WS_URL = os.environ.get("ELEVENLABS_WS_URL", "wss://api.elevenlabs.io")
+MODEL_ID = "eleven_monolingual_v1"
+OUTPUT_FORMAT = "pcm_44100"
+DEFAULT_POOL_SIZE = 2
+# ElevenLabs drops stream-input sockets after 20 seconds without input
+KEEPALIVE_SECONDS = 15
+RECONNECT_DELAY_SECONDS = 1
+MAX_RECONNECT_DELAY_SECONDS = 30
+
+_voice_ids: dict[str, str] = {}
+_voice_ids_lock = asyncio.Lock()
+
+
+async def resolve_voice_id(name: Optional[str] = None) -> str:
+    """Looks a voice up once per process, the first available voice if no name is given."""
+    key = name or ""
+    if key in _voice_ids:
+        return _voice_ids[key]
+
+    async with _voice_ids_lock:
+        if key not in _voice_ids:
+            if name is None and os.environ.get("ELEVENLABS_VOICE_ID"):
+                _voice_ids[key] = os.environ["ELEVENLABS_VOICE_ID"]
+            else:
+                headers = {"xi-api-key": os.environ.get("ELEVENLABS_API_KEY", "")}
+                async with aiohttp.ClientSession() as session:
+                    async with session.get(f"{ELEVENLABS_API_URL}/v1/voices", headers=headers) as resp:
+                        voices = (await resp.json()).get('voices', [])
+                matching = [v for v in voices if name is None or v.get('name') == name]
+                _voice_ids[key] = matching[0]['voice_id']
+    return _voice_ids[key]
+
+
+class _Session:
+    def __init__(self, ws: wsclient.WebSocketClientProtocol):
+        self.ws = ws
+        self.last_sent = time.monotonic()
+
+
+class SessionPool:
+    """Keeps stream-input sessions for one voice connected, authenticated and
+    primed with the BOS message, so a response never waits on a handshake.
+
+    Every response consumes a session (the service closes it after the final
+    message), a background task tops the pool back up and keeps idle
+    sessions alive.
+    """
+
+    def __init__(self, voice_id: str, size: int = DEFAULT_POOL_SIZE, keepalive_seconds: float = KEEPALIVE_SECONDS):
+        self.voice_id = voice_id
+        self._size = size
+        self._keepalive_seconds = keepalive_seconds
+        self._ready: [_Session] = []
+        self._refill_needed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready_count(self) -> int:
+        return len(self._ready)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._maintain())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        while self._ready:
+            await self._ready.pop().ws.close()
+
+    async def acquire(self) -> wsclient.WebSocketClientProtocol:
+        self.start()
+        self._refill_needed.set()
+        while self._ready:
+            session = self._ready.pop(0)
+            if session.ws.open:
+                return session.ws
+        # Pool ran dry, pay for the handshake on this response
+        return (await self._connect()).ws
+
+    async def _connect(self) -> _Session:
+        uri = f"{ELEVENLABS_WS_URL}/v1/text-to-speech/{self.voice_id}/stream-input?model_id={MODEL_ID}&output_format={OUTPUT_FORMAT}&optimize_streaming_latency=2"
+        ws = await wsclient.connect(uri)
+        bos_message = {"text": " ", "xi_api_key": os.environ["ELEVENLABS_API_KEY"]}
+        await ws.send(json.dumps(bos_message))
+        return _Session(ws)
+
+    async def _maintain(self):
+        delay = RECONNECT_DELAY_SECONDS
+        while True:
+            self._refill_needed.clear()
+            self._ready = [session for session in self._ready if session.ws.open]
+            try:
+                while len(self._ready) < self._size:
+                    self._ready.append(await self._connect())
+            except Exception:
+                # Anything, a bad URI as much as a dropped handshake, the pool must outlive it
+                logging.exception("Failed to open TTS session, retrying in %ds", delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY_SECONDS)
+                continue
+            delay = RECONNECT_DELAY_SECONDS
+
+            now = time.monotonic()
+            for session in self._ready:
+                if now - session.last_sent >= self._keepalive_seconds:
+                    try:
+                        await session.ws.send(json.dumps({"text": " "}))
+                        session.last_sent = now
+                    except websockets.exceptions.ConnectionClosed:
+                        pass
+
+            try:
+                await asyncio.wait_for(self._refill_needed.wait(), timeout=self._keepalive_seconds / 2)
+            except asyncio.TimeoutError:
+                pass
@@ -1,127 +1,248 @@
-import time
 import asyncio
+import logging
 import os
 import livekit
-import numpy as np
 import websockets.client as wsclient
 import websockets.exceptions
 import aiohttp
 import json
 import base64
+import time
+from typing import Optional
+
+from services.metrics import STAGE_TTS_FIRST_BYTE, TurnTrace, registry
+
+from .cache import AudioCache, cache_key
+from .playout import PCM_SAMPLE_RATE, PlayoutEngine
+from .sessions import (ELEVENLABS_API_URL, MODEL_ID, OUTPUT_FORMAT, DEFAULT_POOL_SIZE,
+                       SessionPool, resolve_voice_id)
+
+logger = logging.getLogger(__name__)
+
+# Rough speaking rate, used to guess how much of a response was heard when
+# it's interrupted before all of its audio has arrived
+SPEECH_CHARS_PER_SECOND = 15
+
+first_byte_seconds = registry.histogram("tts_first_byte_seconds",
+                                        "Time from the first text of a response to its first audio")
+cache_lookups_total = registry.counter("tts_cache_lookups", "Synthesized audio cache lookups", labelnames=("hit",))
+
 
 class TTS:
-    def __init__(self, audio_source: livekit.AudioSource, sample_rate: int, num_channels: int):
+    def __init__(self,
+                 audio_source: livekit.AudioSource,
+                 sample_rate: int,
+                 num_channels: int,
+                 cache: Optional[AudioCache] = None,
+                 pool_size: int = DEFAULT_POOL_SIZE):
         self._audio_source = audio_source
         self._sample_rate = sample_rate
         self._num_channels = num_channels
         self._voice_id = ""
-        self._generating_response = False
+        self._playout = PlayoutEngine(audio_source, sample_rate, num_channels)
         self._ws: wsclient.WebSocketClientProtocol = None
+        self._cache = cache
+        self._pool_size = pool_size
+        self._pool: Optional[SessionPool] = None
+        # Audio of the utterance being generated, kept so it can be cached once it's final
+        self._recording: Optional[bytearray] = None
+        self._recording_key = ""
+        # Progress of the response in flight, for working out what was said before an interrupt
+        self._response_done = asyncio.Event()
+        self._response_done.set()
+        self._response_start_sample = 0
+        self._response_samples = 0
+        self._response_final = False
+        self._first_text_time: Optional[float] = None
+        self._first_audio_received = False
+        self._trace: Optional[TurnTrace] = None
+
+    async def start(self):
+        """Resolves the voice and opens the session pool, call once when the agent starts."""
+        await self._get_voice_id_if_needed()
+        self._playout.start()
+        if self._pool is None:
+            self._pool = SessionPool(self._voice_id, size=self._pool_size)
+            self._pool.start()
+
+    async def close(self):
+        await self._playout.stop()
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    @property
+    def playout(self) -> PlayoutEngine:
+        return self._playout
+
+    def flush(self):
+        """Drops any audio that is queued but hasn't been played yet."""
+        self._playout.flush()
+
+    async def interrupt(self):
+        """Stops the response in flight, queued audio is dropped before the
+        next frame and the stream-input session is closed so no more audio
+        is generated for it."""
+        self._playout.flush()
+        self._recording = None
+        ws, self._ws = self._ws, None
+        self._response_done.set()
+        if ws is not None:
+            await ws.close()
+
+    async def wait_until_done(self):
+        """Waits until the response in flight has been received and played."""
+        await self._response_done.wait()
+        await self._playout.wait_idle()
+
+    def spoken_text(self, text: str) -> str:
+        """The whole words of text, the response sent so far, that have been played."""
+        played = self._playout.samples_played - self._response_start_sample
+        if self._response_final and self._response_samples > 0:
+            chars = int(len(text) * played / self._response_samples)
+        else:
+            chars = int(played / PCM_SAMPLE_RATE * SPEECH_CHARS_PER_SECOND)
+        if chars >= len(text):
+            return text
+        cut = text.rfind(" ", 0, chars + 1)
+        return text[0:cut].strip() if cut > 0 else ""
 
     async def warmup(self):
-        print("NEIL warming up")
         if self._ws is not None and self._ws.open:
-            print("Already connected from a previous session, killing it")
+            logger.info("Already connected from a previous session, killing it")
             await self._ws.close()
             self._ws = None
 
+        await self.start()
+        # Whatever was being recorded belonged to the session just killed
+        self._recording = None
+        self._response_done.clear()
+        self._response_start_sample = self._playout.samples_played
+        self._response_samples = 0
+        self._response_final = False
+        self._first_text_time = None
+        self._first_audio_received = False
+        ws = await self._pool.acquire()
+        self._ws = ws
+        asyncio.create_task(self._receive_audio_loop(ws))
+
+    async def play_cached(self, text: str) -> bool:
+        """Plays text from the cache, returns False without playing anything if it isn't cached."""
+        if self._cache is None:
+            return False
         await self._get_voice_id_if_needed()
-        asyncio.create_task(self._receive_audio_loop())
-        asyncio.create_task(self._send_empty_audio())
-        uri = f"wss://api.elevenlabs.io/v1/text-to-speech/{self._voice_id}/stream-input?model_id=eleven_monolingual_v1&output_format=pcm_44100&optimize_streaming_latency=2"
-        self._ws = await wsclient.connect(uri)
-        bos_message = {"text": " ", "xi_api_key": os.environ["ELEVENLABS_API_KEY"]}
-        await self._ws.send(json.dumps(bos_message))
+        pcm = self._cache.get(cache_key(text, self._voice_id, OUTPUT_FORMAT))
+        cache_lookups_total.inc(hit="true" if pcm is not None else "false")
+        if pcm is None:
+            return False
+        await self._play_pcm(pcm)
+        return True
 
     async def generate_audio(self, text: str):
+        if await self.play_cached(text):
+            return
+        if self._cache is not None:
+            self._recording = bytearray()
+            self._recording_key = cache_key(text, self._voice_id, OUTPUT_FORMAT)
+
         text_queue = asyncio.Queue()
         await text_queue.put(text)
         await text_queue.put(None)
         await self.stream_generate_audio(text_queue=text_queue)
 
-    async def stream_generate_audio(self, text_queue: asyncio.Queue[str]):
-        await self._get_voice_id_if_needed()
-        while self._ws is None or self._ws.open is False:
-            print("Waiting for ws")
-            await asyncio.sleep(0.1)
+    async def prefetch(self, phrases: [str]):
+        """Synthesizes phrases into the cache ahead of time, e.g. greetings and fillers."""
+        if self._cache is None:
+            return
 
-        while True:
-            text = await text_queue.get()
-            if text is None:
-                await self._ws.send(json.dumps({"text": ""}))
-                break
-
-            payload = {"text": f"{text} ", "try_trigger_generation": True}
-            await self._ws.send(json.dumps(payload))
-
-    async def _send_empty_audio(self):
-        while True:
-            if self._generating_response is False:
-                frame = livekit.AudioFrame.create(sample_rate=self._sample_rate,
-                                                  num_channels=self._num_channels,
-                                                  samples_per_channel=441)
-                await self._audio_source.capture_frame(frame)
-            else:
-                await asyncio.sleep(0.05)
-
-    async def _receive_audio_loop(self):
+        await self._get_voice_id_if_needed()
+        url = f"{ELEVENLABS_API_URL}/v1/text-to-speech/{self._voice_id}?output_format={OUTPUT_FORMAT}"
+        headers = {"xi-api-key": os.environ.get("ELEVENLABS_API_KEY", "")}
+        async with aiohttp.ClientSession() as session:
+            for phrase in phrases:
+                key = cache_key(phrase, self._voice_id, OUTPUT_FORMAT)
+                if self._cache.get(key) is not None:
+                    continue
+                try:
+                    async with session.post(url, headers=headers,
+                                            json={"text": phrase, "model_id": MODEL_ID}) as resp:
+                        if resp.status != 200:
+                            logger.warning("Failed to prefetch %r, status %d", phrase, resp.status)
+                            continue
+                        self._cache.put(key, await resp.read())
+                except aiohttp.ClientError:
+                    logger.exception("Failed to prefetch %r", phrase)
+
+    async def _play_pcm(self, pcm: memoryview):
+        await self._playout.write(pcm)
+        self._playout.end_response()
+
+    async def stream_generate_audio(self, text_queue: asyncio.Queue[str], trace: Optional[TurnTrace] = None):
+        self._trace = trace
+        self._playout.trace = trace
+        await self._get_voice_id_if_needed()
         while self._ws is None or self._ws.open is False:
+            logger.debug("Waiting for ws")
             await asyncio.sleep(0.1)
 
-        frame_size_bytes = 441 * 2  # 10ms at 44.1k * 2 bytes per sample (int16) * 1 channels
-
+        ws = self._ws
         try:
-            remainder = b''
             while True:
-                response = await self._ws.recv()
-                self._generating_response = True
+                text = await text_queue.get()
+                if text is None:
+                    await ws.send(json.dumps({"text": ""}))
+                    break
+
+                payload = {"text": f"{text} ", "try_trigger_generation": True}
+                if self._first_text_time is None:
+                    self._first_text_time = time.perf_counter()
+                await ws.send(json.dumps(payload))
+        except websockets.exceptions.ConnectionClosed:
+            logger.warning("Connection closed while sending text")
+
+    async def _receive_audio_loop(self, ws: wsclient.WebSocketClientProtocol):
+        try:
+            while ws is self._ws:
+                response = await ws.recv()
                 data = json.loads(response)
+                # Interrupted while waiting, this audio belongs to a response nobody wants
+                if ws is not self._ws:
+                    return
 
                 if data['isFinal']:
-                    print("Is Final Closing the Websocket")
-                    if len(remainder) > 0:
-                        if len(remainder) < frame_size_bytes:
-                            remainder = remainder + b'\x00' * (frame_size_bytes - len(remainder))
-                        print("Sending remaining % bytes", len(remainder))
-                        await self._audio_source.capture_frame(self._create_frame_from_chunk(remainder))
-                    await self._ws.close()
+                    logger.debug("Is Final Closing the Websocket")
+                    if self._recording is not None:
+                        self._cache.put(self._recording_key, self._recording)
+                        self._recording = None
+                    self._response_final = True
+                    self._playout.end_response()
+                    await ws.close()
                     return
 
                 if data["audio"]:
-                    chunk = remainder + base64.b64decode(data["audio"])
-
-                    if len(chunk) < frame_size_bytes:
-                        remainder = chunk
-                        continue
-                    else:
-                        remainder = chunk[-(len(chunk) % (frame_size_bytes)):]
-                        chunk = chunk[:-len(remainder)]
-
-                    for i in range(0, len(chunk), frame_size_bytes):
-                        start_time = time.time_ns()
-                        await self._audio_source.capture_frame(self._create_frame_from_chunk(chunk[i: i + frame_size_bytes]))
-                        end_time = time.time_ns()
-                        # print("Time to create a frame: % ms", (end_time - start_time) / 1000000)
+                    audio = base64.b64decode(data["audio"])
+                    if not self._first_audio_received:
+                        self._first_audio_received = True
+                        if self._first_text_time is not None:
+                            first_byte_seconds.observe(time.perf_counter() - self._first_text_time)
+                        if self._trace is not None:
+                            self._trace.mark(STAGE_TTS_FIRST_BYTE)
+                    if self._recording is not None:
+                        self._recording += audio
+                    self._response_samples += len(audio) // 2
+                    await self._playout.write(audio)
 
         except websockets.exceptions.ConnectionClosed:
-            self._generating_response = False
-            print("Connection closed")
-            return
+            logger.warning("Connection closed while receiving audio")
+            if ws is self._ws:
+                # Cut short, caching it would replay the partial audio as the whole phrase
+                self._recording = None
+                self._playout.end_response()
         finally:
-            self._generating_response = False
-
-    def _create_frame_from_chunk(self, chunk: bytes):
-        frame = livekit.AudioFrame.create(sample_rate=44100, num_channels=1, samples_per_channel=441)  # Eleven labs format 
-        audio_data = np.ctypeslib.as_array(frame.data)
-        np.copyto(audio_data, np.frombuffer(chunk, dtype=np.int16))
-        resampled = frame.remix_and_resample(self._sample_rate, self._num_channels)
-        return resampled
+            if ws is self._ws:
+                self._recording = None
+                self._response_done.set()
 
     async def _get_voice_id_if_needed(self):
         if self._voice_id == "":
-            voices_url = "https://api.elevenlabs.io/v1/voices"
-            async with aiohttp.ClientSession() as session:
-                async with session.get(voices_url) as resp:
-                    json_resp = await resp.json()
-                    voice = json_resp.get('voices', [])[0]
-                    self._voice_id = voice['voice_id']
+            self._voice_id = await resolve_voice_id()
@@ -0,0 +1,5 @@
+from .jobs import AGENT_CLASSES, Job, run_job
+from .load import AdmissionControl, WorkerLoad
+from .runner import JobRunner, ProcessPoolRunner
+from .server import WorkerServer
+from .coordinator import Coordinator, WorkerRegistry
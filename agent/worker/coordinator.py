@@ -0,0 +1,229 @@
+import argparse
+import asyncio
+import logging
+import os
+import random
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import aiohttp
+import aiohttp.web
+import aiohttp_cors
+
+from .jobs import AGENT_CLASSES, DEFAULT_ROOM
+from .load import DEFAULT_MAX_TRANSCRIBERS, WorkerLoad
+from .server import HEARTBEAT_SECONDS
+
+PORT = int(os.environ.get("COORDINATOR_PORT", "8100"))
+# A worker that misses this many heartbeats is considered gone
+HEARTBEAT_TIMEOUT_SECONDS = 3 * HEARTBEAT_SECONDS
+PLACEMENT_LEAST_LOADED = "least_loaded"
+PLACEMENT_POWER_OF_TWO = "power_of_two"
+PLACEMENT_STRATEGY = os.environ.get("COORDINATOR_PLACEMENT", PLACEMENT_POWER_OF_TWO)
+FORWARD_TIMEOUT_SECONDS = 5
+
+
+@dataclass
+class WorkerInfo:
+    id: str
+    url: str
+    load: WorkerLoad
+    max_jobs: int
+    max_cpu_load: float
+    max_queue_depth: int
+    max_transcribers: int
+    status: str
+    last_seen: float
+    draining: bool = False
+    # Jobs placed since the last heartbeat, so a burst doesn't all land on one worker
+    placed: int = 0
+
+    @property
+    def utilization(self) -> float:
+        """How close the worker is to turning jobs away, 1.0 or more is full."""
+        return max((self.load.jobs + self.placed) / max(1, self.max_jobs),
+                   self.load.transcribers / max(1, self.max_transcribers),
+                   self.load.cpu / max(self.max_cpu_load, 1e-6),
+                   self.load.inference_queue_depth / max(1, self.max_queue_depth))
+
+    def to_json(self) -> dict:
+        return {"id": self.id, "url": self.url, "status": self.status, "draining": self.draining,
+                "utilization": self.utilization, "load": self.load.to_json(), "max_jobs": self.max_jobs,
+                "last_seen": self.last_seen}
+
+
+class WorkerRegistry:
+    """Workers and their last reported load, kept fresh by their heartbeats."""
+
+    def __init__(self, heartbeat_timeout: float = HEARTBEAT_TIMEOUT_SECONDS):
+        self._heartbeat_timeout = heartbeat_timeout
+        self._workers: dict[str, WorkerInfo] = {}
+
+    def __len__(self):
+        return len(self._workers)
+
+    def get(self, worker_id: str) -> Optional[WorkerInfo]:
+        return self._workers.get(worker_id)
+
+    def workers(self) -> [WorkerInfo]:
+        self._expire()
+        return list(self._workers.values())
+
+    def heartbeat(self, report: dict) -> WorkerInfo:
+        worker = self._workers.get(report["id"])
+        draining = worker is not None and worker.draining
+        if worker is None:
+            logging.info("Worker %s joined at %s", report["id"], report["url"])
+        worker = WorkerInfo(id=report["id"],
+                            url=report["url"],
+                            load=WorkerLoad.from_json(report["load"]),
+                            max_jobs=report["max_jobs"],
+                            max_cpu_load=report["max_cpu_load"],
+                            max_queue_depth=report["max_queue_depth"],
+                            # Workers from before the transcriber cap was reported
+                            max_transcribers=report.get("max_transcribers", DEFAULT_MAX_TRANSCRIBERS),
+                            status=report["status"],
+                            last_seen=time.monotonic(),
+                            draining=draining or report["status"] in ("draining", "drained"))
+        self._workers[worker.id] = worker
+        return worker
+
+    def available(self) -> [WorkerInfo]:
+        return [worker for worker in self.workers() if not worker.draining and worker.utilization < 1.0]
+
+    def _expire(self):
+        now = time.monotonic()
+        for worker_id, worker in list(self._workers.items()):
+            if now - worker.last_seen > self._heartbeat_timeout:
+                logging.warning("Worker %s stopped sending heartbeats, removing it", worker_id)
+                del self._workers[worker_id]
+
+
+def choose_least_loaded(workers: [WorkerInfo]) -> [WorkerInfo]:
+    return sorted(workers, key=lambda worker: worker.utilization)
+
+
+def choose_power_of_two(workers: [WorkerInfo]) -> [WorkerInfo]:
+    """Picks the less loaded of two random workers, then falls back to the rest.
+
+    Sampling two keeps placements spread out when many coordinators, or a
+    burst between heartbeats, act on the same stale load numbers.
+    """
+    if len(workers) <= 2:
+        return choose_least_loaded(workers)
+    sampled = random.sample(workers, 2)
+    first = min(sampled, key=lambda worker: worker.utilization)
+    rest = choose_least_loaded([worker for worker in workers if worker is not first])
+    return [first] + rest
+
+
+STRATEGIES = {
+    PLACEMENT_LEAST_LOADED: choose_least_loaded,
+    PLACEMENT_POWER_OF_TWO: choose_power_of_two,
+}
+
+
+class Coordinator:
+    """Places agent jobs on workers.
+
+    Workers register through their heartbeats. POST /add_agent takes the
+    same body as a worker and forwards it to the worker the placement
+    strategy picks, trying the next candidate if that one turns it away.
+    POST /workers/{id}/drain stops new jobs going to a worker, which tells
+    the worker on its next heartbeat so it stops taking jobs of its own.
+    """
+
+    def __init__(self, strategy: str = PLACEMENT_STRATEGY, registry: Optional[WorkerRegistry] = None):
+        self.registry = registry or WorkerRegistry()
+        self._choose = STRATEGIES[strategy]
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._app_runner: Optional[aiohttp.web.AppRunner] = None
+        self.placements: dict[str, int] = {}
+
+        self.app = aiohttp.web.Application()
+        self.app.add_routes([aiohttp.web.post('/add_agent', self._add_agent),
+                             aiohttp.web.post('/workers/heartbeat', self._heartbeat),
+                             aiohttp.web.get('/workers', self._list_workers),
+                             aiohttp.web.post('/workers/{worker_id}/drain', self._drain)])
+        cors = aiohttp_cors.setup(self.app, defaults={"*": aiohttp_cors.ResourceOptions(
+            allow_credentials=True, expose_headers="*", allow_headers="*")})
+        for route in list(self.app.router.routes()):
+            cors.add(route)
+
+    async def start(self, host: str = '0.0.0.0', port: int = PORT):
+        self._session = aiohttp.ClientSession()
+        self._app_runner = aiohttp.web.AppRunner(self.app)
+        await self._app_runner.setup()
+        await aiohttp.web.TCPSite(self._app_runner, host=host, port=port).start()
+        logging.info("Coordinator listening on %s:%d", host, port)
+
+    async def stop(self):
+        if self._app_runner is not None:
+            await self._app_runner.cleanup()
+        if self._session is not None:
+            await self._session.close()
+
+    async def place(self, agent: str, room: str) -> tuple[Optional[dict], str]:
+        """Starts a job on the best worker that will take it, returns the job or why none would."""
+        candidates = self._choose(self.registry.available())
+        if not candidates:
+            return None, "no worker has capacity"
+
+        reason = ""
+        for worker in candidates:
+            try:
+                async with self._session.post(f"{worker.url}/add_agent", json={"agent": agent, "room": room},
+                                              timeout=aiohttp.ClientTimeout(total=FORWARD_TIMEOUT_SECONDS)) as resp:
+                    data = await resp.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                reason = f"worker {worker.id} unreachable: {e!r}"
+                continue
+
+            if data.get("success"):
+                worker.placed += 1
+                self.placements[worker.id] = self.placements.get(worker.id, 0) + 1
+                return {"worker": worker.id, **data["job"]}, ""
+            reason = data.get("error", "")
+        return None, reason
+
+    async def _add_agent(self, request: aiohttp.web.Request):
+        data = await request.json()
+        if data.get('agent') not in AGENT_CLASSES:
+            return aiohttp.web.json_response({'success': False, 'error': f"unknown agent {data.get('agent')}"},
+                                             status=400)
+        job, reason = await self.place(data['agent'], data.get('room') or DEFAULT_ROOM)
+        if job is None:
+            return aiohttp.web.json_response({'success': False, 'error': reason}, status=503)
+        return aiohttp.web.json_response({'success': True, 'job': job})
+
+    async def _heartbeat(self, request: aiohttp.web.Request):
+        worker = self.registry.heartbeat(await request.json())
+        return aiohttp.web.json_response({'drain': worker.draining})
+
+    async def _list_workers(self, request: aiohttp.web.Request):
+        return aiohttp.web.json_response({'workers': [worker.to_json() for worker in self.registry.workers()]})
+
+    async def _drain(self, request: aiohttp.web.Request):
+        worker = self.registry.get(request.match_info['worker_id'])
+        if worker is None:
+            raise aiohttp.web.HTTPNotFound()
+        worker.draining = True
+        return aiohttp.web.json_response(worker.to_json())
+
+
+async def main(args):
+    coordinator = Coordinator(strategy=args.strategy)
+    await coordinator.start(port=args.port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await coordinator.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--strategy", choices=list(STRATEGIES), default=PLACEMENT_STRATEGY)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,117 @@
+import asyncio
+import importlib
+import logging
+import os
+import time
+import uuid
+from collections.abc import Callable
+from dataclasses import asdict, dataclass, field
+from typing import Optional
+
+import aiohttp
+
+TOKEN_SERVICE_URL = os.environ.get("TOKEN_SERVICE_URL", "")
+LIVEKIT_WS_URL = os.environ.get("LIVEKIT_WS_URL", "wss://hackrtc-usisftuh.livekit.cloud")
+DEFAULT_ROOM = os.environ.get("LIVEKIT_ROOM", "hack-rtc2")
+# A room nobody else has been in for this long is done with its agent
+EMPTY_ROOM_TIMEOUT_SECONDS = 60
+ROOM_POLL_SECONDS = 1
+
+# Imported in the process that runs the job, so the server doesn't load livekit or models
+AGENT_CLASSES = {
+    "kitt": "agents.kitt.kitt:Kitt",
+    "transcription": "agents.transcription:Transcription",
+}
+
+JOB_STATUS_PENDING = "pending"
+JOB_STATUS_RUNNING = "running"
+JOB_STATUS_STOPPING = "stopping"
+JOB_STATUS_FINISHED = "finished"
+JOB_STATUS_FAILED = "failed"
+
+FINAL_STATUSES = {JOB_STATUS_FINISHED, JOB_STATUS_FAILED}
+
+
+@dataclass
+class Job:
+    agent: str
+    room: str
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = JOB_STATUS_PENDING
+    error: Optional[str] = None
+    created: float = field(default_factory=time.time)
+    finished: Optional[float] = None
+    # What the agent is processing, from its StreamManager.report()
+    streams: list[dict] = field(default_factory=list)
+
+    @property
+    def identity(self) -> str:
+        return f"{self.agent}-{self.id[0:8]}"
+
+    @property
+    def done(self) -> bool:
+        return self.status in FINAL_STATUSES
+
+    def to_json(self) -> dict:
+        return asdict(self)
+
+    @staticmethod
+    def from_json(data: dict) -> "Job":
+        return Job(**data)
+
+
+def agent_class(name: str):
+    module_name, class_name = AGENT_CLASSES[name].split(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+async def fetch_token(room: str, identity: str) -> tuple[str, str]:
+    """Asks the token service to let identity join room, returns the url and token to connect with."""
+    async with aiohttp.ClientSession() as session:
+        endpoint = f'{TOKEN_SERVICE_URL}/api/token'
+        async with session.get(endpoint, params={"identity": identity, "roomName": room}) as response:
+            response.raise_for_status()
+            json_response = await response.json()
+    return json_response.get("wsUrl", LIVEKIT_WS_URL), json_response['accessToken']
+
+
+async def run_job(job: Job, stop: asyncio.Event, on_update: Callable[[Job], None]):
+    """Joins the job's room as its agent and stays until told to stop, the
+    room disconnects or it has had nobody else in it for a while."""
+    import livekit
+
+    ws_url, token = await fetch_token(job.room, job.identity)
+    room = livekit.Room()
+    await room.connect(ws_url, token)
+    disconnected = asyncio.Event()
+    room.on("disconnected", lambda *_: disconnected.set())
+
+    try:
+        agent = agent_class(job.agent)(participant=room.local_participant, room=room)
+    except Exception:
+        await room.disconnect()
+        raise
+    job.status = JOB_STATUS_RUNNING
+    on_update(job)
+    logging.info("Job %s running %s in room %s", job.id, job.agent, job.room)
+    try:
+        empty_since = time.monotonic()
+        while not stop.is_set() and not disconnected.is_set():
+            streams = agent.streams.report()
+            if streams != job.streams:
+                job.streams = streams
+                on_update(job)
+            if len(room.participants) > 0:
+                empty_since = time.monotonic()
+            elif time.monotonic() - empty_since > EMPTY_ROOM_TIMEOUT_SECONDS:
+                logging.info("Job %s room %s is empty, leaving", job.id, job.room)
+                break
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=ROOM_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        job.status = JOB_STATUS_STOPPING
+        on_update(job)
+        await agent.cleanup()
+        job.streams = []
@@ -0,0 +1,74 @@
+import os
+import sys
+from dataclasses import asdict, dataclass
+
+DEFAULT_MAX_JOBS = int(os.environ.get("WORKER_MAX_JOBS", str(4 * (os.cpu_count() or 1))))
+DEFAULT_MAX_CPU_LOAD = float(os.environ.get("WORKER_MAX_CPU_LOAD", "0.85"))
+# Past this many waiting transcriptions, another caller would make everyone's transcripts late
+DEFAULT_MAX_QUEUE_DEPTH = int(os.environ.get("WORKER_MAX_QUEUE_DEPTH", "16"))
+DEFAULT_MAX_TRANSCRIBERS = int(os.environ.get("WORKER_MAX_TRANSCRIBERS", "32"))
+
+
+@dataclass
+class WorkerLoad:
+    jobs: int = 0
+    transcribers: int = 0
+    inference_queue_depth: int = 0
+    # One minute load average per core, 1.0 is every core busy
+    cpu: float = 0.0
+
+    def to_json(self) -> dict:
+        return asdict(self)
+
+    @staticmethod
+    def from_json(data: dict) -> "WorkerLoad":
+        return WorkerLoad(**data)
+
+    def __add__(self, other: "WorkerLoad") -> "WorkerLoad":
+        # Processes on one box share its cores, so CPU isn't summed
+        return WorkerLoad(jobs=self.jobs + other.jobs,
+                          transcribers=self.transcribers + other.transcribers,
+                          inference_queue_depth=self.inference_queue_depth + other.inference_queue_depth,
+                          cpu=max(self.cpu, other.cpu))
+
+
+def cpu_load() -> float:
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except OSError:
+        return 0.0
+
+
+def current_load(jobs: int) -> WorkerLoad:
+    """Load of this process, transcription numbers only count once it has imported the transcription service."""
+    transcription = sys.modules.get("services.transcription.transcriber")
+    return WorkerLoad(jobs=jobs,
+                      transcribers=transcription.active_transcribers() if transcription else 0,
+                      inference_queue_depth=transcription.inference_queue_depth() if transcription else 0,
+                      cpu=cpu_load())
+
+
+class AdmissionControl:
+    """Turns new jobs away once the worker is out of CPU or model capacity."""
+
+    def __init__(self,
+                 max_jobs: int = DEFAULT_MAX_JOBS,
+                 max_cpu_load: float = DEFAULT_MAX_CPU_LOAD,
+                 max_queue_depth: int = DEFAULT_MAX_QUEUE_DEPTH,
+                 max_transcribers: int = DEFAULT_MAX_TRANSCRIBERS):
+        self.max_jobs = max_jobs
+        self.max_cpu_load = max_cpu_load
+        self.max_queue_depth = max_queue_depth
+        self.max_transcribers = max_transcribers
+
+    def rejection(self, load: WorkerLoad) -> str:
+        """Why a new job can't be taken, an empty string if it can."""
+        if load.jobs >= self.max_jobs:
+            return f"at capacity, {load.jobs} jobs running"
+        if load.cpu >= self.max_cpu_load:
+            return f"cpu load {load.cpu:.2f} over {self.max_cpu_load:.2f}"
+        if load.inference_queue_depth >= self.max_queue_depth:
+            return f"{load.inference_queue_depth} transcriptions queued"
+        if load.transcribers >= self.max_transcribers:
+            return f"{load.transcribers} transcribers running"
+        return ""
@@ -0,0 +1,242 @@
+import asyncio
+import logging
+import multiprocessing
+import sys
+import threading
+import time
+from collections.abc import Awaitable, Callable
+from typing import Optional
+
+from services.metrics import registry
+
+from .jobs import (JOB_STATUS_FAILED, JOB_STATUS_FINISHED, JOB_STATUS_STOPPING, Job, run_job)
+from .load import WorkerLoad, cpu_load, current_load
+
+LOAD_REPORT_SECONDS = 1
+SHUTDOWN_TIMEOUT_SECONDS = 10
+
+
+class JobRunner:
+    """Runs agent jobs as tasks on this process' event loop."""
+
+    def __init__(self,
+                 on_update: Optional[Callable[[Job], None]] = None,
+                 run: Callable[[Job, asyncio.Event, Callable[[Job], None]], Awaitable[None]] = run_job):
+        self.on_update = on_update or (lambda job: None)
+        self._run_job = run
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._stops: dict[str, asyncio.Event] = {}
+        self.jobs: dict[str, Job] = {}
+
+    @property
+    def active(self) -> int:
+        return len(self._tasks)
+
+    def load(self) -> WorkerLoad:
+        return current_load(self.active)
+
+    def metric_snapshots(self) -> [dict]:
+        """Metrics recorded outside this process, the jobs here record into its own registry."""
+        return []
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        for job_id in list(self._tasks):
+            self.cancel(job_id)
+        if self._tasks:
+            await asyncio.wait(list(self._tasks.values()), timeout=SHUTDOWN_TIMEOUT_SECONDS)
+        # Only if a job loaded it, the server itself doesn't import transcription
+        transcription = sys.modules.get("services.transcription.transcriber")
+        if transcription is not None:
+            await asyncio.get_running_loop().run_in_executor(None, transcription.stop_backends)
+
+    def submit(self, job: Job):
+        self.jobs[job.id] = job
+        self._stops[job.id] = asyncio.Event()
+        self._tasks[job.id] = asyncio.create_task(self._run(job))
+
+    def cancel(self, job_id: str):
+        stop = self._stops.get(job_id)
+        if stop is not None and not stop.is_set():
+            self.jobs[job_id].status = JOB_STATUS_STOPPING
+            self.on_update(self.jobs[job_id])
+            stop.set()
+
+    async def _run(self, job: Job):
+        self.on_update(job)
+        try:
+            await self._run_job(job, self._stops[job.id], self.on_update)
+            job.status = JOB_STATUS_FINISHED
+        except Exception as e:
+            logging.exception("Job %s failed", job.id)
+            job.status = JOB_STATUS_FAILED
+            job.error = repr(e)
+        finally:
+            job.finished = time.time()
+            del self._tasks[job.id]
+            del self._stops[job.id]
+            self.on_update(job)
+
+
+def _process_main(index: int, commands: multiprocessing.Queue, events: multiprocessing.Queue):
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_process_loop(index, commands, events))
+
+
+async def _process_loop(index: int, commands: multiprocessing.Queue, events: multiprocessing.Queue):
+    loop = asyncio.get_running_loop()
+    runner = JobRunner(on_update=lambda job: events.put(("job", index, job.to_json())))
+    shutdown = asyncio.Event()
+
+    def handle(command: str, payload):
+        if command == "start":
+            runner.submit(Job.from_json(payload))
+        elif command == "stop":
+            runner.cancel(payload)
+        elif command == "shutdown":
+            shutdown.set()
+
+    def read_commands():
+        while True:
+            command, payload = commands.get()
+            loop.call_soon_threadsafe(handle, command, payload)
+            if command == "shutdown":
+                return
+
+    threading.Thread(target=read_commands, daemon=True).start()
+    while not shutdown.is_set():
+        events.put(("load", index, runner.load().to_json()))
+        events.put(("metrics", index, registry.snapshot()))
+        try:
+            await asyncio.wait_for(shutdown.wait(), timeout=LOAD_REPORT_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+    await runner.stop()
+
+
+class ProcessPoolRunner:
+    """Runs agent jobs across a pool of processes, each with its own event
+    loop, LiveKit connections and transcription backend.
+
+    A job goes to the process with the fewest jobs. Processes report their
+    load every LOAD_REPORT_SECONDS and send job updates as they happen. A
+    process that dies fails its jobs and is replaced.
+
+    Processes send a snapshot of their metrics with their load, so the
+    server can export the pool's metrics added up.
+    """
+
+    def __init__(self, num_processes: int, on_update: Optional[Callable[[Job], None]] = None):
+        self._context = multiprocessing.get_context("spawn")
+        self._num_processes = num_processes
+        self.on_update = on_update or (lambda job: None)
+        self._events = self._context.Queue()
+        self._commands: list[multiprocessing.Queue] = []
+        self._processes: list[multiprocessing.Process] = []
+        self._loads: list[WorkerLoad] = []
+        self._metrics: list[dict] = []
+        self._assignments: dict[str, int] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._monitor: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.jobs: dict[str, Job] = {}
+
+    @property
+    def active(self) -> int:
+        return len(self._assignments)
+
+    def load(self) -> WorkerLoad:
+        total = WorkerLoad(cpu=cpu_load())
+        for load in self._loads:
+            total = total + load
+        # Jobs sent to a process that hasn't reported them yet still count
+        total.jobs = max(total.jobs, self.active)
+        return total
+
+    def metric_snapshots(self) -> [dict]:
+        return list(self._metrics)
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        for index in range(self._num_processes):
+            self._commands.append(self._context.Queue())
+            self._processes.append(None)
+            self._loads.append(WorkerLoad())
+            self._metrics.append({})
+            self._spawn(index)
+        threading.Thread(target=self._receive_events, daemon=True).start()
+        self._monitor = asyncio.create_task(self._monitor_processes())
+
+    async def stop(self):
+        self._stopping = True
+        if self._monitor is not None:
+            self._monitor.cancel()
+        for commands in self._commands:
+            commands.put(("shutdown", None))
+        for process in self._processes:
+            await asyncio.get_running_loop().run_in_executor(None, process.join, SHUTDOWN_TIMEOUT_SECONDS)
+            if process.is_alive():
+                process.terminate()
+
+    def submit(self, job: Job):
+        index = min(range(self._num_processes), key=self._jobs_in_process)
+        self.jobs[job.id] = job
+        self._assignments[job.id] = index
+        self._commands[index].put(("start", job.to_json()))
+        self.on_update(job)
+
+    def cancel(self, job_id: str):
+        index = self._assignments.get(job_id)
+        if index is not None:
+            self.jobs[job_id].status = JOB_STATUS_STOPPING
+            self._commands[index].put(("stop", job_id))
+
+    def _jobs_in_process(self, index: int) -> int:
+        return sum(1 for assigned in self._assignments.values() if assigned == index)
+
+    def _spawn(self, index: int):
+        process = self._context.Process(target=_process_main,
+                                        args=(index, self._commands[index], self._events),
+                                        daemon=True)
+        process.start()
+        self._processes[index] = process
+
+    def _receive_events(self):
+        while True:
+            try:
+                event = self._events.get()
+            except (EOFError, OSError):
+                return
+            self._loop.call_soon_threadsafe(self._handle_event, *event)
+
+    def _handle_event(self, kind: str, index: int, payload: dict):
+        if kind == "load":
+            self._loads[index] = WorkerLoad.from_json(payload)
+        elif kind == "metrics":
+            self._metrics[index] = payload
+        elif kind == "job":
+            job = Job.from_json(payload)
+            self.jobs[job.id] = job
+            if job.done:
+                self._assignments.pop(job.id, None)
+            self.on_update(job)
+
+    async def _monitor_processes(self):
+        while True:
+            await asyncio.sleep(LOAD_REPORT_SECONDS)
+            for index, process in enumerate(self._processes):
+                if process.is_alive() or self._stopping:
+                    continue
+                logging.error("Worker process %d exited with %s, restarting it", index, process.exitcode)
+                for job_id, assigned in list(self._assignments.items()):
+                    if assigned == index:
+                        job = self.jobs[job_id]
+                        job.status = JOB_STATUS_FAILED
+                        job.error = f"worker process exited with {process.exitcode}"
+                        job.finished = time.time()
+                        del self._assignments[job_id]
+                        self.on_update(job)
+                self._loads[index] = WorkerLoad()
+                self._spawn(index)
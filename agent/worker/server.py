@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import os
+import uuid
+from collections import OrderedDict
+from typing import Optional, Union
+
+import aiohttp
+import aiohttp.web
+import aiohttp_cors
+
+from services.metrics import registry
+
+from .jobs import AGENT_CLASSES, DEFAULT_ROOM, Job
+from .load import AdmissionControl
+from .runner import JobRunner, ProcessPoolRunner
+
+PORT = int(os.environ.get("WORKER_PORT", "8000"))
+COORDINATOR_URL = os.environ.get("COORDINATOR_URL", "")
+HEARTBEAT_SECONDS = 2
+# Finished jobs are kept around so their outcome can still be looked up
+FINISHED_JOBS_KEPT = 200
+
+
+class WorkerServer:
+    """Takes agent jobs over HTTP and runs them.
+
+    POST /add_agent {"agent": "kitt", "room": "..."} starts a job if
+    admission control lets it in, and answers 503 with the reason if not.
+    GET /jobs and GET /jobs/{id} report jobs, DELETE /jobs/{id} stops one,
+    GET /health reports the worker's load and whether it takes new jobs.
+    GET /metrics exports the metrics of the server and its job processes
+    for Prometheus to scrape.
+    POST /drain stops it taking new jobs and lets the running ones finish.
+
+    Given a coordinator_url, the worker registers with the coordinator and
+    sends it the same health report every HEARTBEAT_SECONDS.
+    """
+
+    def __init__(self,
+                 runner: Union[JobRunner, ProcessPoolRunner],
+                 admission: Optional[AdmissionControl] = None,
+                 coordinator_url: str = COORDINATOR_URL,
+                 advertise_url: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self._runner = runner
+        self._admission = admission or AdmissionControl()
+        self._jobs: OrderedDict[str, Job] = OrderedDict()
+        self._app_runner: Optional[aiohttp.web.AppRunner] = None
+        self._coordinator_url = coordinator_url.rstrip("/")
+        self._advertise_url = advertise_url
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._draining = False
+        runner.on_update = self._on_job_update
+
+        self.app = aiohttp.web.Application()
+        self.app.add_routes([aiohttp.web.post('/add_agent', self._add_agent),
+                             aiohttp.web.get('/jobs', self._list_jobs),
+                             aiohttp.web.get('/jobs/{job_id}', self._get_job),
+                             aiohttp.web.delete('/jobs/{job_id}', self._stop_job),
+                             aiohttp.web.get('/health', self._health),
+                             aiohttp.web.get('/metrics', self._metrics),
+                             aiohttp.web.post('/drain', self._drain)])
+        cors = aiohttp_cors.setup(self.app, defaults={"*": aiohttp_cors.ResourceOptions(
+            allow_credentials=True, expose_headers="*", allow_headers="*")})
+        for route in list(self.app.router.routes()):
+            cors.add(route)
+
+    async def start(self, host: str = '0.0.0.0', port: int = PORT):
+        await self._runner.start()
+        self._app_runner = aiohttp.web.AppRunner(self.app)
+        await self._app_runner.setup()
+        await aiohttp.web.TCPSite(self._app_runner, host=host, port=port).start()
+        logging.info("Worker listening on %s:%d", host, port)
+        if self._coordinator_url:
+            self._advertise_url = self._advertise_url or f"http://{os.uname().nodename}:{port}"
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    async def stop(self):
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+        if self._app_runner is not None:
+            await self._app_runner.cleanup()
+        await self._runner.stop()
+
+    def submit(self, agent: str, room: str = DEFAULT_ROOM) -> tuple[Optional[Job], str]:
+        """Starts a job unless the worker is too busy, returns it or why it was turned away."""
+        if agent not in AGENT_CLASSES:
+            raise ValueError(f"unknown agent {agent}")
+        rejection = "draining" if self._draining else self._admission.rejection(self._runner.load())
+        if rejection:
+            return None, rejection
+
+        job = Job(agent=agent, room=room)
+        self._jobs[job.id] = job
+        self._runner.submit(job)
+        return job, ""
+
+    def _on_job_update(self, job: Job):
+        self._jobs[job.id] = job
+        finished = [job_id for job_id, j in self._jobs.items() if j.done]
+        for job_id in finished[0:max(0, len(finished) - FINISHED_JOBS_KEPT)]:
+            del self._jobs[job_id]
+
+    def drain(self):
+        if not self._draining:
+            logging.info("Draining, %d jobs left to finish", self._runner.active)
+        self._draining = True
+
+    def health(self) -> dict:
+        load = self._runner.load()
+        if self._draining:
+            status, reason = ("drained" if load.jobs == 0 else "draining"), "draining"
+        else:
+            reason = self._admission.rejection(load)
+            status = "overloaded" if reason else "ok"
+        return {"id": self.id,
+                "url": self._advertise_url,
+                "status": status,
+                "reason": reason,
+                "load": load.to_json(),
+                "max_jobs": self._admission.max_jobs,
+                "max_cpu_load": self._admission.max_cpu_load,
+                "max_queue_depth": self._admission.max_queue_depth,
+                "max_transcribers": self._admission.max_transcribers}
+
+    async def _heartbeat(self):
+        async with aiohttp.ClientSession() as session:
+            while True:
+                try:
+                    async with session.post(f"{self._coordinator_url}/workers/heartbeat", json=self.health(),
+                                            timeout=aiohttp.ClientTimeout(total=HEARTBEAT_SECONDS)) as resp:
+                        if (await resp.json()).get("drain"):
+                            self.drain()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    logging.warning("Heartbeat to coordinator failed: %r", e)
+                await asyncio.sleep(HEARTBEAT_SECONDS)
+
+    async def _add_agent(self, request: aiohttp.web.Request):
+        data = await request.json()
+        try:
+            job, rejection = self.submit(data['agent'], data.get('room') or DEFAULT_ROOM)
+        except (KeyError, ValueError) as e:
+            return aiohttp.web.json_response({'success': False, 'error': str(e)}, status=400)
+        if job is None:
+            return aiohttp.web.json_response({'success': False, 'error': rejection}, status=503)
+        return aiohttp.web.json_response({'success': True, 'job': job.to_json()})
+
+    async def _list_jobs(self, request: aiohttp.web.Request):
+        return aiohttp.web.json_response({'jobs': [job.to_json() for job in self._jobs.values()]})
+
+    async def _get_job(self, request: aiohttp.web.Request):
+        job = self._jobs.get(request.match_info['job_id'])
+        if job is None:
+            raise aiohttp.web.HTTPNotFound()
+        return aiohttp.web.json_response(job.to_json())
+
+    async def _stop_job(self, request: aiohttp.web.Request):
+        job_id = request.match_info['job_id']
+        if job_id not in self._jobs:
+            raise aiohttp.web.HTTPNotFound()
+        self._runner.cancel(job_id)
+        return aiohttp.web.json_response({'success': True})
+
+    async def _health(self, request: aiohttp.web.Request):
+        return aiohttp.web.json_response(self.health())
+
+    async def _metrics(self, request: aiohttp.web.Request):
+        text = registry.merged(self._runner.metric_snapshots()).expose()
+        return aiohttp.web.Response(text=text, headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    async def _drain(self, request: aiohttp.web.Request):
+        self.drain()
+        return aiohttp.web.json_response(self.health())
@@ -1,9 +1,10 @@
-import { useCallback, useEffect, useRef, useState } from "react";
+import { useCallback, useEffect, useMemo, useRef, useState } from "react";
 import { ConnectionDetails } from "./api/connection_details";
-import { LiveKitRoom, ParticipantLoop, RoomAudioRenderer, TrackToggle, VideoConference, useLocalParticipant, useMediaTrack, useParticipantContext, useParticipantInfo, useRemoteParticipants } from "@livekit/components-react";
+import { LiveKitRoom, ParticipantLoop, RoomAudioRenderer, TrackToggle, VideoConference, useLocalParticipant, useMediaTrack, useParticipantContext, useParticipantInfo, useRemoteParticipants, useRoomContext } from "@livekit/components-react";
 import "@livekit/components-styles";
 import axios from "axios";
-import { DataPacket_Kind, Track } from "livekit-client";
+import { DataPacket_Kind, RemoteParticipant, RoomEvent, Track } from "livekit-client";
+import { TranscriptDecoder, TranscriptLine } from "../utils/transcripts";
 
 export default function Page() {
   const [connectionDetails, setConnectionDetails] =
@@ -28,6 +29,7 @@ export default function Page() {
       <div className="flex-col p-0">
         {/* <DataSender /> */}
         <Kitt />
+        <Transcripts />
       </div>
       <RoomAudioRenderer />
     </LiveKitRoom>
@@ -67,3 +69,31 @@ function Agent() {
     </div>
   )
 }
+
+function Transcripts() {
+  const room = useRoomContext();
+  const decoder = useMemo(() => new TranscriptDecoder(), []);
+  const [lines, setLines] = useState<TranscriptLine[]>([]);
+
+  useEffect(() => {
+    const onData = (payload: Uint8Array, sender?: RemoteParticipant) => {
+      if (sender && decoder.apply(payload, sender.identity)) {
+        setLines(decoder.transcript());
+      }
+    };
+    room.on(RoomEvent.DataReceived, onData);
+    return () => {
+      room.off(RoomEvent.DataReceived, onData);
+    };
+  }, [room, decoder]);
+
+  return (
+    <div className="flex flex-col">
+      {lines.map((line) => (
+        <div key={`${line.sender}/${line.sid}/${line.id}`} className={line.final ? "" : "opacity-60"}>
+          {line.participant} ({line.sender}): {line.text}
+        </div>
+      ))}
+    </div>
+  )
+}
@@ -0,0 +1,69 @@
+/** A participant's monologue as far as it has been transcribed. */
+export type TranscriptLine = {
+  // The agent that transcribed it, each agent numbers monologues its own way
+  sender: string
+  // Tells participants apart, identities can repeat
+  sid: string
+  // Only for showing
+  participant: string
+  id: number
+  rev: number
+  text: string
+  final: boolean
+}
+
+// [participant sid, participant name, monologue id, rev, base, keep, text], see agent/agents/transcripts.py
+type Update = [string, string, number, number, number, number, string]
+
+const MESSAGE_TYPE = 'transcript'
+const MESSAGE_VERSION = 2
+const MAX_LINES = 50
+
+const decoder = new TextDecoder()
+
+/** Rebuilds transcripts from the agent's delta encoded data packets. */
+export class TranscriptDecoder {
+  private lines = new Map<string, TranscriptLine>()
+
+  /** Applies a data packet from sender, returns whether any transcript changed. */
+  apply(payload: Uint8Array, sender: string): boolean {
+    let message
+    try {
+      message = JSON.parse(decoder.decode(payload))
+    } catch {
+      return false
+    }
+    if (message?.t !== MESSAGE_TYPE || message.v !== MESSAGE_VERSION) {
+      return false
+    }
+
+    let changed = false
+    const final = message.f === 1
+    message.u.forEach(([sid, participant, id, rev, base, keep, text]: Update) => {
+      const key = `${sender}/${sid}/${id}`
+      const line = this.lines.get(key)
+      // Partials are lossy, one can arrive after its final or after a newer one
+      if (line && (line.final || (!final && line.rev >= rev))) {
+        return
+      }
+      if (base === 0) {
+        this.lines.set(key, { sender, sid, participant, id, rev, text, final })
+      } else if (line && line.rev === base) {
+        this.lines.set(key, { sender, sid, participant, id, rev, text: line.text.slice(0, keep) + text, final })
+      } else {
+        // The delta's base was lost, wait for the next whole partial or the final
+        return
+      }
+      changed = true
+    })
+
+    while (this.lines.size > MAX_LINES) {
+      this.lines.delete(this.lines.keys().next().value)
+    }
+    return changed
+  }
+
+  transcript(): TranscriptLine[] {
+    return Array.from(this.lines.values())
+  }
+}